@@ -0,0 +1,218 @@
+import asyncio
+import datetime
+from collections import namedtuple
+import numpy as np
+from models import db, QuizAttempt, UserAnswer
+from database import run_read
+from archive import archive
+
+# Rows fetched from SQLite per round trip when bulk-loading answers
+LOAD_CHUNK_SIZE = 100_000
+# Attempts finished this recently are left for the next refresh, so an
+# attempt whose transaction commits after the read is not skipped
+FINISH_LAG = datetime.timedelta(seconds=5)
+# Stored in selected_option for answers that timed out
+NO_ANSWER = -1
+# Answers a question needs before it is ranked by /question_stats
+MIN_ANSWERS = 20
+
+# Column arrays of answers from completed attempts
+AnswerArrays = namedtuple("AnswerArrays", ["question_id", "selected_option", "is_correct", "score"])
+
+
+def empty_answer_arrays():
+    return AnswerArrays(
+        np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int8), np.zeros(0, np.int64)
+    )
+
+
+def load_answer_arrays(finished_after=None, finished_until=None):
+    """Bulk-load the answers of attempts finished in a time window (runs on a reader thread).
+
+    Incomplete attempts have no score to discriminate against and are left
+    out. Rows are fetched in chunks straight from the cursor, without
+    building model instances.
+    """
+    query = (
+        UserAnswer
+        .select(
+            UserAnswer.question_id,
+            UserAnswer.selected_option,
+            UserAnswer.is_correct,
+            QuizAttempt.score,
+        )
+        .join(QuizAttempt)
+        .where(QuizAttempt.end_time.is_null(False))
+    )
+    if finished_after is not None:
+        query = query.where(QuizAttempt.end_time > finished_after)
+    if finished_until is not None:
+        query = query.where(QuizAttempt.end_time <= finished_until)
+
+    sql, params = query.sql()
+    cursor = db.execute_sql(sql, params)
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(LOAD_CHUNK_SIZE)
+        if not rows:
+            break
+        # NULL becomes NaN in a float array, mapped to NO_ANSWER / incorrect below
+        chunks.append(np.array(rows, dtype=np.float64))
+    if not chunks:
+        return empty_answer_arrays()
+
+    table = np.concatenate(chunks)
+    return AnswerArrays(
+        table[:, 0].astype(np.int64),
+        np.nan_to_num(table[:, 1], nan=NO_ANSWER).astype(np.int64),
+        np.nan_to_num(table[:, 2], nan=0).astype(np.int8),
+        table[:, 3].astype(np.int64),
+    )
+
+
+class ItemStatistics:
+    """Per-question item analysis over any number of answer batches.
+
+    Only additive sums are kept per question (indexed by question id), so
+    adding a batch is a handful of ``np.bincount`` calls and the results are
+    derived from the sums on demand:
+
+    - difficulty: share of correct answers (classical p-value)
+    - discrimination: point-biserial correlation between answering the
+      question correctly and the score of the attempt
+    - option_counts: how often each option was picked, column 0 counting
+      timed-out answers
+    """
+
+    def __init__(self):
+        self.answers = 0
+        self._n = np.zeros(0)
+        self._correct = np.zeros(0)
+        self._score = np.zeros(0)
+        self._score_sq = np.zeros(0)
+        self._score_correct = np.zeros(0)
+        self._options = np.zeros((0, 1), np.int64)
+
+    def add(self, answers):
+        """Accumulate an AnswerArrays batch"""
+        if len(answers.question_id) == 0:
+            return
+        question_id = answers.question_id
+        size = max(len(self._n), int(question_id.max()) + 1)
+        slots = max(self._options.shape[1], int(answers.selected_option.max()) + 2)
+        self._grow(size, slots)
+
+        correct = answers.is_correct.astype(np.float64)
+        score = answers.score.astype(np.float64)
+        self._n += np.bincount(question_id, minlength=size)
+        self._correct += np.bincount(question_id, weights=correct, minlength=size)
+        self._score += np.bincount(question_id, weights=score, minlength=size)
+        self._score_sq += np.bincount(question_id, weights=score * score, minlength=size)
+        self._score_correct += np.bincount(question_id, weights=score * correct, minlength=size)
+        # One flat bincount over (question, option) cells
+        cells = question_id * slots + (answers.selected_option - NO_ANSWER)
+        self._options += np.bincount(cells, minlength=size * slots).reshape(size, slots)
+        self.answers += len(question_id)
+
+    def _grow(self, size, slots):
+        grow = size - len(self._n)
+        if grow > 0:
+            self._n, self._correct, self._score, self._score_sq, self._score_correct = (
+                np.concatenate([column, np.zeros(grow)])
+                for column in (self._n, self._correct, self._score, self._score_sq, self._score_correct)
+            )
+        rows, columns = self._options.shape
+        if size > rows or slots > columns:
+            self._options = np.pad(self._options, ((0, size - rows), (0, slots - columns)))
+
+    @property
+    def question_ids(self):
+        """Ids of every question with at least one answer"""
+        return np.flatnonzero(self._n)
+
+    @property
+    def answered(self):
+        return self._n
+
+    @property
+    def difficulty(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self._correct / self._n
+
+    @property
+    def discrimination(self):
+        """Point-biserial correlation, NaN where it is undefined"""
+        n = self._n
+        correct = self._correct
+        wrong = n - correct
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self._score / n
+            std = np.sqrt(np.maximum(self._score_sq / n - mean * mean, 0))
+            mean_correct = self._score_correct / correct
+            mean_wrong = (self._score - self._score_correct) / wrong
+            p = correct / n
+            return (mean_correct - mean_wrong) / std * np.sqrt(p * (1 - p))
+
+    @property
+    def option_counts(self):
+        return self._options
+
+    def lowest(self, values, count, min_answers=MIN_ANSWERS):
+        """Ids of the ``count`` questions with the lowest ``values`` among those answered enough"""
+        candidates = np.flatnonzero((self._n >= min_answers) & ~np.isnan(values))
+        return candidates[np.argsort(values[candidates], kind="stable")[:count]].tolist()
+
+    def question(self, question_id):
+        """Return (answered, difficulty, discrimination, option counts) of one question, or None"""
+        if question_id < 0 or question_id >= len(self._n) or self._n[question_id] == 0:
+            return None
+        return (
+            int(self._n[question_id]),
+            float(self.difficulty[question_id]),
+            float(self.discrimination[question_id]),
+            self._options[question_id].tolist(),
+        )
+
+
+class ItemAnalysis:
+    """Keep ItemStatistics current with incremental refreshes.
+
+    Each refresh only loads the answers of attempts finished since the
+    previous one; ``full`` starts over from every attempt in the database
+    and in the archive. Attempts archived after they were counted stay in
+    the running sums.
+    """
+
+    def __init__(self):
+        self.statistics = ItemStatistics()
+        self.finished_until = None
+        self.last_refresh = None
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, full=False):
+        """Load newly finished attempts and return the number of answers added"""
+        async with self._lock:
+            if full:
+                self.statistics = ItemStatistics()
+                self.finished_until = None
+            added = 0
+            if self.finished_until is None:
+                added += await asyncio.to_thread(self._add_archive)
+            until = datetime.datetime.now() - FINISH_LAG
+            answers = await run_read(load_answer_arrays, self.finished_until, until)
+            await asyncio.to_thread(self.statistics.add, answers)
+            self.finished_until = until
+            self.last_refresh = datetime.datetime.now()
+            return added + len(answers.question_id)
+
+    def _add_archive(self):
+        """Stream every archived answer into the statistics, one block at a time"""
+        added = 0
+        for batch in archive.answer_batches():
+            answers = AnswerArrays(*batch)
+            self.statistics.add(answers)
+            added += len(answers.question_id)
+        return added
+
+
+item_analysis = ItemAnalysis()
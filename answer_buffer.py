@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from peewee import IntegrityError, chunked
+from models import db, UserAnswer
+from database import run_write
+from rollups import record_answers
+
+# Flush as soon as this many answers are waiting
+FLUSH_SIZE = 200
+# Flush at least this often (seconds) while answers are waiting
+FLUSH_INTERVAL = 0.5
+# Producers wait once this many answers are buffered
+MAX_PENDING = 5000
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerBuffer:
+    """Collect UserAnswer rows in memory and write them in group commits.
+
+    Answers are flushed with a single insert_many per transaction when the
+    buffer reaches FLUSH_SIZE, every FLUSH_INTERVAL seconds, or when a caller
+    asks for an explicit flush (end of quiz, shutdown). Once MAX_PENDING rows
+    are waiting, add() blocks until a flush frees up space.
+    """
+
+    def __init__(self, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._flush_lock = asyncio.Lock()
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        """Start the background flusher"""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the background flusher and write everything still buffered"""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def add(self, quiz_attempt_id, question_id, selected_option, is_correct, answer_time):
+        """Queue an answer for the next group commit"""
+        while len(self._pending) >= self.max_pending:
+            self._has_space.clear()
+            self._wakeup.set()
+            await self._has_space.wait()
+
+        self._pending.append({
+            "quiz_attempt": quiz_attempt_id,
+            "question_id": question_id,
+            "selected_option": selected_option,
+            "is_correct": is_correct,
+            "answer_time": answer_time,
+        })
+        if len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Write every buffered answer in one transaction"""
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            try:
+                if batch:
+                    rejected = await run_write(_insert_answers, batch)
+                    if rejected:
+                        # Retrying them would fail again and hold back every later answer
+                        logger.warning("Dropped %d answers that violate a constraint, e.g. %r",
+                                       len(rejected), rejected[0])
+            except Exception:
+                # Put the rows back so the next flush retries them
+                self._pending[:0] = batch
+                raise
+            finally:
+                if len(self._pending) < self.max_pending:
+                    self._has_space.set()
+            return len(batch)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush %d buffered answers", len(self._pending))
+
+
+def _insert_answers(rows):
+    """Insert a batch of answers and return the rows rejected by a constraint (runs on the writer thread).
+
+    A failing batch is retried one row at a time, so a single bad row, e.g.
+    of an attempt deleted by a cleanup, doesn't block the others.
+    """
+    try:
+        with db.atomic():
+            # Keep each statement well below SQLite's bound-parameter limit
+            for chunk in chunked(rows, 100):
+                UserAnswer.insert_many(chunk).execute()
+    except IntegrityError:
+        inserted, rejected = [], []
+        for row in rows:
+            try:
+                with db.atomic():
+                    UserAnswer.insert(row).execute()
+            except IntegrityError:
+                rejected.append(row)
+            else:
+                inserted.append(row)
+        rows = inserted
+    else:
+        rejected = []
+    record_answers(rows)
+    return rejected
+
+
+answer_buffer = AnswerBuffer()
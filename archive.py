@@ -0,0 +1,341 @@
+import asyncio
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+from peewee import chunked, fn
+from models import db, User, QuizAttempt, UserAnswer
+from database import run_read, run_write
+import cleanup
+
+# Directory holding the segment files, relative to the working directory
+ARCHIVE_DIR = "archive"
+# Quiz attempts moved per segment file
+SEGMENT_ATTEMPTS = 50_000
+# Rows per compressed column block; a scan holds one block per column in memory
+BLOCK_ROWS = 65_536
+COMPRESSION_LEVEL = 6
+# Attempts deleted from SQLite per transaction once their segment is written
+DELETE_CHUNK_SIZE = cleanup.CHUNK_SIZE
+
+SEGMENT_SUFFIX = ".seg"
+PARTIAL_SUFFIX = ".seg.tmp"
+MAGIC = b"GQARCH01"
+_FOOTER_LENGTH = struct.Struct("<Q")
+_UNIX_EPOCH_JULIAN_DAY = 2440587.5
+
+# Column layouts. Times are the stored (naive, local) timestamps as seconds
+# since 1970-01-01 with NaN for NULL; a NULL selected option or correctness
+# is stored as -1.
+ATTEMPT_COLUMNS = (
+    ("id", "<i8"),
+    ("user_id", "<i8"),  # Telegram id
+    ("start_time", "<f8"),
+    ("end_time", "<f8"),
+    ("score", "<i4"),
+    ("total_questions", "<i4"),
+)
+ANSWER_COLUMNS = (
+    ("quiz_attempt", "<i8"),
+    ("question_id", "<i4"),
+    ("selected_option", "<i1"),
+    ("is_correct", "<i1"),
+    ("answer_time", "<f8"),
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _unix_time(field):
+    return (fn.julianday(field) - _UNIX_EPOCH_JULIAN_DAY) * 86400
+
+
+def _fetch_columns(query, columns):
+    """Run a query on the raw cursor and return its rows as one array per column"""
+    sql, params = query.sql()
+    rows = db.execute_sql(sql, params).fetchall()
+    table = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns))
+    result = {}
+    for index, (name, dtype) in enumerate(columns):
+        column = table[:, index]
+        if np.dtype(dtype).kind == "i":
+            column = np.nan_to_num(column, nan=-1)
+        result[name] = column.astype(dtype)
+    return result
+
+
+def load_archive_rows(cutoff_date, after_id, limit):
+    """Read the next batch of aged attempts and their answers (runs on a reader thread).
+
+    Returns {"attempts": columns, "answers": columns}, or None when no aged
+    attempt is left after ``after_id``.
+    """
+    attempts = _fetch_columns(
+        QuizAttempt
+        .select(
+            QuizAttempt.id,
+            User.user_id,
+            _unix_time(QuizAttempt.start_time),
+            _unix_time(QuizAttempt.end_time),
+            QuizAttempt.score,
+            QuizAttempt.total_questions,
+        )
+        .join(User)
+        .where(cleanup.attempts_condition(cleanup.OLD_QUIZZES, cutoff_date) & (QuizAttempt.id > after_id))
+        .order_by(QuizAttempt.id)
+        .limit(limit),
+        ATTEMPT_COLUMNS,
+    )
+    if len(attempts["id"]) == 0:
+        return None
+
+    answer_chunks = [
+        _fetch_columns(
+            UserAnswer
+            .select(
+                UserAnswer.quiz_attempt,
+                UserAnswer.question_id,
+                UserAnswer.selected_option,
+                UserAnswer.is_correct,
+                _unix_time(UserAnswer.answer_time),
+            )
+            .where(UserAnswer.quiz_attempt.in_(attempt_ids))
+            .order_by(UserAnswer.id),
+            ANSWER_COLUMNS,
+        )
+        for attempt_ids in chunked(attempts["id"].tolist(), 500)
+    ]
+    answers = {name: np.concatenate([chunk[name] for chunk in answer_chunks]) for name, _ in ANSWER_COLUMNS}
+    return {"attempts": attempts, "answers": answers}
+
+
+def delete_attempt_ids(attempt_ids):
+    """Delete archived attempts and their answers (runs on the writer thread)"""
+    answers = UserAnswer.delete().where(UserAnswer.quiz_attempt.in_(attempt_ids)).execute()
+    quizzes = QuizAttempt.delete().where(QuizAttempt.id.in_(attempt_ids)).execute()
+    return quizzes, answers
+
+
+def write_segment(path, tables):
+    """Write tables of column arrays as one segment file and fsync it.
+
+    Layout: MAGIC, then every compressed column block, then a JSON footer
+    with the dtype and byte range of each block, then the footer length.
+    """
+    layouts = {"attempts": ATTEMPT_COLUMNS, "answers": ANSWER_COLUMNS}
+    footer = {"tables": {}}
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        for table, columns in tables.items():
+            layout = layouts[table]
+            rows = len(columns[layout[0][0]])
+            blocks = []
+            raw_bytes = 0
+            for start in range(0, rows, BLOCK_ROWS):
+                block = {"rows": min(BLOCK_ROWS, rows - start), "columns": {}}
+                for name, dtype in layout:
+                    raw = np.ascontiguousarray(columns[name][start:start + BLOCK_ROWS], dtype=dtype).tobytes()
+                    data = zlib.compress(raw, COMPRESSION_LEVEL)
+                    block["columns"][name] = [f.tell(), len(data)]
+                    raw_bytes += len(raw)
+                    f.write(data)
+                blocks.append(block)
+            footer["tables"][table] = {
+                "rows": rows,
+                "raw_bytes": raw_bytes,
+                "dtypes": dict(layout),
+                "blocks": blocks,
+            }
+        encoded = json.dumps(footer).encode()
+        f.write(encoded)
+        f.write(_FOOTER_LENGTH.pack(len(encoded)))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class Segment:
+    """Read-only, memory-mapped view of one segment file.
+
+    Only the footer is parsed on open; column blocks are decompressed from
+    the mapping one at a time while scanning.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._map[:len(MAGIC)] != MAGIC or len(self._map) < len(MAGIC) + _FOOTER_LENGTH.size:
+                raise ValueError(f"{path} is not an archive segment")
+            (length,) = _FOOTER_LENGTH.unpack_from(self._map, len(self._map) - _FOOTER_LENGTH.size)
+            end = len(self._map) - _FOOTER_LENGTH.size
+            self.footer = json.loads(self._map[end - length:end])
+        except Exception:
+            self._map.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    @property
+    def size(self):
+        return len(self._map)
+
+    def rows(self, table):
+        return self.footer["tables"][table]["rows"]
+
+    def raw_bytes(self, table):
+        return self.footer["tables"][table]["raw_bytes"]
+
+    def blocks(self, table, columns=None):
+        """Yield {column: array} for each block of a table"""
+        spec = self.footer["tables"][table]
+        names = columns or list(spec["dtypes"])
+        for block in spec["blocks"]:
+            arrays = {}
+            for name in names:
+                offset, length = block["columns"][name]
+                arrays[name] = np.frombuffer(zlib.decompress(self._map[offset:offset + length]), spec["dtypes"][name])
+            yield arrays
+
+    def column(self, table, name):
+        """One whole column; meant for the attempts table, ten times smaller than the answers"""
+        chunks = [block[name] for block in self.blocks(table, [name])]
+        return np.concatenate(chunks) if chunks else np.zeros(0, self.footer["tables"][table]["dtypes"][name])
+
+
+class Archive:
+    """Append-only columnar storage for aged quiz attempts and answers.
+
+    Moving a batch writes a new segment file first and only then deletes the
+    rows from SQLite. Until the deletes are done the file keeps a
+    PARTIAL_SUFFIX; ``recover`` finishes or discards such files after a crash,
+    so rows are never lost or archived twice.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, segment_attempts=SEGMENT_ATTEMPTS):
+        self.directory = directory
+        self.segment_attempts = segment_attempts
+        self._lock = asyncio.Lock()
+
+    def segment_paths(self):
+        return sorted(glob.glob(os.path.join(self.directory, "*" + SEGMENT_SUFFIX)))
+
+    def segments(self):
+        """Yield every complete segment, each closed once the caller moves on"""
+        for path in self.segment_paths():
+            with Segment(path) as segment:
+                yield segment
+
+    def summary(self):
+        """Return (segments, attempts, answers, bytes on disk, uncompressed bytes)"""
+        count = attempts = answers = size = raw = 0
+        for segment in self.segments():
+            count += 1
+            attempts += segment.rows("attempts")
+            answers += segment.rows("answers")
+            size += segment.size
+            raw += segment.raw_bytes("attempts") + segment.raw_bytes("answers")
+        return count, attempts, answers, size, raw
+
+    def answer_batches(self):
+        """Yield (question_id, selected_option, is_correct, score) arrays of completed attempts, block by block"""
+        for segment in self.segments():
+            attempt_ids = segment.column("attempts", "id")
+            completed = ~np.isnan(segment.column("attempts", "end_time"))
+            scores = segment.column("attempts", "score")
+            for block in segment.blocks("answers", ["quiz_attempt", "question_id", "selected_option", "is_correct"]):
+                # Attempt ids are sorted, so each answer finds its attempt by binary search
+                attempt = np.searchsorted(attempt_ids, block["quiz_attempt"])
+                keep = completed[attempt]
+                yield (
+                    block["question_id"][keep].astype(np.int64),
+                    block["selected_option"][keep].astype(np.int64),
+                    (block["is_correct"][keep] == 1).astype(np.int8),
+                    scores[attempt[keep]].astype(np.int64),
+                )
+
+    def question_breakdown(self, user_id):
+        """Return (question_id, answered, correct) over a Telegram user's archived answers"""
+        answered = np.zeros(0, np.int64)
+        correct = np.zeros(0, np.int64)
+        for segment in self.segments():
+            user_attempts = segment.column("attempts", "id")[segment.column("attempts", "user_id") == user_id]
+            if len(user_attempts) == 0:
+                continue
+            for block in segment.blocks("answers", ["quiz_attempt", "question_id", "is_correct"]):
+                mine = np.isin(block["quiz_attempt"], user_attempts)
+                if not mine.any():
+                    continue
+                question_id = block["question_id"][mine]
+                size = max(len(answered), int(question_id.max()) + 1)
+                answered = np.pad(answered, (0, size - len(answered))) + np.bincount(question_id, minlength=size)
+                correct = np.pad(correct, (0, size - len(correct))) + np.bincount(
+                    question_id, weights=block["is_correct"][mine] == 1, minlength=size
+                ).astype(np.int64)
+        return [
+            (question_id, int(answered[question_id]), int(correct[question_id]))
+            for question_id in np.flatnonzero(answered).tolist()
+        ]
+
+    async def archive_attempts(self, cutoff_date, progress=None):
+        """Move attempts started before the cutoff date, with their answers, into new segments.
+
+        ``progress`` is called like the cleanup progress callbacks and the
+        moved rows are returned as a CleanupResult.
+        """
+        async with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            await self._recover()
+            result = cleanup.CleanupResult()
+            after_id = 0
+            while True:
+                tables = await run_read(load_archive_rows, cutoff_date, after_id, self.segment_attempts)
+                if tables is None:
+                    return result
+                attempt_ids = tables["attempts"]["id"]
+                after_id = int(attempt_ids[-1])
+                path = os.path.join(self.directory, f"{int(attempt_ids[0]):012d}-{after_id:012d}{PARTIAL_SUFFIX}")
+                await asyncio.to_thread(write_segment, path, tables)
+                await self._finish(path, attempt_ids.tolist(), result, progress)
+
+    async def recover(self):
+        """Complete or discard segments left behind by an interrupted run"""
+        async with self._lock:
+            await self._recover()
+
+    async def _recover(self):
+        for path in glob.glob(os.path.join(self.directory, "*" + PARTIAL_SUFFIX)):
+            try:
+                with Segment(path) as segment:
+                    attempt_ids = segment.column("attempts", "id").tolist()
+            except Exception:
+                # Crashed while writing: nothing was deleted yet
+                logger.warning("Discarding incomplete archive segment %s", path)
+                os.remove(path)
+                continue
+            logger.info("Finishing interrupted archive segment %s", path)
+            await self._finish(path, attempt_ids)
+
+    async def _finish(self, path, attempt_ids, result=None, progress=None):
+        """Delete the rows of a written segment from SQLite, then publish the segment"""
+        for chunk in chunked(attempt_ids, DELETE_CHUNK_SIZE):
+            quizzes, answers = await run_write(delete_attempt_ids, chunk)
+            if result is not None:
+                result.add(0, quizzes, answers)
+        os.replace(path, path[:-len(PARTIAL_SUFFIX)] + SEGMENT_SUFFIX)
+        if progress is not None:
+            await progress(result)
+
+
+archive = Archive()
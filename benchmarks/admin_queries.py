@@ -0,0 +1,365 @@
+"""Time the stats and admin code paths on reproducible synthetic datasets.
+
+Builds a SQLite file with the models.py schema (users, quiz attempts with
+ten answers each, a share left incomplete, activity skewed towards a few
+heavy users and spread over ``--days``), derives UserStats and DailyStats
+from it, then times what /stats, /user_stats, /global_stats, /top_scores,
+/active_users and /cleanup run. Every destructive cleanup action runs in
+its own process on a fresh copy of the dataset.
+
+Datasets are cached next to the system temp files under a name derived
+from their parameters, so runs on different commits measure the same data.
+Results go to a JSON file; ``--compare`` prints the change against an
+earlier one.
+
+    python benchmarks/admin_queries.py [--scale 10k|100k|1m] [--compare OLD.json]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+# (users, answers) per preset
+SCALES = {
+    "10k": (10_000, 1_000_000),
+    "100k": (100_000, 10_000_000),
+    "1m": (1_000_000, 50_000_000),
+}
+QUESTIONS_PER_QUIZ = 10
+OPTIONS = 4
+# Share of attempts that were never finished
+INCOMPLETE_RATIO = 0.05
+# Attempts generated and inserted per step
+GENERATE_CHUNK = 50_000
+# Age in days of the cutoff used by the /cleanup paths, as in the admin examples
+CLEANUP_DAYS = 30
+CLEANUP_ACTIONS = ("old_quizzes", "incomplete_quizzes", "inactive_users", "all")
+# Newest activity in every dataset, fixed so datasets don't depend on the day they were built
+DATASET_END = datetime.datetime(2026, 1, 1)
+
+
+def _insert_sql(model, fields):
+    columns = ", ".join(f'"{field.column_name}"' for field in fields)
+    placeholders = ", ".join("?" for _ in fields)
+    return f'INSERT INTO "{model._meta.table_name}" ({columns}) VALUES ({placeholders})'
+
+
+def _timestamps(now, seconds_ago):
+    """Format ages in seconds the way peewee stores DateTimeField values"""
+    moments = np.datetime64(now, "s") - seconds_ago.astype("timedelta64[s]")
+    return np.char.replace(np.datetime_as_string(moments, unit="s"), "T", " ").tolist()
+
+
+def generate(path, users, answers, questions, days, seed):
+    """Write a synthetic dataset to ``path``; the same parameters always give the same rows"""
+    import models
+    from models import db, User, QuizAttempt, UserAnswer
+    from user_stats import rebuild_user_stats
+    from rollups import rebuild_rollups
+
+    rng = np.random.default_rng(seed)
+    now = DATASET_END
+    span = days * 86400
+
+    models.db.init(path, pragmas=models.DATABASE_PRAGMAS, timeout=10)
+    models.create_tables()
+    conn = db.connection()
+
+    user_age = rng.integers(0, span, size=users)
+    ability = rng.normal(size=users)
+    with db.atomic():
+        conn.executemany(
+            _insert_sql(User, [User.id, User.user_id, User.username, User.first_name, User.joined_date]),
+            zip(range(1, users + 1), range(1_000_000, 1_000_000 + users),
+                (f"user{i}" if i % 3 else None for i in range(users)),
+                (f"User{i}" for i in range(users)),
+                _timestamps(now, user_age)),
+        )
+
+    hardness = rng.normal(size=questions)
+    correct_option = rng.integers(0, OPTIONS, size=questions)
+    attempt_fields = [QuizAttempt.id, QuizAttempt.user, QuizAttempt.start_time, QuizAttempt.end_time,
+                      QuizAttempt.score, QuizAttempt.total_questions]
+    answer_fields = [UserAnswer.quiz_attempt, UserAnswer.question_id, UserAnswer.selected_option,
+                     UserAnswer.is_correct, UserAnswer.answer_time]
+    attempts = answers // QUESTIONS_PER_QUIZ
+    next_id = 1
+    for first in range(0, attempts, GENERATE_CHUNK):
+        count = min(GENERATE_CHUNK, attempts - first)
+        # Squaring skews activity towards the low user indexes
+        user = (rng.random(count) ** 2 * users).astype(np.int64)
+        age = (rng.random(count) * user_age[user]).astype(np.int64)
+        incomplete = rng.random(count) < INCOMPLETE_RATIO
+        answered = np.where(incomplete, rng.integers(0, QUESTIONS_PER_QUIZ, size=count), QUESTIONS_PER_QUIZ)
+
+        attempt = np.repeat(np.arange(count), answered)
+        position = np.arange(len(attempt)) - np.repeat(np.cumsum(answered) - answered, answered)
+        question = rng.integers(0, questions, size=len(attempt))
+        chance = 1 / (1 + np.exp(hardness[question] - ability[user[attempt]]))
+        is_correct = rng.random(len(attempt)) < chance
+        wrong = (correct_option[question] + rng.integers(1, OPTIONS, size=len(attempt))) % OPTIONS
+        selected = np.where(is_correct, correct_option[question], wrong)
+        score = np.bincount(attempt, weights=is_correct, minlength=count).astype(np.int64)
+
+        ids = np.arange(next_id, next_id + count)
+        next_id += count
+        start_time = _timestamps(now, age)
+        end_time = _timestamps(now, age - rng.integers(60, 300, size=count))
+        with db.atomic():
+            conn.executemany(_insert_sql(QuizAttempt, attempt_fields), (
+                (attempt_id, user_index + 1, start, None if unfinished else end,
+                 0 if unfinished else quiz_score, 0 if unfinished else QUESTIONS_PER_QUIZ)
+                for attempt_id, user_index, start, end, unfinished, quiz_score in zip(
+                    ids.tolist(), user.tolist(), start_time, end_time, incomplete.tolist(), score.tolist())
+            ))
+            conn.executemany(_insert_sql(UserAnswer, answer_fields), zip(
+                ids[attempt].tolist(), (question + 1).tolist(), selected.tolist(), is_correct.tolist(),
+                _timestamps(now, age[attempt] - 15 * (position + 1)),
+            ))
+        print(f"\rgenerated {first + count:,}/{attempts:,} attempts", end="", flush=True)
+    print()
+
+    with db.atomic():
+        rebuild_user_stats()
+        rebuild_rollups()
+    db.close()
+
+
+def dataset_path(args):
+    name = f"grammar-bench-{args.users}u-{args.answers}a-{args.questions}q-{args.days}d-s{args.seed}.db"
+    return os.path.join(args.data_dir or tempfile.gettempdir(), name)
+
+
+def ensure_dataset(args):
+    path = dataset_path(args)
+    if os.path.exists(path):
+        print(f"using cached dataset {path}")
+        return path
+    partial = path + ".partial"
+    for leftover in (partial, partial + "-wal", partial + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    started = time.perf_counter()
+    # Generated in a child process so this one never holds a connection to it
+    process = multiprocessing.get_context("spawn").Process(
+        target=generate, args=(partial, args.users, args.answers, args.questions, args.days, args.seed)
+    )
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise SystemExit(f"dataset generation failed with exit code {process.exitcode}")
+    os.replace(partial, path)
+    print(f"generated {path} in {time.perf_counter() - started:.1f}s ({os.path.getsize(path) / 1024 / 1024:.0f} MB)")
+    return path
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "calls": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)],
+        "max": ordered[-1],
+    }
+
+
+async def timed(samples, func, *args):
+    started = time.perf_counter()
+    result = await func(*args)
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+async def bench_reads(path, args):
+    """Time the read-only paths, the way their handlers run them"""
+    import models
+    from database import run_read, executor
+    from leaderboard import leaderboard, load_users
+    from user_stats import get_user_stats
+    from plugins.admin import _load_user_details, _load_global_stats, _load_cleanup_stats, _load_users
+    import cleanup
+
+    models.db.init(path, pragmas=models.DATABASE_PRAGMAS, timeout=10)
+    rng = np.random.default_rng(args.seed + 1)
+    sample_ids = (1_000_000 + rng.integers(0, args.users, size=args.samples)).tolist()
+    cutoff = DATASET_END - datetime.timedelta(days=CLEANUP_DAYS)
+    results = {}
+
+    async def stats(user_id):
+        await run_read(get_user_stats, user_id)
+        leaderboard.rank(user_id)
+
+    async def ranking(board):
+        entries = board.items()
+        await run_read(load_users, [user_id for user_id, _, _ in entries])
+
+    samples = []
+    for _ in range(args.repeat):
+        await timed(samples, leaderboard.reload)
+    results["leaderboard reload"] = samples
+
+    cases = [
+        ("/stats", stats, [(user_id,) for user_id in sample_ids]),
+        ("/user_stats", lambda user_id: run_read(_load_user_details, user_id), [(user_id,) for user_id in sample_ids]),
+        # The heaviest user of the skewed activity
+        ("/user_stats heaviest", lambda: run_read(_load_user_details, 1_000_000), [()] * args.repeat),
+        ("/global_stats", lambda: run_read(_load_global_stats, 7), [()] * args.repeat),
+        ("/top_scores", lambda: ranking(leaderboard.top_scores), [()] * args.repeat),
+        ("/active_users", lambda: ranking(leaderboard.most_active), [()] * args.repeat),
+        ("/users", lambda: run_read(_load_users), [()] * args.repeat),
+        ("/cleanup stats", lambda: run_read(_load_cleanup_stats), [()] * args.repeat),
+        ("/cleanup count all", lambda: cleanup.count_full_cleanup(cutoff), [()] * args.repeat),
+    ]
+    for name, func, calls in cases:
+        samples = []
+        for call_args in calls:
+            await timed(samples, func, *call_args)
+        results[name] = samples
+    executor.shutdown()
+    return {name: summarize(samples) for name, samples in results.items()}
+
+
+def run_cleanup(path, action):
+    """Run one /cleanup action on ``path`` and return (seconds, users, quizzes, answers)"""
+    import models
+    import cleanup
+    from database import executor
+
+    models.db.init(path, pragmas=models.DATABASE_PRAGMAS, timeout=10)
+    cutoff = DATASET_END - datetime.timedelta(days=CLEANUP_DAYS)
+
+    async def run():
+        if action == cleanup.INACTIVE_USERS:
+            return await cleanup.delete_inactive_users(cutoff)
+        if action == cleanup.FULL_CLEANUP:
+            return await cleanup.full_cleanup(cutoff)
+        if action == cleanup.INCOMPLETE_QUIZZES:
+            return await cleanup.delete_attempts(action)
+        return await cleanup.delete_attempts(action, cutoff)
+
+    started = time.perf_counter()
+    result = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+    return elapsed, result.users, result.quizzes, result.answers
+
+
+def bench_cleanups(path, args):
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    scratch_dir = tempfile.mkdtemp(prefix="admin-queries-")
+    try:
+        for action in CLEANUP_ACTIONS:
+            scratch = os.path.join(scratch_dir, "cleanup.db")
+            shutil.copyfile(path, scratch)
+            with context.Pool(1) as pool:
+                elapsed, users, quizzes, answers = pool.apply(run_cleanup, (scratch, action))
+            results[f"/cleanup {action}"] = dict(
+                summarize([elapsed]), users=users, quizzes=quizzes, answers=answers
+            )
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(scratch + suffix):
+                    os.remove(scratch + suffix)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    header = f"{'path':>24} {'calls':>6} {'p50':>10} {'p95':>10} {'max':>10}"
+    if baseline:
+        header += f" {'base p50':>10} {'change':>8}"
+    print(header)
+    for name, result in results.items():
+        line = (f"{name:>24} {result['calls']:>6} {result['p50'] * 1000:>8.2f}ms "
+                f"{result['p95'] * 1000:>8.2f}ms {result['max'] * 1000:>8.2f}ms")
+        previous = baseline.get(name) if baseline else None
+        if previous:
+            line += f" {previous['p50'] * 1000:>8.2f}ms {result['p50'] / previous['p50'] - 1:>+7.0%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="10k", help="dataset preset")
+    parser.add_argument("--users", type=int, help="override the preset's user count")
+    parser.add_argument("--answers", type=int, help="override the preset's answer count")
+    parser.add_argument("--questions", type=int, default=100, help="questions in the bank")
+    parser.add_argument("--days", type=int, default=365, help="days of history")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=200, help="users sampled for the per-user paths")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of every other read path")
+    parser.add_argument("--skip-cleanup", action="store_true", help="skip the destructive /cleanup actions")
+    parser.add_argument("--data-dir", help="where datasets are cached (default: the temp directory)")
+    parser.add_argument("--output", help="results file (default: admin_queries-<scale>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+    users, answers = SCALES[args.scale]
+    args.users = args.users or users
+    args.answers = args.answers or answers
+
+    commit = git_commit()
+    output = os.path.abspath(args.output or f"admin_queries-{args.scale}-{commit or 'unknown'}.json")
+    compare = os.path.abspath(args.compare) if args.compare else None
+    if args.data_dir:
+        args.data_dir = os.path.abspath(args.data_dir)
+        os.makedirs(args.data_dir, exist_ok=True)
+    # plugins.admin loads questions.json relative to the working directory
+    os.chdir(ROOT)
+    path = ensure_dataset(args)
+    results = asyncio.run(bench_reads(path, args))
+    if not args.skip_cleanup:
+        results.update(bench_cleanups(path, args))
+
+    report = {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "dataset": {
+            "users": args.users,
+            "answers": args.answers,
+            "questions": args.questions,
+            "days": args.days,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if compare:
+        with open(compare) as f:
+            previous = json.load(f)
+        if previous["dataset"] != report["dataset"]:
+            print(f"warning: {compare} was measured on a different dataset")
+        baseline = previous["results"]
+    print_results(results, baseline)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Question bank load time from JSON and from its compiled cache.
+
+Writes synthetic banks of increasing size to a temporary directory and
+loads each one three times: the first load parses the JSON and writes the
+compiled bank, the second reads the compiled bank, and the third runs after
+the JSON changed and has to parse again.
+
+    python benchmarks/bank_cache.py [--sizes 1000,10000,100000]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from question_bank import QuestionBank, COMPILED_SUFFIX
+
+
+def write_bank(path, count):
+    questions = [
+        {
+            "id": i,
+            "question": f"Question {i}: The letter ____ by the manager yesterday.",
+            "options": ["was written", "wrote", "is writing", "has written"],
+            "correct_answer": i % 4,
+            "topic": f"topic_{i % 8}",
+        }
+        for i in range(1, count + 1)
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"questions": questions}, f)
+
+
+def timed_load(path):
+    started = time.perf_counter()
+    bank = QuestionBank.from_file(path)
+    return bank, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated question counts")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bank-cache-")
+    print(f"{'questions':>10} {'JSON MB':>8} {'parse':>9} {'compiled':>9} {'speedup':>8} {'changed':>9}")
+    for count in (int(size) for size in args.sizes.split(",")):
+        path = os.path.join(directory, f"questions-{count}.json")
+        write_bank(path, count)
+        parsed, parse_time = timed_load(path)
+        cached, cached_time = timed_load(path)
+        assert cached.questions == parsed.questions
+        # Any edit to the file invalidates the compiled bank
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n")
+        _, changed_time = timed_load(path)
+        print(f"{count:>10} {os.path.getsize(path) / 1024 / 1024:>8.1f} {parse_time * 1000:>7.1f}ms "
+              f"{cached_time * 1000:>7.1f}ms {parse_time / cached_time:>7.1f}x {changed_time * 1000:>7.1f}ms")
+        os.remove(path + COMPILED_SUFFIX)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Item-analysis throughput on synthetic answers.
+
+Generates answers from a simple ability model (stronger users answer more
+questions correctly and score higher), then times ItemStatistics in one
+batch, in incremental batches, and a plain Python loop on a sample for
+comparison. ``--db-rows`` also times bulk-loading answers from a temporary
+SQLite database.
+
+    python benchmarks/item_analysis.py [--answers N] [--questions N] [--db-rows N]
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+QUESTIONS_PER_QUIZ = 10
+OPTIONS = 4
+
+
+def synthetic_answers(answers, questions, seed=0):
+    """Return AnswerArrays for ``answers`` answers grouped in 10-question attempts"""
+    from analytics import AnswerArrays
+
+    rng = np.random.default_rng(seed)
+    attempts = answers // QUESTIONS_PER_QUIZ
+    ability = rng.normal(size=attempts)
+    hardness = rng.normal(size=questions)
+    question_id = rng.integers(0, questions, size=(attempts, QUESTIONS_PER_QUIZ))
+    chance = 1 / (1 + np.exp(hardness[question_id] - ability[:, None]))
+    is_correct = rng.random(chance.shape) < chance
+    score = np.repeat(is_correct.sum(axis=1), QUESTIONS_PER_QUIZ)
+
+    correct_option = rng.integers(0, OPTIONS, size=questions)[question_id]
+    wrong_option = (correct_option + rng.integers(1, OPTIONS, size=chance.shape)) % OPTIONS
+    selected = np.where(is_correct, correct_option, wrong_option)
+    # A few answers time out
+    selected[rng.random(chance.shape) < 0.02] = -1
+    is_correct &= selected >= 0
+    return AnswerArrays(
+        question_id.ravel(), selected.ravel(), is_correct.ravel().astype(np.int8), score
+    )
+
+
+def python_loop(answers):
+    """The per-row accumulation ItemStatistics replaces"""
+    sums = {}
+    for question_id, selected, correct, score in zip(*(column.tolist() for column in answers)):
+        row = sums.setdefault(question_id, [0, 0, 0, 0, 0, {}])
+        row[0] += 1
+        row[1] += correct
+        row[2] += score
+        row[3] += score * score
+        row[4] += score * correct
+        row[5][selected] = row[5].get(selected, 0) + 1
+    return sums
+
+
+def time_call(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def bench_compute(args):
+    from analytics import AnswerArrays, ItemStatistics
+
+    answers, elapsed = time_call(synthetic_answers, args.answers, args.questions)
+    print(f"generated {len(answers.question_id):,} answers in {elapsed:.2f}s")
+
+    statistics = ItemStatistics()
+    _, elapsed = time_call(statistics.add, answers)
+    print(f"{'vectorized, one batch':>28}: {elapsed:7.3f}s  {len(answers.question_id) / elapsed / 1e6:7.1f}M answers/s")
+
+    _, derived = time_call(lambda: (statistics.difficulty, statistics.discrimination))
+    print(f"{'difficulty + discrimination':>28}: {derived * 1000:7.3f}ms")
+
+    incremental = ItemStatistics()
+    batches = np.array_split(np.arange(len(answers.question_id)), args.batches)
+    started = time.perf_counter()
+    for batch in batches:
+        incremental.add(AnswerArrays(*(column[batch] for column in answers)))
+    elapsed = time.perf_counter() - started
+    print(f"{f'vectorized, {args.batches} batches':>28}: {elapsed:7.3f}s")
+    assert np.allclose(incremental.discrimination, statistics.discrimination, equal_nan=True)
+
+    sample = min(args.loop_sample, len(answers.question_id))
+    _, elapsed = time_call(python_loop, AnswerArrays(*(column[:sample] for column in answers)))
+    print(f"{f'python loop, {sample:,} sample':>28}: {elapsed:7.3f}s  "
+          f"(~{elapsed * len(answers.question_id) / sample:.1f}s for all answers)")
+
+    discrimination = statistics.discrimination[statistics.question_ids]
+    print(f"mean discrimination {np.nanmean(discrimination):.3f}, "
+          f"difficulty range {np.nanmin(statistics.difficulty):.2f}-{np.nanmax(statistics.difficulty):.2f}")
+
+
+def bench_load(args):
+    # models opens grammar_bot.db relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="item-analysis-")
+    os.chdir(workdir)
+    from peewee import chunked
+    import models
+    from models import db, User, QuizAttempt, UserAnswer
+    from analytics import load_answer_arrays
+
+    models.create_tables()
+    answers = synthetic_answers(args.db_rows, args.questions, seed=1)
+    attempts = len(answers.question_id) // QUESTIONS_PER_QUIZ
+    now = datetime.datetime.now()
+    with db.atomic():
+        user = User.create(user_id=1, first_name="bench")
+        for chunk in chunked(range(attempts), 100):
+            QuizAttempt.insert_many([
+                {"user": user, "start_time": now, "end_time": now,
+                 "score": int(answers.score[i * QUESTIONS_PER_QUIZ]), "total_questions": QUESTIONS_PER_QUIZ}
+                for i in chunk
+            ]).execute()
+        rows = zip(
+            (np.arange(len(answers.question_id)) // QUESTIONS_PER_QUIZ + 1).tolist(),
+            answers.question_id.tolist(),
+            [None if s < 0 else s for s in answers.selected_option.tolist()],
+            answers.is_correct.astype(bool).tolist(),
+        )
+        fields = [UserAnswer.quiz_attempt, UserAnswer.question_id, UserAnswer.selected_option, UserAnswer.is_correct]
+        for chunk in chunked(rows, 200):
+            UserAnswer.insert_many(chunk, fields=fields).execute()
+
+    loaded, elapsed = time_call(load_answer_arrays)
+    print(f"{'load from SQLite':>28}: {elapsed:7.3f}s  {len(loaded.question_id) / elapsed / 1e6:7.2f}M answers/s "
+          f"({workdir})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--answers", type=int, default=10_000_000, help="synthetic answers to analyse")
+    parser.add_argument("--questions", type=int, default=500, help="questions in the bank")
+    parser.add_argument("--batches", type=int, default=10, help="batches for the incremental run")
+    parser.add_argument("--loop-sample", type=int, default=500_000, help="answers run through the Python loop")
+    parser.add_argument("--db-rows", type=int, default=0, help="answers to load back from SQLite (0 skips)")
+    args = parser.parse_args()
+
+    bench_compute(args)
+    if args.db_rows:
+        bench_load(args)
+
+
+if __name__ == "__main__":
+    main()
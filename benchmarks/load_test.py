@@ -0,0 +1,262 @@
+"""Drive simulated users through full quizzes against the real quiz handlers.
+
+Fake Client, Message and CallbackQuery objects stand in for pyrogram, so no
+network or credentials are needed; everything else (timer wheel, answer
+buffer, session store, outbound scheduler, database executor) is the real
+code running on a fresh SQLite file. Each user sends /quiz, presses
+"Start Quiz" and answers every question after a random think time, or lets
+a share of the questions time out.
+
+    python benchmarks/load_test.py [--users N] [--think SECONDS] [--timeout-ratio R]
+
+Reports quiz throughput, p50/p95/p99 latency of quiz_command,
+handle_start_quiz, handle_quiz_answer and question_timer, event loop lag
+and the database write rate.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+# Seconds between event loop lag probes
+LAG_INTERVAL = 0.05
+# Simulated users get ids from here on, like webhook_stub.py
+FIRST_USER_ID = 9_000_000_000
+
+
+class FakeClient:
+    """Records outgoing calls and hands each chat's messages to its simulated user"""
+
+    def __init__(self, api_latency=0.0):
+        self.api_latency = api_latency
+        self.calls = 0
+        self._message_ids = itertools.count(1)
+        self.inboxes = collections.defaultdict(asyncio.Queue)
+
+    async def _call(self):
+        self.calls += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await self._call()
+        message = FakeMessage(self, next(self._message_ids), chat_id, None, text, reply_markup)
+        self.inboxes[chat_id].put_nowait(message)
+        return message
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        await self._call()
+        message = FakeMessage(self, message_id, chat_id, None, text, reply_markup)
+        self.inboxes[chat_id].put_nowait(message)
+        return message
+
+    async def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        await self._call()
+        return True
+
+
+class FakeMessage:
+    """The parts of pyrogram's Message the plugins use"""
+
+    def __init__(self, client, message_id, chat_id, from_user, text, reply_markup=None):
+        self._client = client
+        self.id = message_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = from_user
+        self.text = text
+        self.reply_markup = reply_markup
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        return await self._client.send_message(self.chat.id, text, reply_markup=reply_markup)
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        return await self._client.edit_message_text(self.chat.id, self.id, text, reply_markup=reply_markup)
+
+
+class FakeCallbackQuery:
+    """The parts of pyrogram's CallbackQuery the plugins use"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, client, from_user, data, message=None):
+        self._client = client
+        self.id = str(next(self._ids))
+        self.from_user = from_user
+        self.data = data
+        self.message = message
+
+    async def answer(self, text=None, **kwargs):
+        return await self._client.answer_callback_query(self.id, text)
+
+
+class Recorder:
+    """Latency samples per handler"""
+
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+
+    async def time(self, name, handler, *args):
+        started = time.perf_counter()
+        try:
+            return await handler(*args)
+        finally:
+            self.samples[name].append(time.perf_counter() - started)
+
+    def wrap(self, name, handler):
+        async def timed(*args):
+            return await self.time(name, handler, *args)
+        return timed
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+async def watch_loop_lag(lags):
+    """Sample how late the event loop wakes up a sleeping task"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(time.perf_counter() - started - LAG_INTERVAL)
+
+
+async def play(client, recorder, quiz_handler, user_id, args, rng, results):
+    user = SimpleNamespace(id=user_id, username=None, first_name=f"Load{user_id - FIRST_USER_ID}", last_name=None)
+    inbox = client.inboxes[user_id]
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+
+    command = FakeMessage(client, 0, user_id, user, "/quiz")
+    await recorder.time("quiz_command", quiz_handler.quiz_command, client, command)
+    welcome = await inbox.get()
+    await asyncio.sleep(rng.expovariate(1 / args.think) if args.think else 0)
+    await recorder.time("handle_start_quiz", quiz_handler.handle_start_quiz, client,
+                        FakeCallbackQuery(client, user, "start_quiz", welcome))
+
+    while True:
+        message = await inbox.get()
+        if message.reply_markup is None:
+            if message.text.startswith("Quiz completed!"):
+                results["completed"] += 1
+                return
+            # Countdown tick
+            continue
+        if rng.random() < args.timeout_ratio:
+            results["timed_out"] += 1
+            continue
+        await asyncio.sleep(rng.expovariate(1 / args.think) if args.think else 0)
+        buttons = message.reply_markup.inline_keyboard
+        data = rng.choice(buttons)[0].callback_data
+        await recorder.time("handle_quiz_answer", quiz_handler.handle_quiz_answer, client,
+                            FakeCallbackQuery(client, user, data, message))
+        results["answered"] += 1
+
+
+async def run(args, db_path):
+    import models
+    from database import executor
+    from answer_buffer import answer_buffer
+    from session_store import session_store
+    from timer_wheel import timer_wheel
+    from leaderboard import leaderboard
+    from outbound import outbound, TokenBucket
+    import outbound as outbound_module
+    import plugins.quiz_handler as quiz_handler
+
+    models.db.init(db_path, pragmas=models.DATABASE_PRAGMAS, timeout=10)
+    models.create_tables()
+    quiz_handler.QUESTION_TIMEOUT = args.question_timeout
+    if not args.telegram_limits:
+        # Measure the handlers, not Telegram's rate limits
+        outbound.bucket = TokenBucket(float("inf"), float("inf"))
+        outbound_module.CHAT_RATE = outbound_module.CHAT_BURST = float("inf")
+
+    recorder = Recorder()
+    # send_question looks question_timer up when it schedules the timer
+    quiz_handler.question_timer = recorder.wrap("question_timer", quiz_handler.question_timer)
+    writes = {"count": 0, "seconds": 0.0}
+    write = executor.write
+
+    async def counted_write(func, *a, **kw):
+        started = time.perf_counter()
+        try:
+            return await write(func, *a, **kw)
+        finally:
+            writes["count"] += 1
+            writes["seconds"] += time.perf_counter() - started
+    executor.write = counted_write
+
+    client = FakeClient(args.api_latency)
+    answer_buffer.start()
+    session_store.start()
+    await leaderboard.reload()
+    lags = []
+    lag_task = asyncio.create_task(watch_loop_lag(lags))
+    results = collections.Counter()
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        play(client, recorder, quiz_handler, FIRST_USER_ID + number, args, random.Random(rng.random()), results)
+        for number in range(args.users)
+    ))
+    elapsed = time.perf_counter() - started
+
+    lag_task.cancel()
+    await timer_wheel.close()
+    await answer_buffer.close()
+    await session_store.close()
+    await outbound.close()
+    executor.shutdown()
+    answers = models.UserAnswer.select().count()
+
+    questions = results["answered"] + results["timed_out"]
+    print(f"{args.users} users, {results['completed']} quizzes in {elapsed:.1f}s: "
+          f"{results['completed'] / elapsed:.1f} quizzes/s, {questions / elapsed:.1f} questions/s "
+          f"({results['timed_out']} timed out), {client.calls} Telegram calls")
+    print(f"{'handler':>20} {'calls':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name in ("quiz_command", "handle_start_quiz", "handle_quiz_answer", "question_timer"):
+        samples = recorder.samples.get(name)
+        if not samples:
+            continue
+        print(f"{name:>20} {len(samples):>8} " + " ".join(
+            f"{percentile(samples, fraction) * 1000:>7.2f}ms" for fraction in (0.5, 0.95, 0.99, 1.0)
+        ))
+    if lags:
+        print(f"event loop lag: p50 {percentile(lags, 0.5) * 1000:.2f}ms, "
+              f"p99 {percentile(lags, 0.99) * 1000:.2f}ms, max {max(lags) * 1000:.2f}ms")
+    print(f"database: {writes['count']} write transactions ({writes['count'] / elapsed:.1f}/s, "
+          f"{writes['seconds'] / max(writes['count'], 1) * 1000:.2f}ms mean wait), "
+          f"{answers} answers ({answers / elapsed:.1f} rows/s) in {db_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000, help="simulated quiz takers")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds before each click")
+    parser.add_argument("--timeout-ratio", type=float, default=0.1, help="share of questions left to time out")
+    parser.add_argument("--question-timeout", type=float, default=5, help="seconds per question")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which users arrive")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds each fake Telegram call takes")
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the outbound rate limits")
+    parser.add_argument("--db", help="SQLite file to use (default: a new temporary file)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # quiz_handler loads questions.json relative to the working directory
+    os.chdir(ROOT)
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="load-test-"), "grammar_bot.db")
+    asyncio.run(run(args, db_path))
+
+
+if __name__ == "__main__":
+    main()
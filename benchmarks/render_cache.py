@@ -0,0 +1,66 @@
+"""Allocations per rendered question, with and without the render cache.
+
+Renders every position of a quiz for many simulated users, once by building
+the text and keyboard from scratch (the old send_question path) and once
+through QuestionBank.render.
+
+    python benchmarks/render_cache.py [--users N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from question_bank import QuestionBank
+
+
+def render_uncached(bank, index, position, total):
+    return bank._render(index, position, total)
+
+
+def render_cached(bank, index, position, total):
+    return bank.render(index, position, total)
+
+
+def run(bank, render, users):
+    rng = random.Random(0)
+    orders = [bank.new_order(rng) for _ in range(users)]
+    total = len(bank)
+    renders = users * total
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_blocks = sys.getallocatedblocks()
+    allocated = 0
+    started = time.perf_counter()
+    for order in orders:
+        for position in range(total):
+            before = tracemalloc.get_traced_memory()[0]
+            result = render(bank, order[position], position, total)
+            allocated += tracemalloc.get_traced_memory()[0] - before
+            del result
+    elapsed = time.perf_counter() - started
+    retained_blocks = sys.getallocatedblocks() - start_blocks
+    tracemalloc.stop()
+    return renders, allocated / renders, retained_blocks, elapsed / renders * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000, help="simulated quiz takers")
+    parser.add_argument("--questions", default=os.path.join(os.path.dirname(__file__), "..", "questions.json"))
+    args = parser.parse_args()
+
+    print(f"{'path':>10} {'renders':>9} {'bytes/render':>13} {'retained blocks':>16} {'us/render':>10}")
+    for name, render in (("uncached", render_uncached), ("cached", render_cached)):
+        bank = QuestionBank.from_file(args.questions)
+        renders, per_render, retained, micros = run(bank, render, args.users)
+        print(f"{name:>10} {renders:>9} {per_render:>13.0f} {retained:>16} {micros:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
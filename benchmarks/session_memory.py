@@ -0,0 +1,81 @@
+"""Memory per quiz session at 1k, 10k and 100k concurrent sessions.
+
+Compares the old representation (a dict holding a shuffled copy of the
+question list) with QuizSession backed by the shared QuestionBank.
+
+    python benchmarks/session_memory.py [--bank-size N]
+"""
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from question_bank import QuestionBank
+from quiz_session import QuizSession
+
+SESSION_COUNTS = (1_000, 10_000, 100_000)
+
+
+def synthetic_questions(count):
+    return [
+        {
+            "id": i,
+            "question": f"Question {i}",
+            "options": [f"Option {j}" for j in range(4)],
+            "correct_answer": i % 4,
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def legacy_session(questions, attempt_id, rng):
+    user_questions = questions.copy()
+    rng.shuffle(user_questions)
+    return {
+        "quiz_attempt_id": attempt_id,
+        "current_question": -1,
+        "message_id": None,
+        "questions": user_questions,
+        "welcome_message_id": attempt_id,
+    }
+
+
+def compact_session(bank, attempt_id, rng):
+    session = QuizSession(attempt_id, attempt_id, bank, bank.new_order(rng), attempt_id)
+    session.message_id = attempt_id
+    return session
+
+
+def measure(factory, count):
+    rng = random.Random(0)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sessions = {user_id: factory(user_id, rng) for user_id in range(count)}
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del sessions
+    return used / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bank-size", type=int, default=10, help="number of questions in the bank")
+    args = parser.parse_args()
+
+    questions = synthetic_questions(args.bank_size)
+    bank = QuestionBank(questions)
+
+    print(f"Question bank: {len(bank)} questions")
+    print(f"{'sessions':>10} {'dict + list copy':>18} {'QuizSession':>14} {'ratio':>7}")
+    for count in SESSION_COUNTS:
+        legacy = measure(lambda user_id, rng: legacy_session(questions, user_id, rng), count)
+        compact = measure(lambda user_id, rng: compact_session(bank, user_id, rng), count)
+        print(f"{count:>10} {legacy:>16.0f} B {compact:>12.0f} B {legacy / compact:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import datetime
+import time
+from models import User, QuizAttempt, UserAnswer, UserStats, QuizSessionState
+from database import run_read, run_write, known_users
+from rollups import record_users_deleted
+
+# Parent rows deleted per transaction
+CHUNK_SIZE = 500
+# Minimum seconds between two progress reports
+PROGRESS_INTERVAL = 2.0
+# Attempts started this recently are never considered incomplete by default
+INCOMPLETE_GRACE = datetime.timedelta(minutes=10)
+
+# Cleanup targets
+OLD_QUIZZES = "old_quizzes"
+INCOMPLETE_QUIZZES = "incomplete_quizzes"
+INACTIVE_USERS = "inactive_users"
+FULL_CLEANUP = "all"
+
+
+class CleanupResult:
+    """Rows deleted so far by a cleanup run"""
+
+    def __init__(self):
+        self.users = 0
+        self.quizzes = 0
+        self.answers = 0
+
+    def add(self, users, quizzes, answers):
+        self.users += users
+        self.quizzes += quizzes
+        self.answers += answers
+
+
+def attempts_condition(target, cutoff_date):
+    """WHERE clause selecting the quiz attempts of a cleanup target.
+
+    For incomplete quizzes the cutoff is optional and defaults to
+    INCOMPLETE_GRACE before now.
+    """
+    if target == OLD_QUIZZES:
+        condition = QuizAttempt.start_time < cutoff_date
+    elif target == INCOMPLETE_QUIZZES:
+        if cutoff_date is None:
+            cutoff_date = datetime.datetime.now() - INCOMPLETE_GRACE
+        condition = QuizAttempt.end_time.is_null(True) & (QuizAttempt.start_time < cutoff_date)
+    else:
+        raise ValueError(f"Unknown cleanup target: {target}")
+    # Never delete quizzes that are still being played
+    in_progress = QuizSessionState.select(QuizSessionState.quiz_attempt_id)
+    return condition & QuizAttempt.id.not_in(in_progress)
+
+
+def _inactive_users_condition(cutoff_date):
+    """WHERE clause selecting users without a quiz attempt since the cutoff date"""
+    active_user_ids = QuizAttempt.select(QuizAttempt.user).where(QuizAttempt.start_time >= cutoff_date)
+    playing_user_ids = QuizSessionState.select(QuizSessionState.user_id)
+    return User.id.not_in(active_user_ids) & User.user_id.not_in(playing_user_ids)
+
+
+def count_attempts(target, cutoff_date=None):
+    """Count the quiz attempts a cleanup would delete (runs on a reader thread)"""
+    return QuizAttempt.select().where(attempts_condition(target, cutoff_date)).count()
+
+
+def count_inactive_users(cutoff_date):
+    """Count the users a cleanup would delete (runs on a reader thread)"""
+    return User.select().where(_inactive_users_condition(cutoff_date)).count()
+
+
+def delete_attempts_chunk(target, cutoff_date, after_id, limit):
+    """Delete the next chunk of attempts and their answers (runs on the writer thread).
+
+    Returns the last attempt id of the chunk, or None when nothing is left.
+    """
+    attempt_ids = [row[0] for row in (
+        QuizAttempt
+        .select(QuizAttempt.id)
+        .where(attempts_condition(target, cutoff_date) & (QuizAttempt.id > after_id))
+        .order_by(QuizAttempt.id)
+        .limit(limit)
+        .tuples()
+    )]
+    if not attempt_ids:
+        return None, 0, 0
+
+    # Children first, the foreign keys are enforced
+    answers = UserAnswer.delete().where(UserAnswer.quiz_attempt.in_(attempt_ids)).execute()
+    quizzes = QuizAttempt.delete().where(QuizAttempt.id.in_(attempt_ids)).execute()
+    return attempt_ids[-1], quizzes, answers
+
+
+def _delete_users_chunk(cutoff_date, after_id, limit):
+    """Delete the next chunk of inactive users and all their data (runs on the writer thread)"""
+    user_ids = [row[0] for row in (
+        User
+        .select(User.id)
+        .where(_inactive_users_condition(cutoff_date) & (User.id > after_id))
+        .order_by(User.id)
+        .limit(limit)
+        .tuples()
+    )]
+    if not user_ids:
+        return None, 0, 0, 0
+
+    attempt_ids = QuizAttempt.select(QuizAttempt.id).where(QuizAttempt.user.in_(user_ids))
+    telegram_ids = User.select(User.user_id).where(User.id.in_(user_ids))
+
+    answers = UserAnswer.delete().where(UserAnswer.quiz_attempt.in_(attempt_ids)).execute()
+    quizzes = QuizAttempt.delete().where(QuizAttempt.user.in_(user_ids)).execute()
+    UserStats.delete().where(UserStats.user_id.in_(telegram_ids)).execute()
+    record_users_deleted(user_ids)
+    users = User.delete().where(User.id.in_(user_ids)).execute()
+    return user_ids[-1], users, quizzes, answers
+
+
+class _ProgressReporter:
+    """Call an async progress callback at most every PROGRESS_INTERVAL seconds"""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._last_report = time.monotonic()
+
+    async def __call__(self, result):
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if now - self._last_report >= PROGRESS_INTERVAL:
+            self._last_report = now
+            await self.callback(result)
+
+
+async def delete_attempts(target, cutoff_date=None, progress=None, result=None):
+    """Delete every quiz attempt of a target in chunked transactions.
+
+    ``progress`` is an optional coroutine function called with the running
+    CleanupResult, throttled to one call every PROGRESS_INTERVAL seconds.
+    """
+    result = result or CleanupResult()
+    report = _ProgressReporter(progress)
+    after_id = 0
+    while True:
+        after_id, quizzes, answers = await run_write(
+            delete_attempts_chunk, target, cutoff_date, after_id, CHUNK_SIZE
+        )
+        if after_id is None:
+            return result
+        result.add(0, quizzes, answers)
+        await report(result)
+
+
+async def delete_inactive_users(cutoff_date, progress=None, result=None):
+    """Delete inactive users with their attempts, answers and statistics in chunked transactions"""
+    result = result or CleanupResult()
+    report = _ProgressReporter(progress)
+    after_id = 0
+    while True:
+        after_id, users, quizzes, answers = await run_write(
+            _delete_users_chunk, cutoff_date, after_id, CHUNK_SIZE
+        )
+        if after_id is None:
+            return result
+        # Cached row ids may point at deleted users now
+        known_users.clear()
+        result.add(users, quizzes, answers)
+        await report(result)
+
+
+async def full_cleanup(cutoff_date, progress=None):
+    """Delete old and incomplete quizzes, then inactive users"""
+    result = CleanupResult()
+    await delete_attempts(OLD_QUIZZES, cutoff_date, progress, result)
+    await delete_attempts(INCOMPLETE_QUIZZES, None, progress, result)
+    await delete_inactive_users(cutoff_date, progress, result)
+    return result
+
+
+async def count_full_cleanup(cutoff_date):
+    """Count what full_cleanup would delete: (inactive users, old quizzes, incomplete quizzes)"""
+    return (
+        await run_read(count_inactive_users, cutoff_date),
+        await run_read(count_attempts, OLD_QUIZZES, cutoff_date),
+        await run_read(count_attempts, INCOMPLETE_QUIZZES),
+    )
@@ -1,13 +1,35 @@
 import os
 import json
+import logging
 from pathlib import Path
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
+# List of admin user IDs (Telegram IDs of users who can access admin commands)
+ADMIN_USER_IDS = [652429947]
+
+
+def _int_env(name, default):
+    """Integer environment variable, or ``default`` with a warning if it is malformed"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning("Invalid %s=%r, using %d", name, value, default)
+        return default
+
 
 class GrammerBotConfig:
     def __init__(self):
         try:
             self.token, self.api_hash, self.api_id = self._read_env_config()
+            (self.retention_days, self.retention_incomplete_hours,
+             self.retention_interval_minutes, self.retention_archive) = self._read_retention_config()
+            self.archive_dir = os.getenv("ARCHIVE_DIR", "archive")
+            self.metrics_file, self.metrics_interval = self._read_metrics_config()
         except Exception:
             exit(2)
 
@@ -22,3 +44,19 @@ class GrammerBotConfig:
         
         return token, api_hash, api_id
 
+    def _read_retention_config(self):
+        # 0 disables the corresponding retention rule
+        retention_days = _int_env("RETENTION_DAYS", 0)
+        incomplete_hours = _int_env("RETENTION_INCOMPLETE_HOURS", 0)
+        interval_minutes = _int_env("RETENTION_INTERVAL_MINUTES", 60)
+        # Move old quizzes to the archive instead of deleting them
+        archive = os.getenv("RETENTION_ARCHIVE", "0") == "1"
+
+        return retention_days, incomplete_hours, interval_minutes, archive
+
+    def _read_metrics_config(self):
+        # Prometheus text file rewritten periodically, empty disables it
+        metrics_file = os.getenv("METRICS_FILE", "metrics.prom")
+        interval_seconds = _int_env("METRICS_INTERVAL_SECONDS", 15)
+
+        return metrics_file, interval_seconds
@@ -0,0 +1,50 @@
+from collections import namedtuple
+from timer_wheel import timer_wheel
+
+# Seconds a confirmation prompt stays answerable
+CONFIRM_TIMEOUT = 300
+
+# A destructive cleanup waiting for its confirmation. ``action`` is one of
+# the cleanup targets, ``cutoff_date`` is None for incomplete quizzes.
+PendingCleanup = namedtuple("PendingCleanup", ["action", "cutoff_date", "user_id"])
+
+
+class ConfirmationRegistry:
+    """Operations waiting for a reply to their prompt message.
+
+    Entries are keyed by (chat id, prompt message id), so routing a reply is
+    one dict lookup. Each entry expires through the timer wheel after
+    ``timeout`` seconds, so unanswered prompts never accumulate.
+    """
+
+    def __init__(self, timeout=CONFIRM_TIMEOUT):
+        self.timeout = timeout
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def register(self, chat_id, prompt_id, job):
+        """Wait for a reply to a prompt message"""
+        key = (chat_id, prompt_id)
+        timer = timer_wheel.schedule(self.timeout, self._expire, key)
+        self._pending[key] = (job, timer)
+
+    def is_pending(self, chat_id, prompt_id):
+        return (chat_id, prompt_id) in self._pending
+
+    def pop(self, chat_id, prompt_id, user_id):
+        """Take the job waiting on a prompt if ``user_id`` requested it, else return None"""
+        key = (chat_id, prompt_id)
+        entry = self._pending.get(key)
+        if entry is None or entry[0].user_id != user_id:
+            return None
+        del self._pending[key]
+        entry[1].cancel()
+        return entry[0]
+
+    def _expire(self, key):
+        self._pending.pop(key, None)
+
+
+pending_confirmations = ConfirmationRegistry()
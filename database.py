@@ -0,0 +1,236 @@
+import asyncio
+import contextvars
+import datetime
+import functools
+import itertools
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from peewee import EXCLUDED
+from models import db, User
+from rollups import record_new_user
+
+# Number of threads serving read-only queries
+READ_WORKERS = 4
+# Telegram users whose row id and profile are kept in memory
+KNOWN_USERS_SIZE = 50_000
+
+
+class DatabaseExecutor:
+    """Run peewee calls on dedicated threads so the event loop only ever awaits.
+
+    Writes go through a single writer thread (SQLite allows one writer at a
+    time anyway), reads are spread over a small pool of reader threads.
+    Peewee keeps one connection per thread, so every worker reuses its own.
+    """
+
+    def __init__(self, read_workers=READ_WORKERS):
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-reader")
+        # Set in webhook worker processes, which share one writer process
+        self.remote_writer = None
+
+    async def read(self, func, *args, **kwargs):
+        """Run a read-only database function on a reader thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, _in_context(func, *args, **kwargs))
+
+    async def write(self, func, *args, **kwargs):
+        """Run a database function on the writer thread inside one transaction"""
+        if self.remote_writer is not None:
+            return await self.remote_writer.write(func, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, _in_context(_atomic_call, func, *args, **kwargs))
+
+    def shutdown(self):
+        """Wait for queued work to finish and stop the worker threads"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        if self.remote_writer is not None:
+            self.remote_writer.close()
+
+
+def _in_context(func, *args, **kwargs):
+    """Bind a call to the caller's context variables, as asyncio.to_thread does"""
+    return functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def _atomic_call(func, *args, **kwargs):
+    with db.atomic():
+        return func(*args, **kwargs)
+
+
+class RemoteWriter:
+    """Send write calls to the writer process shared by the webhook workers.
+
+    Calls travel as (worker, request id, function, args, kwargs) over a
+    multiprocessing queue, so write functions and their arguments must be
+    picklable: module-level functions, never lambdas or closures. A thread
+    waits on this worker's response queue and resolves the futures.
+    """
+
+    def __init__(self, requests, responses, worker_index):
+        self._requests = requests
+        self._responses = responses
+        self._worker_index = worker_index
+        self._ids = itertools.count()
+        self._futures = {}
+        self._loop = None
+        self._thread = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._receive, name="db-remote-writer", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            self._responses.put(None)
+            self._thread.join()
+            self._thread = None
+
+    async def write(self, func, *args, **kwargs):
+        request_id = next(self._ids)
+        future = self._loop.create_future()
+        self._futures[request_id] = future
+        self._requests.put((self._worker_index, request_id, func, args, kwargs))
+        return await future
+
+    def _receive(self):
+        while True:
+            response = self._responses.get()
+            if response is None:
+                return
+            self._loop.call_soon_threadsafe(self._resolve, *response)
+
+    def _resolve(self, request_id, ok, value):
+        future = self._futures.pop(request_id)
+        if future.cancelled():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+
+def serve_writes(requests, responses):
+    """Main loop of the shared writer process: run every write call in arrival order"""
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        worker_index, request_id, func, args, kwargs = request
+        try:
+            response = (request_id, True, _atomic_call(func, *args, **kwargs))
+        except Exception as e:
+            # Raised again in the worker that asked for the write
+            response = (request_id, False, e)
+        try:
+            pickle.dumps(response)
+        except Exception as e:
+            # The worker must get an answer even if the result can't cross processes
+            response = (request_id, False, RuntimeError(f"Unpicklable write result: {e!r}"))
+        responses[worker_index].put(response)
+
+
+executor = DatabaseExecutor()
+
+
+async def run_read(func, *args, **kwargs):
+    """Await a read-only database function without blocking the event loop"""
+    return await executor.read(func, *args, **kwargs)
+
+
+async def run_write(func, *args, **kwargs):
+    """Await a database write function without blocking the event loop"""
+    return await executor.write(func, *args, **kwargs)
+
+
+def upsert_user(user_id, username, first_name, last_name):
+    """Register a Telegram user or refresh their profile in one statement (runs on the writer thread).
+
+    Returns the User row id.
+    """
+    now = datetime.datetime.now()
+    query = User.insert(
+        user_id=user_id,
+        username=username,
+        first_name=first_name,
+        last_name=last_name,
+        joined_date=now
+    ).on_conflict(
+        conflict_target=[User.user_id],
+        update={
+            User.username: EXCLUDED.username,
+            User.first_name: EXCLUDED.first_name,
+            User.last_name: EXCLUDED.last_name,
+        }
+    ).returning(User.id, User.joined_date)
+    user = list(query.execute())[0]
+    # An existing row keeps its original join date
+    if user.joined_date == now:
+        record_new_user(now)
+    return user.id
+
+
+class KnownUsers:
+    """Bounded LRU of Telegram user id -> (User row id, profile hash).
+
+    Only touched from the event loop. A user whose profile is unchanged is
+    resolved without any query; a miss or a changed profile costs one upsert.
+    Webhook workers share a generation counter through ``share``, so
+    clearing the cache in one process clears it in all of them.
+    """
+
+    def __init__(self, size=KNOWN_USERS_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._generation = None
+        self._seen_generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def share(self, generation):
+        """Follow a ``multiprocessing.Value`` counter bumped by every ``clear``"""
+        self._generation = generation
+        self._seen_generation = generation.value
+
+    def lookup(self, user_id, username, first_name, last_name):
+        """Return the cached row id, or None if the user is unknown or their profile changed"""
+        if self._generation is not None and self._generation.value != self._seen_generation:
+            # Another process deleted users
+            self._entries.clear()
+            self._seen_generation = self._generation.value
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] != hash((username, first_name, last_name)):
+            return None
+        self._entries.move_to_end(user_id)
+        return entry[0]
+
+    def remember(self, user_id, row_id, username, first_name, last_name):
+        self._entries[user_id] = (row_id, hash((username, first_name, last_name)))
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Forget every user, e.g. after users were deleted"""
+        self._entries.clear()
+        if self._generation is not None:
+            with self._generation.get_lock():
+                self._generation.value += 1
+                self._seen_generation = self._generation.value
+
+
+known_users = KnownUsers()
+
+
+async def register_user(user_id, username, first_name, last_name):
+    """Make sure a Telegram user is registered with their current profile and return the row id"""
+    row_id = known_users.lookup(user_id, username, first_name, last_name)
+    if row_id is None:
+        row_id = await run_write(upsert_user, user_id, username, first_name, last_name)
+        known_users.remember(user_id, row_id, username, first_name, last_name)
+    return row_id
@@ -0,0 +1,162 @@
+import heapq
+from models import User, UserStats
+from database import run_read
+
+# Users kept in each leaderboard
+LEADERBOARD_SIZE = 10
+
+
+class TopK:
+    """The k users with the highest keys, for keys that only ever grow.
+
+    Best scores and attempt counts never decrease, so a user pushed out of
+    the heap can only come back through a later ``offer`` with a higher key.
+    """
+
+    def __init__(self, k=LEADERBOARD_SIZE):
+        self.k = k
+        self._heap = []
+        self._members = {}
+
+    def offer(self, user_id, key, payload=None):
+        """Record a user's new key; O(log k), or O(k) when a member improves"""
+        member = self._members.get(user_id)
+        if member is not None:
+            if key <= member[0]:
+                return
+            self._members[user_id] = (key, payload)
+            self._heap = [(member_key, member_id) for member_id, (member_key, _) in self._members.items()]
+            heapq.heapify(self._heap)
+        elif len(self._heap) < self.k:
+            self._members[user_id] = (key, payload)
+            heapq.heappush(self._heap, (key, user_id))
+        elif key > self._heap[0][0]:
+            _, evicted = heapq.heapreplace(self._heap, (key, user_id))
+            del self._members[evicted]
+            self._members[user_id] = (key, payload)
+
+    def items(self):
+        """Return (user_id, key, payload) tuples, highest key first"""
+        return [
+            (user_id, key, payload)
+            for user_id, (key, payload) in sorted(
+                self._members.items(), key=lambda item: item[1][0], reverse=True
+            )
+        ]
+
+
+class ScoreRanks:
+    """Fenwick tree counting users per best score, for O(log n) rank lookups"""
+
+    def __init__(self, size=64):
+        self._counts = [0] * size
+        self._tree = [0] * (size + 1)
+        self.total = 0
+
+    def add(self, score, delta):
+        if score >= len(self._counts):
+            self._grow(score + 1)
+        self._counts[score] += delta
+        self.total += delta
+        i = score + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def count_above(self, score):
+        """Number of users whose best score is strictly higher"""
+        i = min(score + 1, len(self._counts))
+        at_most = 0
+        while i > 0:
+            at_most += self._tree[i]
+            i -= i & -i
+        return self.total - at_most
+
+    def rank(self, score):
+        """1-based position of a best score, users with equal scores share it"""
+        return self.count_above(score) + 1
+
+    def _grow(self, size):
+        counts = self._counts + [0] * (max(size, len(self._counts) * 2) - len(self._counts))
+        self.__init__(len(counts))
+        for score, count in enumerate(counts):
+            if count:
+                self.add(score, count)
+
+
+class Leaderboard:
+    """In-memory best-score and activity leaderboards.
+
+    Seeded once from UserStats, then kept current by the quiz handlers, so
+    /top_scores, /active_users, /leaderboard and the rank in /stats never
+    scan the attempt table.
+    """
+
+    def __init__(self, size=LEADERBOARD_SIZE):
+        self.size = size
+        self._reset()
+
+    def _reset(self):
+        self.top_scores = TopK(self.size)
+        self.most_active = TopK(self.size)
+        self.ranks = ScoreRanks()
+        self._attempts = {}
+        self._best = {}
+
+    def load(self, rows):
+        """Rebuild from (user_id, attempts, completed, best_score, best_total) rows"""
+        self._reset()
+        for user_id, attempts, completed, best_score, best_total in rows:
+            self._attempts[user_id] = attempts
+            self.most_active.offer(user_id, attempts)
+            if completed:
+                self._best[user_id] = best_score
+                self.ranks.add(best_score, 1)
+                self.top_scores.offer(user_id, best_score, best_total)
+
+    async def reload(self):
+        """Reseed from the database, e.g. after cleanup deleted users"""
+        self.load(await run_read(_load_leaderboard_rows))
+
+    def record_attempt(self, user_id):
+        """Count a started quiz"""
+        attempts = self._attempts.get(user_id, 0) + 1
+        self._attempts[user_id] = attempts
+        self.most_active.offer(user_id, attempts)
+
+    def record_score(self, user_id, score, total_questions):
+        """Count a completed quiz"""
+        best = self._best.get(user_id)
+        if best is not None and score <= best:
+            return
+        if best is not None:
+            self.ranks.add(best, -1)
+        self.ranks.add(score, 1)
+        self._best[user_id] = score
+        self.top_scores.offer(user_id, score, total_questions)
+
+    def rank(self, user_id):
+        """Return (rank, ranked users) for a user, or None before their first completed quiz"""
+        best = self._best.get(user_id)
+        if best is None:
+            return None
+        return self.ranks.rank(best), self.ranks.total
+
+
+def _load_leaderboard_rows():
+    """Load the columns the leaderboard is seeded from (runs on a reader thread)"""
+    return list(UserStats.select(
+        UserStats.user_id,
+        UserStats.attempts,
+        UserStats.completed,
+        UserStats.best_score,
+        UserStats.best_total,
+    ).tuples())
+
+
+def load_users(user_ids):
+    """Map Telegram ids to their User rows (runs on a reader thread)"""
+    return {user.user_id: user for user in User.select().where(User.user_id.in_(list(user_ids)))}
+
+
+leaderboard = Leaderboard()
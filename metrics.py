@@ -0,0 +1,239 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from models import db
+
+# Upper bounds (seconds) of the latency histogram buckets
+HANDLER_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+# Seconds between event loop lag probes
+LAG_INTERVAL = 0.5
+# Seconds between writes of the Prometheus text file
+EXPORT_INTERVAL = 15
+# Prefix of every exported metric
+NAMESPACE = "grammar_bot"
+# Label of queries run outside any handler (timers, buffers, background jobs)
+BACKGROUND = "background"
+
+logger = logging.getLogger(__name__)
+
+# Name of the handler the current task is running, inherited by database threads
+current_handler = contextvars.ContextVar("current_handler", default=BACKGROUND)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, safe to update from several threads"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, fraction):
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        # Beyond the largest bucket
+        return self.buckets[-1]
+
+    def render(self, name, labels=""):
+        """Prometheus text lines of this histogram"""
+        separator = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for upper, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{upper}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class Metrics:
+    """Handler latency, database query timing and event loop lag of the bot.
+
+    ``start`` wraps the callback of every registered pyrogram handler and
+    the ``execute_sql`` method of the peewee database. Queries are counted
+    against the handler whose task issued them, the context variable
+    travelling with the call to the database threads. Gauges are read when
+    a report is built. The Prometheus text file is rewritten every
+    ``export_interval`` seconds; ``/metrics`` shows the same data.
+    """
+
+    def __init__(self, path=None, export_interval=EXPORT_INTERVAL):
+        self.path = path
+        self.export_interval = export_interval
+        self.handler_latency = {}
+        self.handler_queries = {}
+        self.query_latency = Histogram(QUERY_BUCKETS)
+        self.loop_lag = Histogram(HANDLER_BUCKETS)
+        self.max_loop_lag = 0.0
+        self.gauges = {}
+        self._queries_lock = threading.Lock()
+        self._tasks = []
+        self._execute_sql = None
+
+    def add_gauge(self, name, description, read):
+        """Export ``read()`` as a gauge"""
+        self.gauges[name] = (description, read)
+
+    def start(self, client):
+        """Instrument the client's handlers and the database and start the background tasks"""
+        self._add_bot_gauges()
+        self.instrument_handlers(client)
+        self.instrument_database()
+        if not self._tasks:
+            self._tasks.append(asyncio.create_task(self._watch_loop_lag()))
+            if self.path:
+                self._tasks.append(asyncio.create_task(self._export()))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self.path:
+            await self.export(self.path)
+        if self._execute_sql is not None:
+            del db.execute_sql
+            self._execute_sql = None
+
+    def _add_bot_gauges(self):
+        from answer_buffer import answer_buffer
+        from outbound import outbound
+        from plugins.quiz_handler import active_quizzes
+        from timer_wheel import timer_wheel
+
+        self.add_gauge("active_sessions", "Quiz sessions in progress.", lambda: len(active_quizzes))
+        self.add_gauge("pending_timers", "Timers scheduled on the timer wheel.", lambda: timer_wheel.pending)
+        self.add_gauge("buffered_answers", "Answers waiting for the next group commit.", lambda: len(answer_buffer))
+        self.add_gauge("outbound_queue_depth", "Telegram calls waiting to be sent.", lambda: outbound.depth)
+
+    def instrument_handlers(self, client):
+        for group in client.dispatcher.groups.values():
+            for handler in group:
+                if not getattr(handler.callback, "instrumented", False):
+                    handler.callback = self._timed_handler(handler.callback)
+
+    def instrument_database(self):
+        if self._execute_sql is not None:
+            return
+        self._execute_sql = db.execute_sql
+
+        @functools.wraps(self._execute_sql)
+        def execute_sql(sql, params=None, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return self._execute_sql(sql, params, *args, **kwargs)
+            finally:
+                self.query_latency.observe(time.perf_counter() - started)
+                handler = current_handler.get()
+                with self._queries_lock:
+                    self.handler_queries[handler] = self.handler_queries.get(handler, 0) + 1
+        db.execute_sql = execute_sql
+
+    def _timed_handler(self, callback):
+        name = callback.__name__
+        histogram = self.handler_latency.setdefault(name, Histogram(HANDLER_BUCKETS))
+
+        @functools.wraps(callback)
+        async def timed(client, update):
+            token = current_handler.set(name)
+            started = time.perf_counter()
+            try:
+                return await callback(client, update)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+                current_handler.reset(token)
+        timed.instrumented = True
+        return timed
+
+    async def _watch_loop_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            lag = max(time.perf_counter() - started - LAG_INTERVAL, 0)
+            self.loop_lag.observe(lag)
+            self.max_loop_lag = max(self.max_loop_lag, lag)
+
+    async def _export(self):
+        while True:
+            await asyncio.sleep(self.export_interval)
+            try:
+                await self.export(self.path)
+            except Exception:
+                logger.exception("Failed to write metrics to %s", self.path)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def header(name, kind, description):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        name = f"{NAMESPACE}_handler_seconds"
+        header(name, "histogram", "Time spent in each pyrogram handler.")
+        for handler, histogram in sorted(self.handler_latency.items()):
+            lines.extend(histogram.render(name, f'handler="{handler}"'))
+
+        name = f"{NAMESPACE}_handler_queries_total"
+        header(name, "counter", "SQL statements executed on behalf of each handler.")
+        for handler, count in sorted(self.handler_queries.items()):
+            lines.append(f'{name}{{handler="{handler}"}} {count}')
+
+        name = f"{NAMESPACE}_db_query_seconds"
+        header(name, "histogram", "Execution time of SQL statements.")
+        lines.extend(self.query_latency.render(name))
+
+        name = f"{NAMESPACE}_event_loop_lag_seconds"
+        header(name, "histogram", "Delay of the event loop in waking up a sleeping task.")
+        lines.extend(self.loop_lag.render(name))
+
+        for gauge, (description, read) in sorted(self.gauges.items()):
+            name = f"{NAMESPACE}_{gauge}"
+            header(name, "gauge", description)
+            lines.append(f"{name} {read()}")
+        return "\n".join(lines) + "\n"
+
+    async def export(self, path):
+        """Replace the file at ``path`` with the current metrics in one rename"""
+        # Gauges are read on the event loop, only the file write is offloaded
+        await asyncio.to_thread(_write_file, path, self.render())
+
+
+def _write_file(path, text):
+    partial = f"{path}.tmp"
+    with open(partial, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(partial, path)
+
+
+metrics = Metrics()
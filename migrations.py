@@ -0,0 +1,79 @@
+import logging
+from playhouse.migrate import SqliteMigrator, migrate as apply_operations
+from models import User, QuizAttempt, UserAnswer, QuizSessionState, UserStats, DailyStats
+
+logger = logging.getLogger(__name__)
+
+
+def _add_quiz_indexes(db):
+    """Version 1: secondary indexes used by /stats, end_quiz and admin queries"""
+    for model in (User, QuizAttempt, UserAnswer):
+        model._schema.create_indexes(safe=True)
+
+
+def _add_session_state(db):
+    """Version 2: persisted quiz sessions"""
+    db.create_tables([QuizSessionState], safe=True)
+
+
+def _add_user_stats(db):
+    """Version 3: per-user aggregates, backfilled from existing attempts"""
+    from user_stats import rebuild_user_stats
+
+    db.create_tables([UserStats], safe=True)
+    rebuild_user_stats()
+
+
+def _add_session_score(db):
+    """Version 4: running score of persisted quiz sessions"""
+    migrator = SqliteMigrator(db)
+    columns = {column.name for column in db.get_columns(QuizSessionState._meta.table_name)}
+    operations = [
+        migrator.add_column(QuizSessionState._meta.table_name, name, getattr(QuizSessionState, name))
+        for name in ("correct", "answered")
+        if name not in columns
+    ]
+    apply_operations(*operations)
+
+
+def _add_daily_stats(db):
+    """Version 5: daily rollups, backfilled from existing history"""
+    from rollups import rebuild_rollups
+
+    db.create_tables([DailyStats], safe=True)
+    rebuild_rollups()
+
+
+def _add_answer_breakdown_index(db):
+    """Version 6: covering index for per-question answer aggregates"""
+    UserAnswer._schema.create_indexes(safe=True)
+
+
+# Ordered list of migrations. The schema version is stored in SQLite's
+# user_version pragma; migration n brings the database from version n - 1
+# to n inside its own transaction, so a failed step is retried on next start.
+MIGRATIONS = [
+    _add_quiz_indexes,
+    _add_session_state,
+    _add_user_stats,
+    _add_session_score,
+    _add_daily_stats,
+    _add_answer_breakdown_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(db):
+    return db.pragma('user_version')
+
+
+def migrate(db):
+    """Apply every migration newer than the database's schema version"""
+    version = get_schema_version(db)
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info("Migrating database to schema version %d (%s)", target, migration.__name__)
+        with db.atomic():
+            migration(db)
+            db.pragma('user_version', target)
+    return get_schema_version(db)
@@ -1,8 +1,18 @@
 from peewee import *
 import datetime
 
+# Connection profile tuned for many small writes and concurrent readers
+DATABASE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -64 * 1024,  # 64 MB page cache (negative value means KiB)
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+    'foreign_keys': 1,
+}
+
 # Create a SQLite database
-db = SqliteDatabase('grammar_bot.db')
+db = SqliteDatabase('grammar_bot.db', pragmas=DATABASE_PRAGMAS, timeout=10)
 
 class BaseModel(Model):
     class Meta:
@@ -13,15 +23,25 @@ class User(BaseModel):
     username = CharField(null=True)
     first_name = CharField()
     last_name = CharField(null=True)
-    joined_date = DateTimeField(default=datetime.datetime.now)
+    joined_date = DateTimeField(default=datetime.datetime.now, index=True)
 
 class QuizAttempt(BaseModel):
     user = ForeignKeyField(User, backref='quiz_attempts')
-    start_time = DateTimeField(default=datetime.datetime.now)
+    start_time = DateTimeField(default=datetime.datetime.now, index=True)
     end_time = DateTimeField(null=True)
     score = IntegerField(default=0)
     total_questions = IntegerField(default=0)
 
+    class Meta:
+        indexes = (
+            # /stats and /user_stats: a user's completed attempts
+            (('user', 'end_time'), False),
+            # Last activity and inactive-user cleanup
+            (('user', 'start_time'), False),
+            # /cleanup incomplete_quizzes and completed-quiz aggregates
+            (('end_time', 'score'), False),
+        )
+
 class UserAnswer(BaseModel):
     quiz_attempt = ForeignKeyField(QuizAttempt, backref='answers')
     question_id = IntegerField()
@@ -29,9 +49,56 @@ class UserAnswer(BaseModel):
     is_correct = BooleanField(null=True)
     answer_time = DateTimeField(null=True)  # Time when the user answered
 
+    class Meta:
+        indexes = (
+            # Scoring an attempt in end_quiz
+            (('quiz_attempt', 'is_correct'), False),
+            # Covers the per-question breakdown of /user_stats
+            (('quiz_attempt', 'question_id', 'is_correct'), False),
+        )
+
+class QuizSessionState(BaseModel):
+    """Persisted state of an in-progress quiz, used to resume after a restart"""
+    user_id = IntegerField(primary_key=True)
+    chat_id = IntegerField()
+    quiz_attempt_id = IntegerField()
+    question_ids = BlobField()  # Packed array of question ids in quiz order
+    current_question = IntegerField(default=-1)
+    message_id = IntegerField(null=True)
+    deadline = FloatField(null=True)  # Unix time of the next timer event
+    correct = IntegerField(default=0)
+    answered = IntegerField(default=0)
+
+class UserStats(BaseModel):
+    """Per-user aggregates kept up to date by the quiz flow, keyed by Telegram user id"""
+    user_id = IntegerField(primary_key=True)
+    attempts = IntegerField(default=0)
+    completed = IntegerField(default=0)
+    total_score = IntegerField(default=0)
+    total_questions = IntegerField(default=0)
+    best_score = IntegerField(default=0)
+    best_total = IntegerField(default=0)  # Question count of the best attempt
+    last_activity = DateTimeField(null=True)
+
+class DailyStats(BaseModel):
+    """Per-day counters behind /global_stats"""
+    day = DateField(primary_key=True)
+    new_users = IntegerField(default=0)
+    quizzes_started = IntegerField(default=0)
+    quizzes_completed = IntegerField(default=0)
+    answers = IntegerField(default=0)
+    correct_answers = IntegerField(default=0)
+    score_sum = IntegerField(default=0)  # Sum of scores of completed quizzes
+
 def create_tables():
+    from migrations import migrate, get_schema_version, SCHEMA_VERSION
+
     with db:
-        db.create_tables([User, QuizAttempt, UserAnswer])
+        # An up-to-date database needs no DDL, only this pragma read
+        if get_schema_version(db) == SCHEMA_VERSION:
+            return
+        db.create_tables([User, QuizAttempt, UserAnswer, QuizSessionState, UserStats, DailyStats])
+        migrate(db)
 
 if __name__ == '__main__':
     create_tables()
\ No newline at end of file
@@ -0,0 +1,369 @@
+import asyncio
+import collections
+import functools
+import heapq
+import itertools
+import logging
+import time
+from pyrogram.errors import FloodWait
+
+# Priorities, lower goes first
+PRIORITY_ANSWER = 0
+PRIORITY_QUESTION = 1
+PRIORITY_REPLY = 2
+PRIORITY_TICK = 3
+
+# Bot API limits: about 30 messages per second overall and one per second in a chat
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+# FloodWaits retried per call before the error reaches the caller
+MAX_FLOOD_RETRIES = 3
+# FloodWaits in this many chats within FLOOD_WINDOW seconds mean the bot-wide limit was hit
+GLOBAL_FLOOD_CHATS = 2
+FLOOD_WINDOW = 1.0
+# Queue wait samples kept for the latency percentiles
+LATENCY_SAMPLES = 1000
+# Seconds close() waits for queued calls before dropping them
+CLOSE_TIMEOUT = 10
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allow ``rate`` calls per second with bursts of up to ``capacity``"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available, 0 if one is available now"""
+        self._refill(now)
+        wait = self.paused_for(now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def paused_for(self, now):
+        return max(self.paused_until - now, 0)
+
+    def full_in(self, now):
+        """Seconds until the bucket is full again and no longer paused"""
+        self._refill(now)
+        return max(self.paused_for(now), (self.capacity - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """Hand out no token for ``seconds``, e.g. after a FloodWait"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class _Call:
+    """A queued Telegram API call and the futures waiting for its result"""
+
+    __slots__ = ("priority", "seq", "call", "key", "limited", "futures", "enqueued", "retries", "dead")
+
+    def __init__(self, priority, seq, call, key, limited):
+        self.priority = priority
+        self.seq = seq
+        self.call = call
+        self.key = key
+        self.limited = limited
+        self.futures = []
+        self.enqueued = time.monotonic()
+        self.retries = 0
+        self.dead = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Chat:
+    __slots__ = ("bucket", "queue", "busy")
+
+    def __init__(self):
+        self.bucket = TokenBucket(CHAT_RATE, CHAT_BURST)
+        self.queue = []
+        self.busy = False
+
+    def head(self):
+        """Next live call of this chat, dropping coalesced ones"""
+        while self.queue and self.queue[0].dead:
+            heapq.heappop(self.queue)
+        return self.queue[0] if self.queue else None
+
+
+class OutboundScheduler:
+    """Single queue for every outgoing Telegram API call.
+
+    Calls are grouped by chat. A chat has at most one call in flight, so its
+    messages arrive in order, and takes a token from its own bucket and from
+    the global bucket per message. Among the chats that may send, the one
+    whose next call has the best priority goes first. A pending edit of a
+    message is replaced by a newer edit of the same message, and FloodWait
+    errors pause the chat and put the call back in its queue. A FloodWait
+    on a call that isn't a chat message, or in several chats at once,
+    pauses the global bucket too.
+
+    The global rate is per process: processes sharing one bot token split
+    it with ``share``.
+    """
+
+    def __init__(self, rate=GLOBAL_RATE, burst=GLOBAL_BURST):
+        self.bucket = TokenBucket(rate, burst)
+        self._floods = collections.deque()
+        self._chats = {}
+        self._ready = []
+        self._delayed = []
+        self._edits = {}
+        self._seq = itertools.count()
+        self._depth = 0
+        self._in_flight = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.coalesced = 0
+        self.flood_waits = 0
+        self.failed = 0
+        self._latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    @property
+    def depth(self):
+        """Number of calls waiting to be sent"""
+        return self._depth
+
+    def __len__(self):
+        return self._depth
+
+    def share(self, processes):
+        """Use 1/``processes`` of the global rate, for one of several processes sending as the same bot"""
+        self.bucket = TokenBucket(GLOBAL_RATE / processes, max(GLOBAL_BURST / processes, 1))
+
+    def start(self):
+        """Start the sender task (called automatically when a call is queued)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout=CLOSE_TIMEOUT):
+        """Send what is queued, waiting at most ``timeout`` seconds, and stop the sender"""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._depth or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._depth:
+            logger.warning("Dropping %d queued Telegram calls on shutdown", self._depth)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def submit(self, chat_id, priority, call, key=None, limited=True, wait=True):
+        """Queue ``call()``, a coroutine function without arguments, for a chat.
+
+        Calls with the same ``key`` replace each other while queued, the last
+        one is sent and resolves every future. ``limited=False`` skips the
+        per-chat rate limit, for calls Telegram doesn't count as messages.
+        Returns a future for the result, or None with ``wait=False``, in
+        which case errors are only logged.
+        """
+        self.start()
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat()
+        item = _Call(priority, next(self._seq), call, key, limited)
+        previous = self._edits.get(key) if key is not None else None
+        if previous is not None:
+            self.coalesced += 1
+            if priority >= previous.priority:
+                # Keep the queue position, send the newer content
+                previous.call = call
+                return self._wait(previous, wait)
+            previous.dead = True
+            self._depth -= 1
+            item.futures = previous.futures
+            item.enqueued = previous.enqueued
+        if key is not None:
+            self._edits[key] = item
+        heapq.heappush(chat.queue, item)
+        self._depth += 1
+        if not chat.busy and chat.head() is item:
+            heapq.heappush(self._ready, (item.priority, item.seq, chat_id))
+            self._wakeup.set()
+        return self._wait(item, wait)
+
+    def _wait(self, item, wait):
+        if not wait:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        item.futures.append(future)
+        return future
+
+    def send_message(self, client, chat_id, text, priority=PRIORITY_REPLY, wait=True, **kwargs):
+        return self.submit(chat_id, priority, functools.partial(client.send_message, chat_id, text, **kwargs), wait=wait)
+
+    def edit_message_text(self, client, chat_id, message_id, text, priority=PRIORITY_REPLY, wait=True, **kwargs):
+        call = functools.partial(client.edit_message_text, chat_id, message_id, text, **kwargs)
+        return self.submit(chat_id, priority, call, key=(chat_id, message_id), wait=wait)
+
+    def reply(self, message, text, priority=PRIORITY_REPLY, wait=True, **kwargs):
+        """Queue ``message.reply_text``"""
+        return self.submit(message.chat.id, priority, functools.partial(message.reply_text, text, **kwargs), wait=wait)
+
+    def edit(self, message, text, priority=PRIORITY_REPLY, wait=True, **kwargs):
+        """Queue ``message.edit_text``, replacing a pending edit of the same message"""
+        call = functools.partial(message.edit_text, text, **kwargs)
+        return self.submit(message.chat.id, priority, call, key=(message.chat.id, message.id), wait=wait)
+
+    def answer(self, callback_query, text=None, wait=True, **kwargs):
+        """Queue ``callback_query.answer`` ahead of everything else; answers aren't chat messages"""
+        call = functools.partial(callback_query.answer, text, **kwargs)
+        return self.submit(callback_query.from_user.id, PRIORITY_ANSWER, call, limited=False, wait=wait)
+
+    def latency(self, fraction):
+        """Queue wait in seconds at ``fraction`` (0..1) of the recent calls, 0 without samples"""
+        if not self._latencies:
+            return 0
+        samples = sorted(self._latencies)
+        return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, chat_id = heapq.heappop(self._delayed)
+                self._make_ready(chat_id)
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            if not self._ready:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, seq, chat_id = self._ready[0]
+            chat = self._chats[chat_id]
+            item = chat.head()
+            if chat.busy or item is None or item.seq != seq:
+                # Superseded by a newer entry of the same chat
+                heapq.heappop(self._ready)
+                continue
+            # Calls outside the chat's rate limit still respect a FloodWait pause
+            chat_wait = chat.bucket.delay(now) if item.limited else chat.bucket.paused_for(now)
+            if chat_wait:
+                heapq.heappop(self._ready)
+                heapq.heappush(self._delayed, (now + chat_wait, chat_id))
+                continue
+            global_wait = self.bucket.delay(now)
+            if global_wait:
+                # Sleep for a global token, unless something better arrives
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), global_wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._ready)
+            heapq.heappop(chat.queue)
+            self._depth -= 1
+            if item.key is not None and self._edits.get(item.key) is item:
+                del self._edits[item.key]
+            self.bucket.take()
+            if item.limited:
+                chat.bucket.take()
+            chat.busy = True
+            self._latencies.append(now - item.enqueued)
+            task = asyncio.create_task(self._send(chat_id, chat, item))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    def _make_ready(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is None or chat.busy:
+            return
+        item = chat.head()
+        if item is not None:
+            heapq.heappush(self._ready, (item.priority, item.seq, chat_id))
+            self._wakeup.set()
+            return
+        # Forget an idle chat once its bucket has refilled
+        now = time.monotonic()
+        refill = chat.bucket.full_in(now)
+        if refill:
+            heapq.heappush(self._delayed, (now + refill, chat_id))
+        else:
+            del self._chats[chat_id]
+
+    async def _send(self, chat_id, chat, item):
+        try:
+            result = await item.call()
+        except FloodWait as e:
+            self.flood_waits += 1
+            item.retries += 1
+            if item.retries <= MAX_FLOOD_RETRIES:
+                logger.warning("FloodWait of %ss in chat %s, retrying", e.value, chat_id)
+                chat.bucket.pause(e.value)
+                if self._is_global_flood(chat_id, item):
+                    logger.warning("Pausing every chat for %ss", e.value)
+                    self.bucket.pause(e.value)
+                self._requeue(chat, item)
+            else:
+                self._fail(item, e)
+        except Exception as e:
+            self._fail(item, e)
+        else:
+            self.sent += 1
+            for future in item.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            chat.busy = False
+            self._make_ready(chat_id)
+
+    def _is_global_flood(self, chat_id, item):
+        """Whether a FloodWait is more likely the bot-wide limit than the chat's own"""
+        if not item.limited:
+            return True
+        now = time.monotonic()
+        while self._floods and self._floods[0][0] < now - FLOOD_WINDOW:
+            self._floods.popleft()
+        self._floods.append((now, chat_id))
+        return len({chat for _, chat in self._floods}) >= GLOBAL_FLOOD_CHATS
+
+    def _requeue(self, chat, item):
+        pending = self._edits.get(item.key) if item.key is not None else None
+        if pending is not None:
+            # A newer edit of the message is queued and will be sent instead
+            pending.futures.extend(item.futures)
+            return
+        if item.key is not None:
+            self._edits[item.key] = item
+        heapq.heappush(chat.queue, item)
+        self._depth += 1
+
+    def _fail(self, item, error):
+        self.failed += 1
+        if not item.futures:
+            logger.error("Telegram call failed", exc_info=error)
+        for future in item.futures:
+            if not future.done():
+                future.set_exception(error)
+
+
+outbound = OutboundScheduler()
@@ -1,12 +1,22 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message
+from config import ADMIN_USER_IDS
 from models import User, QuizAttempt, UserAnswer
-from peewee import fn
+from database import run_read, run_write
+import cleanup
+from retention import retention_job
+from user_stats import get_user_with_stats, get_question_breakdown, rebuild_user_stats
+from plugins.quiz_handler import question_banks
+from rollups import load_totals, rebuild_rollups, catch_up_rollups
+from leaderboard import leaderboard, load_users
+from analytics import item_analysis, MIN_ANSWERS
+from archive import archive
+from confirmations import pending_confirmations, PendingCleanup
+from outbound import outbound, PRIORITY_TICK
+from metrics import metrics
+import asyncio
 import datetime
 
-# List of admin user IDs (Telegram IDs of users who can access admin commands)
-ADMIN_USER_IDS = [652429947]
-
 # Admin filter - only allow commands from admin users
 def admin_filter(_, __, message):
     return message.from_user and message.from_user.id in ADMIN_USER_IDS
@@ -16,22 +26,35 @@ admin_only = filters.create(admin_filter)
 @Client.on_message(filters.command("admin") & admin_only)
 async def admin_command(client: Client, message: Message):
     """Show admin commands help"""
-    await message.reply_text(
+    await outbound.reply(
+        message,
         "🔐 **Admin Commands**\n\n"
         "/admin - Show this help message\n"
         "/users - Show total user count and recent users\n"
-        "/user_stats <user_id> - Show detailed stats for a specific user\n"
-        "/global_stats - Show global statistics for the bot\n"
+        "/user_stats <user_id> [all] - Show detailed stats for a specific user\n"
+        "/global_stats [days] - Show global statistics for the bot\n"
         "/active_users - Show most active users by quiz count\n"
         "/top_scores - Show users with highest scores\n"
+        "/question_stats [id] - Show question difficulty and distractor analysis\n"
+        "/rebuild_stats - Recompute per-user statistics from quiz history\n"
+        "/rebuild_rollups [days|all] - Recompute daily statistics from recent history\n"
+        "/retention - Show the background retention job status\n"
+        "/outbound - Show the outgoing message queue\n"
+        "/metrics - Show handler latency, query counts and event loop lag\n"
+        "/archive [days] - Move old quizzes into compressed archive files\n"
         "/cleanup - Database maintenance and cleanup operations"
     )
 
+def _load_users():
+    """Total user count and the ten most recent users (runs on a reader thread)"""
+    total_users = User.select().count()
+    recent_users = list(User.select().order_by(User.joined_date.desc()).limit(10))
+    return total_users, recent_users
+
 @Client.on_message(filters.command("users") & admin_only)
 async def users_command(client: Client, message: Message):
     """Show total user count and recent users"""
-    total_users = User.select().count()
-    recent_users = User.select().order_by(User.joined_date.desc()).limit(10)
+    total_users, recent_users = await run_read(_load_users)
     
     user_list = "\n".join(
         f"{i+1}. {user.first_name} {user.last_name or ''} (@{user.username or 'No username'}) - "
@@ -39,62 +62,80 @@ async def users_command(client: Client, message: Message):
         for i, user in enumerate(recent_users)
     )
     
-    await message.reply_text(
+    await outbound.reply(
+        message,
         f"👥 **User Statistics**\n\n"
         f"Total registered users: {total_users}\n\n"
         f"**Most recent users:**\n{user_list}"
     )
 
+def _load_user_details(user_id):
+    """Collect the statistics shown by /user_stats (runs on a reader thread)"""
+    # The user and their quiz aggregates in one primary-key join
+    user = get_user_with_stats(user_id)
+    if user is None:
+        return None
+    # Answer totals and the per-question breakdown come from the same scan
+    return user, get_question_breakdown(user_id)
+
+def _question_label(question_id):
+    """Short text of a question for the /user_stats breakdown"""
+    try:
+        text = question_banks.current.by_id(question_id).question
+    except KeyError:
+        return f"#{question_id}"
+    text = text.replace("\n", " ")
+    return f"#{question_id} {text[:40]}{'…' if len(text) > 40 else ''}"
+
 @Client.on_message(filters.command("user_stats") & admin_only)
 async def user_stats_command(client: Client, message: Message):
-    """Show detailed stats for a specific user"""
+    """Show detailed stats for a specific user; /user_stats <id> all includes archived answers"""
     # Check if user ID is provided
     command_parts = message.text.split()
     if len(command_parts) < 2:
-        await message.reply_text("Please provide a user ID. Example: /user_stats 123456789")
+        await outbound.reply(message, "Please provide a user ID. Example: /user_stats 123456789")
         return
     
     try:
         user_id = int(command_parts[1])
     except ValueError:
-        await message.reply_text("Invalid user ID. Please provide a numeric ID.")
+        await outbound.reply(message, "Invalid user ID. Please provide a numeric ID.")
         return
+    include_archive = len(command_parts) > 2 and command_parts[2].lower() == "all"
     
-    # Get user
-    try:
-        user = User.get(User.user_id == user_id)
-    except User.DoesNotExist:
-        await message.reply_text(f"User with ID {user_id} not found.")
+    details = await run_read(_load_user_details, user_id)
+    if details is None:
+        await outbound.reply(message, f"User with ID {user_id} not found.")
         return
     
-    # Get quiz attempts
-    quiz_attempts = QuizAttempt.select().where(QuizAttempt.user == user)
-    completed_quizzes = quiz_attempts.where(QuizAttempt.end_time.is_null(False))
-    
-    # Calculate statistics
-    total_attempts = quiz_attempts.count()
-    completed_count = completed_quizzes.count()
-    
-    if completed_count > 0:
-        avg_score = sum(q.score for q in completed_quizzes) / completed_count
-        best_score = max((q.score for q in completed_quizzes), default=0)
-        total_questions_answered = UserAnswer.select().join(QuizAttempt).where(QuizAttempt.user == user).count()
-        correct_answers = UserAnswer.select().join(QuizAttempt).where(
-            (QuizAttempt.user == user) & (UserAnswer.is_correct == True)
-        ).count()
-        accuracy = (correct_answers / total_questions_answered * 100) if total_questions_answered > 0 else 0
-    else:
-        avg_score = 0
-        best_score = 0
-        total_questions_answered = 0
-        correct_answers = 0
-        accuracy = 0
+    user, breakdown = details
+    if include_archive:
+        # Merge in the answers moved to the archive
+        totals = {question_id: (answered, correct) for question_id, answered, correct in breakdown}
+        for question_id, answered, correct in await asyncio.to_thread(archive.question_breakdown, user_id):
+            previous_answered, previous_correct = totals.get(question_id, (0, 0))
+            totals[question_id] = (previous_answered + answered, previous_correct + correct)
+        breakdown = [(question_id, answered, correct) for question_id, (answered, correct) in totals.items()]
+    stats = user.stats
+    total_attempts = stats.attempts if stats else 0
+    completed_count = stats.completed if stats else 0
+    avg_score = stats.total_score / completed_count if completed_count > 0 else 0
+    best_score = stats.best_score if completed_count > 0 else 0
+    last_activity_time = stats.last_activity if stats and stats.last_activity else "Never"
     
-    # Get recent activity
-    last_activity = quiz_attempts.order_by(QuizAttempt.start_time.desc()).first()
-    last_activity_time = last_activity.start_time if last_activity else "Never"
+    total_questions_answered = sum(answered for _, answered, _ in breakdown)
+    correct_answers = sum(correct for _, _, correct in breakdown)
+    accuracy = (correct_answers / total_questions_answered * 100) if total_questions_answered > 0 else 0
     
-    await message.reply_text(
+    # Questions this user gets wrong most often
+    hardest = sorted(breakdown, key=lambda row: (row[2] / row[1], -row[1]))[:5]
+    hardest_list = "\n".join(
+        f"{_question_label(question_id)} - {correct}/{answered} correct"
+        for question_id, answered, correct in hardest
+    ) or "No answers yet"
+    
+    await outbound.reply(
+        message,
         f"📊 **User Details**\n\n"
         f"User: {user.first_name} {user.last_name or ''}\n"
         f"Username: @{user.username or 'None'}\n"
@@ -108,103 +149,137 @@ async def user_stats_command(client: Client, message: Message):
         f"Questions answered: {total_questions_answered}\n"
         f"Correct answers: {correct_answers}\n"
         f"Accuracy: {accuracy:.1f}%\n\n"
+        f"**Hardest questions ({len(breakdown)} seen):**\n{hardest_list}\n\n"
         f"Last activity: {last_activity_time}"
     )
 
+def _load_global_stats(days):
+    """Sum the daily rollups for all time and for the last ``days`` days (runs on a reader thread)"""
+    since = datetime.date.today() - datetime.timedelta(days=days - 1)
+    return load_totals(), load_totals(since)
+
 @Client.on_message(filters.command("global_stats") & admin_only)
 async def global_stats_command(client: Client, message: Message):
-    """Show global statistics for the bot"""
-    total_users = User.select().count()
-    total_quizzes = QuizAttempt.select().count()
-    completed_quizzes = QuizAttempt.select().where(QuizAttempt.end_time.is_null(False)).count()
-    total_questions = UserAnswer.select().count()
-    correct_answers = UserAnswer.select().where(UserAnswer.is_correct == True).count()
-    
-    # Calculate global accuracy
-    accuracy = (correct_answers / total_questions * 100) if total_questions > 0 else 0
-    
-    # Get average score
-    avg_score_query = QuizAttempt.select(fn.AVG(QuizAttempt.score)).where(QuizAttempt.end_time.is_null(False))
-    avg_score = avg_score_query.scalar() or 0
+    """Show global statistics for the bot; /global_stats <days> sets the recent window"""
+    command_parts = message.text.split()
+    days = 7
+    if len(command_parts) > 1:
+        try:
+            days = int(command_parts[1])
+            if days <= 0:
+                raise ValueError
+        except ValueError:
+            await outbound.reply(message, "Invalid number of days. Using default of 7 days.")
+            days = 7
     
-    # Get users registered in the last 7 days
-    week_ago = datetime.datetime.now() - datetime.timedelta(days=7)
-    new_users = User.select().where(User.joined_date >= week_ago).count()
+    totals, recent = await run_read(_load_global_stats, days)
     
-    # Get quizzes taken in the last 7 days
-    recent_quizzes = QuizAttempt.select().where(QuizAttempt.start_time >= week_ago).count()
+    # Calculate global accuracy and average score
+    accuracy = (totals["correct_answers"] / totals["answers"] * 100) if totals["answers"] > 0 else 0
+    avg_score = (totals["score_sum"] / totals["quizzes_completed"]) if totals["quizzes_completed"] > 0 else 0
+    recent_accuracy = (recent["correct_answers"] / recent["answers"] * 100) if recent["answers"] > 0 else 0
     
-    await message.reply_text(
+    await outbound.reply(
+        message,
         f"📈 **Global Statistics**\n\n"
         f"**User Stats:**\n"
-        f"Total users: {total_users}\n"
-        f"New users (last 7 days): {new_users}\n\n"
+        f"Total users: {totals['new_users']}\n"
+        f"New users (last {days} days): {recent['new_users']}\n\n"
         f"**Quiz Stats:**\n"
-        f"Total quizzes started: {total_quizzes}\n"
-        f"Completed quizzes: {completed_quizzes}\n"
-        f"Quizzes taken (last 7 days): {recent_quizzes}\n"
+        f"Total quizzes started: {totals['quizzes_started']}\n"
+        f"Completed quizzes: {totals['quizzes_completed']}\n"
+        f"Quizzes taken (last {days} days): {recent['quizzes_started']}\n"
         f"Average score: {avg_score:.1f}\n\n"
         f"**Question Stats:**\n"
-        f"Total questions answered: {total_questions}\n"
-        f"Correct answers: {correct_answers}\n"
-        f"Global accuracy: {accuracy:.1f}%"
+        f"Total questions answered: {totals['answers']}\n"
+        f"Correct answers: {totals['correct_answers']}\n"
+        f"Global accuracy: {accuracy:.1f}%\n"
+        f"Accuracy (last {days} days): {recent_accuracy:.1f}%"
     )
 
+def _user_label(users, user_id):
+    """Name of a leaderboard user, or their Telegram ID if the user row is gone"""
+    user = users.get(user_id)
+    if user is None:
+        return f"ID: {user_id}"
+    return f"{user.first_name} {user.last_name or ''} (@{user.username or 'No username'})"
+
 @Client.on_message(filters.command("active_users") & admin_only)
 async def active_users_command(client: Client, message: Message):
     """Show most active users by quiz count"""
-    # Get users with the most quiz attempts
-    query = (
-        User
-        .select(User, fn.COUNT(QuizAttempt.id).alias('quiz_count'))
-        .join(QuizAttempt)
-        .group_by(User.id)
-        .order_by(fn.COUNT(QuizAttempt.id).desc())
-        .limit(10)
-    )
+    entries = leaderboard.most_active.items()
     
-    if not query.exists():
-        await message.reply_text("No quiz attempts recorded yet.")
+    if not entries:
+        await outbound.reply(message, "No quiz attempts recorded yet.")
         return
     
+    users = await run_read(load_users, [user_id for user_id, _, _ in entries])
     user_list = "\n".join(
-        f"{i+1}. {user.first_name} {user.last_name or ''} (@{user.username or 'No username'}) - "
-        f"{user.quiz_count} quizzes"
-        for i, user in enumerate(query)
+        f"{i+1}. {_user_label(users, user_id)} - {quiz_count} quizzes"
+        for i, (user_id, quiz_count, _) in enumerate(entries)
     )
     
-    await message.reply_text(
+    await outbound.reply(
+        message,
         f"🏆 **Most Active Users**\n\n{user_list}"
     )
 
 @Client.on_message(filters.command("top_scores") & admin_only)
 async def top_scores_command(client: Client, message: Message):
     """Show users with highest scores"""
-    # Get top quiz scores
-    top_scores = (
-        QuizAttempt
-        .select(QuizAttempt, User)
-        .join(User)
-        .where(QuizAttempt.end_time.is_null(False))
-        .order_by(QuizAttempt.score.desc())
-        .limit(10)
-    )
+    entries = leaderboard.top_scores.items()
     
-    if not top_scores.exists():
-        await message.reply_text("No completed quizzes yet.")
+    if not entries:
+        await outbound.reply(message, "No completed quizzes yet.")
         return
     
+    users = await run_read(load_users, [user_id for user_id, _, _ in entries])
     score_list = "\n".join(
-        f"{i+1}. {attempt.user.first_name} {attempt.user.last_name or ''} - "
-        f"Score: {attempt.score}/{attempt.total_questions} "
-        f"({attempt.score/attempt.total_questions*100:.1f}%)"
-        for i, attempt in enumerate(top_scores)
+        f"{i+1}. {_user_label(users, user_id)} - "
+        f"Score: {score}/{total} "
+        f"({score/total*100 if total else 0:.1f}%)"
+        for i, (user_id, score, total) in enumerate(entries)
     )
     
-    await message.reply_text(
+    await outbound.reply(
+        message,
         f"🥇 **Top Quiz Scores**\n\n{score_list}"
     )
 
+def _load_cleanup_stats():
+    """Collect the counters shown by /cleanup stats (runs on a reader thread)"""
+    total_users = User.select().count()
+    total_quizzes = QuizAttempt.select().count()
+    total_answers = UserAnswer.select().count()
+    
+    # Incomplete quizzes
+    incomplete_quizzes = cleanup.count_attempts(cleanup.INCOMPLETE_QUIZZES)
+    
+    # Old quizzes (> 30 days)
+    thirty_days_ago = datetime.datetime.now() - datetime.timedelta(days=30)
+    old_quizzes = cleanup.count_attempts(cleanup.OLD_QUIZZES, thirty_days_ago)
+    
+    # Inactive users (no quiz in last 30 days)
+    inactive_users = cleanup.count_inactive_users(thirty_days_ago)
+    
+    return total_users, total_quizzes, total_answers, incomplete_quizzes, old_quizzes, inactive_users
+
+def _cleanup_progress(status_msg):
+    """Return a progress callback that edits the cleanup status message"""
+    async def report(result):
+        # Updates still queued are replaced by newer ones
+        outbound.edit(
+            status_msg,
+            f"🧹 Cleanup in progress...\n\n"
+            f"Deleted so far:\n"
+            f"- {result.users} users\n"
+            f"- {result.quizzes} quiz attempts\n"
+            f"- {result.answers} user answers",
+            priority=PRIORITY_TICK,
+            wait=False
+        )
+    return report
+
 @Client.on_message(filters.command("cleanup") & admin_only)
 async def cleanup_command(client: Client, message: Message):
     """Handle database cleanup operations"""
@@ -212,7 +287,8 @@ async def cleanup_command(client: Client, message: Message):
     
     # Show help if no arguments provided
     if len(command_parts) == 1:
-        await message.reply_text(
+        await outbound.reply(
+            message,
             "🧹 **Database Cleanup**\n\n"
             "Usage:\n"
             "/cleanup help - Show this help message\n"
@@ -229,7 +305,8 @@ async def cleanup_command(client: Client, message: Message):
     
     # Show help
     if action == "help":
-        await message.reply_text(
+        await outbound.reply(
+            message,
             "🧹 **Database Cleanup**\n\n"
             "Usage:\n"
             "/cleanup help - Show this help message\n"
@@ -244,22 +321,11 @@ async def cleanup_command(client: Client, message: Message):
     # Show cleanup statistics
     elif action == "stats":
         # Calculate statistics for potential cleanup
-        total_users = User.select().count()
-        total_quizzes = QuizAttempt.select().count()
-        total_answers = UserAnswer.select().count()
-        
-        # Incomplete quizzes
-        incomplete_quizzes = QuizAttempt.select().where(QuizAttempt.end_time.is_null(True)).count()
-        
-        # Old quizzes (> 30 days)
-        thirty_days_ago = datetime.datetime.now() - datetime.timedelta(days=30)
-        old_quizzes = QuizAttempt.select().where(QuizAttempt.start_time < thirty_days_ago).count()
-        
-        # Inactive users (no quiz in last 30 days)
-        active_user_ids = QuizAttempt.select(QuizAttempt.user).where(QuizAttempt.start_time >= thirty_days_ago).distinct()
-        inactive_users = User.select().where(User.id.not_in(active_user_ids)).count()
+        (total_users, total_quizzes, total_answers, incomplete_quizzes,
+         old_quizzes, inactive_users) = await run_read(_load_cleanup_stats)
         
-        await message.reply_text(
+        await outbound.reply(
+            message,
             f"📊 **Cleanup Statistics**\n\n"
             f"Total database records:\n"
             f"- Users: {total_users}\n"
@@ -275,196 +341,115 @@ async def cleanup_command(client: Client, message: Message):
     # Delete inactive users
     elif action == "inactive_users":
         if len(command_parts) < 3:
-            await message.reply_text("Please specify the number of days. Example: /cleanup inactive_users 30")
+            await outbound.reply(message, "Please specify the number of days. Example: /cleanup inactive_users 30")
             return
         
         try:
             days = int(command_parts[2])
             if days < 1:
-                await message.reply_text("Days must be a positive number.")
+                await outbound.reply(message, "Days must be a positive number.")
                 return
         except ValueError:
-            await message.reply_text("Invalid number of days. Please provide a valid number.")
+            await outbound.reply(message, "Invalid number of days. Please provide a valid number.")
             return
         
         # Find inactive users
         cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
-        active_user_ids = QuizAttempt.select(QuizAttempt.user).where(QuizAttempt.start_time >= cutoff_date).distinct()
-        inactive_users = User.select().where(User.id.not_in(active_user_ids))
-        inactive_count = inactive_users.count()
+        inactive_count = await run_read(cleanup.count_inactive_users, cutoff_date)
         
         # Confirmation message
-        confirm_msg = await message.reply_text(
+        confirm_msg = await outbound.reply(
+            message,
             f"⚠️ **Confirmation Required**\n\n"
             f"You are about to delete {inactive_count} users who have been inactive for {days}+ days.\n"
             f"This will also delete all their quiz attempts and answers.\n\n"
             f"Reply with 'CONFIRM' to proceed or 'CANCEL' to abort."
         )
         
-        # Wait for confirmation
-        @Client.on_message(filters.reply & filters.text & filters.user(message.from_user.id))
-        async def confirm_inactive_deletion(client, confirm_message):
-            if confirm_message.reply_to_message.id != confirm_msg.id:
-                return
-            
-            if confirm_message.text.upper() == "CONFIRM":
-                # Delete inactive users and their data
-                deleted_count = 0
-                for user in inactive_users:
-                    # Get all quiz attempts for this user
-                    user_attempts = QuizAttempt.select().where(QuizAttempt.user == user.id)
-                    
-                    # Delete all answers for these attempts
-                    for attempt in user_attempts:
-                        UserAnswer.delete().where(UserAnswer.quiz_attempt == attempt.id).execute()
-                    
-                    # Delete all quiz attempts
-                    QuizAttempt.delete().where(QuizAttempt.user == user.id).execute()
-                    
-                    # Delete the user
-                    user.delete_instance()
-                    deleted_count += 1
-                
-                await confirm_message.reply_text(f"✅ Successfully deleted {deleted_count} inactive users and all their data.")
-            elif confirm_message.text.upper() == "CANCEL":
-                await confirm_message.reply_text("Operation cancelled.")
-            else:
-                await confirm_message.reply_text("Invalid response. Operation cancelled.")
-            
-            # Remove the handler
-            client.remove_handler(confirm_inactive_deletion)
+        pending_confirmations.register(
+            confirm_msg.chat.id, confirm_msg.id,
+            PendingCleanup(cleanup.INACTIVE_USERS, cutoff_date, message.from_user.id)
+        )
     
     # Delete old quizzes
     elif action == "old_quizzes":
         if len(command_parts) < 3:
-            await message.reply_text("Please specify the number of days. Example: /cleanup old_quizzes 30")
+            await outbound.reply(message, "Please specify the number of days. Example: /cleanup old_quizzes 30")
             return
         
         try:
             days = int(command_parts[2])
             if days < 1:
-                await message.reply_text("Days must be a positive number.")
+                await outbound.reply(message, "Days must be a positive number.")
                 return
         except ValueError:
-            await message.reply_text("Invalid number of days. Please provide a valid number.")
+            await outbound.reply(message, "Invalid number of days. Please provide a valid number.")
             return
         
         # Find old quizzes
         cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
-        old_quizzes = QuizAttempt.select().where(QuizAttempt.start_time < cutoff_date)
-        old_count = old_quizzes.count()
+        old_count = await run_read(cleanup.count_attempts, cleanup.OLD_QUIZZES, cutoff_date)
         
         # Confirmation message
-        confirm_msg = await message.reply_text(
+        confirm_msg = await outbound.reply(
+            message,
             f"⚠️ **Confirmation Required**\n\n"
             f"You are about to delete {old_count} quiz attempts that are older than {days} days.\n"
             f"This will also delete all answers associated with these quizzes.\n\n"
             f"Reply with 'CONFIRM' to proceed or 'CANCEL' to abort."
         )
         
-        # Wait for confirmation
-        @Client.on_message(filters.reply & filters.text & filters.user(message.from_user.id))
-        async def confirm_old_quizzes_deletion(client, confirm_message):
-            if confirm_message.reply_to_message.id != confirm_msg.id:
-                return
-            
-            if confirm_message.text.upper() == "CONFIRM":
-                # Delete old quizzes and their answers
-                deleted_count = 0
-                for quiz in old_quizzes:
-                    # Delete all answers for this quiz
-                    UserAnswer.delete().where(UserAnswer.quiz_attempt == quiz.id).execute()
-                    
-                    # Delete the quiz attempt
-                    quiz.delete_instance()
-                    deleted_count += 1
-                
-                await confirm_message.reply_text(f"✅ Successfully deleted {deleted_count} old quiz attempts and all their answers.")
-            elif confirm_message.text.upper() == "CANCEL":
-                await confirm_message.reply_text("Operation cancelled.")
-            else:
-                await confirm_message.reply_text("Invalid response. Operation cancelled.")
-            
-            # Remove the handler
-            client.remove_handler(confirm_old_quizzes_deletion)
+        pending_confirmations.register(
+            confirm_msg.chat.id, confirm_msg.id,
+            PendingCleanup(cleanup.OLD_QUIZZES, cutoff_date, message.from_user.id)
+        )
     
     # Delete incomplete quizzes
     elif action == "incomplete_quizzes":
         # Find incomplete quizzes
-        incomplete_quizzes = QuizAttempt.select().where(QuizAttempt.end_time.is_null(True))
-        incomplete_count = incomplete_quizzes.count()
+        incomplete_count = await run_read(cleanup.count_attempts, cleanup.INCOMPLETE_QUIZZES)
         
         if incomplete_count == 0:
-            await message.reply_text("There are no incomplete quizzes to delete.")
+            await outbound.reply(message, "There are no incomplete quizzes to delete.")
             return
         
         # Confirmation message
-        confirm_msg = await message.reply_text(
+        confirm_msg = await outbound.reply(
+            message,
             f"⚠️ **Confirmation Required**\n\n"
             f"You are about to delete {incomplete_count} incomplete quiz attempts.\n"
             f"This will also delete all answers associated with these quizzes.\n\n"
             f"Reply with 'CONFIRM' to proceed or 'CANCEL' to abort."
         )
         
-        # Wait for confirmation
-        @Client.on_message(filters.reply & filters.text & filters.user(message.from_user.id))
-        async def confirm_incomplete_deletion(client, confirm_message):
-            if confirm_message.reply_to_message.id != confirm_msg.id:
-                return
-            
-            if confirm_message.text.upper() == "CONFIRM":
-                # Delete incomplete quizzes and their answers
-                deleted_count = 0
-                for quiz in incomplete_quizzes:
-                    # Delete all answers for this quiz
-                    UserAnswer.delete().where(UserAnswer.quiz_attempt == quiz.id).execute()
-                    
-                    # Delete the quiz attempt
-                    quiz.delete_instance()
-                    deleted_count += 1
-                
-                await confirm_message.reply_text(f"✅ Successfully deleted {deleted_count} incomplete quiz attempts and all their answers.")
-            elif confirm_message.text.upper() == "CANCEL":
-                await confirm_message.reply_text("Operation cancelled.")
-            else:
-                await confirm_message.reply_text("Invalid response. Operation cancelled.")
-            
-            # Remove the handler
-            client.remove_handler(confirm_incomplete_deletion)
+        pending_confirmations.register(
+            confirm_msg.chat.id, confirm_msg.id,
+            PendingCleanup(cleanup.INCOMPLETE_QUIZZES, None, message.from_user.id)
+        )
     
     # Full cleanup
     elif action == "all":
         if len(command_parts) < 3:
-            await message.reply_text("Please specify the number of days. Example: /cleanup all 30")
+            await outbound.reply(message, "Please specify the number of days. Example: /cleanup all 30")
             return
         
         try:
             days = int(command_parts[2])
             if days < 1:
-                await message.reply_text("Days must be a positive number.")
+                await outbound.reply(message, "Days must be a positive number.")
                 return
         except ValueError:
-            await message.reply_text("Invalid number of days. Please provide a valid number.")
+            await outbound.reply(message, "Invalid number of days. Please provide a valid number.")
             return
         
         # Calculate statistics for cleanup
         cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
         
-        # Find old quizzes
-        old_quizzes = QuizAttempt.select().where(QuizAttempt.start_time < cutoff_date)
-        old_count = old_quizzes.count()
-        
-        # Find incomplete quizzes
-        incomplete_quizzes = QuizAttempt.select().where(QuizAttempt.end_time.is_null(True))
-        incomplete_count = incomplete_quizzes.count()
-        
-        # Find inactive users
-        active_user_ids = QuizAttempt.select(QuizAttempt.user).where(QuizAttempt.start_time >= cutoff_date).distinct()
-        inactive_users = User.select().where(User.id.not_in(active_user_ids))
-        inactive_count = inactive_users.count()
+        inactive_count, old_count, incomplete_count = await cleanup.count_full_cleanup(cutoff_date)
         
         # Confirmation message
-        confirm_msg = await message.reply_text(
+        confirm_msg = await outbound.reply(
+            message,
             f"⚠️ **Full Database Cleanup Confirmation**\n\n"
             f"You are about to perform a full cleanup of data older than {days} days:\n"
             f"- {inactive_count} inactive users\n"
@@ -474,72 +459,315 @@ async def cleanup_command(client: Client, message: Message):
             f"Reply with 'CONFIRM' to proceed or 'CANCEL' to abort."
         )
         
-        # Wait for confirmation
-        @Client.on_message(filters.reply & filters.text & filters.user(message.from_user.id))
-        async def confirm_full_cleanup(client, confirm_message):
-            if confirm_message.reply_to_message.id != confirm_msg.id:
-                return
-            
-            if confirm_message.text.upper() == "CONFIRM":
-                status_msg = await confirm_message.reply_text("Cleanup in progress... This may take a while.")
-                
-                # 1. Delete old and incomplete quizzes first
-                quizzes_to_delete = list(old_quizzes) + list(incomplete_quizzes)
-                quiz_ids = [q.id for q in quizzes_to_delete]
-                
-                # Delete answers for these quizzes
-                answers_deleted = UserAnswer.delete().where(UserAnswer.quiz_attempt.in_(quiz_ids)).execute()
-                
-                # Delete the quizzes
-                quizzes_deleted = QuizAttempt.delete().where(QuizAttempt.id.in_(quiz_ids)).execute()
-                
-                # 2. Delete inactive users
-                users_deleted = 0
-                for user in inactive_users:
-                    # Get remaining quiz attempts for this user
-                    remaining_attempts = QuizAttempt.select().where(QuizAttempt.user == user.id)
-                    
-                    # Delete all answers for these attempts
-                    for attempt in remaining_attempts:
-                        UserAnswer.delete().where(UserAnswer.quiz_attempt == attempt.id).execute()
-                    
-                    # Delete all quiz attempts
-                    QuizAttempt.delete().where(QuizAttempt.user == user.id).execute()
-                    
-                    # Delete the user
-                    user.delete_instance()
-                    users_deleted += 1
-                
-                await status_msg.edit_text(
-                    f"✅ **Cleanup Complete**\n\n"
-                    f"Deleted:\n"
-                    f"- {users_deleted} inactive users\n"
-                    f"- {quizzes_deleted} quiz attempts\n"
-                    f"- {answers_deleted} user answers\n\n"
-                    f"Database has been successfully cleaned up."
-                )
-            elif confirm_message.text.upper() == "CANCEL":
-                await confirm_message.reply_text("Operation cancelled.")
-            else:
-                await confirm_message.reply_text("Invalid response. Operation cancelled.")
-            
-            # Remove the handler
-            client.remove_handler(confirm_full_cleanup)
+        pending_confirmations.register(
+            confirm_msg.chat.id, confirm_msg.id,
+            PendingCleanup(cleanup.FULL_CLEANUP, cutoff_date, message.from_user.id)
+        )
     
     else:
-        await message.reply_text(f"Unknown action: {action}\nUse /cleanup help to see available commands.")
+        await outbound.reply(message, f"Unknown action: {action}\nUse /cleanup help to see available commands.")
+
+async def _run_inactive_users_cleanup(job, status_msg):
+    # Delete inactive users and their data
+    result = await cleanup.delete_inactive_users(job.cutoff_date, _cleanup_progress(status_msg))
+    await leaderboard.reload()
+    await outbound.edit(status_msg, f"✅ Successfully deleted {result.users} inactive users and all their data.")
+
+async def _run_old_quizzes_cleanup(job, status_msg):
+    # Delete old quizzes and their answers
+    result = await cleanup.delete_attempts(cleanup.OLD_QUIZZES, job.cutoff_date, _cleanup_progress(status_msg))
+    await outbound.edit(status_msg, f"✅ Successfully deleted {result.quizzes} old quiz attempts and all their answers.")
+
+async def _run_incomplete_quizzes_cleanup(job, status_msg):
+    # Delete incomplete quizzes and their answers
+    result = await cleanup.delete_attempts(cleanup.INCOMPLETE_QUIZZES, None, _cleanup_progress(status_msg))
+    await outbound.edit(status_msg, f"✅ Successfully deleted {result.quizzes} incomplete quiz attempts and all their answers.")
+
+async def _run_full_cleanup(job, status_msg):
+    result = await cleanup.full_cleanup(job.cutoff_date, _cleanup_progress(status_msg))
+    await leaderboard.reload()
+    await outbound.edit(
+        status_msg,
+        f"✅ **Cleanup Complete**\n\n"
+        f"Deleted:\n"
+        f"- {result.users} inactive users\n"
+        f"- {result.quizzes} quiz attempts\n"
+        f"- {result.answers} user answers\n\n"
+        f"Database has been successfully cleaned up."
+    )
+
+# What a confirmed PendingCleanup runs, by action
+CLEANUP_RUNNERS = {
+    cleanup.INACTIVE_USERS: _run_inactive_users_cleanup,
+    cleanup.OLD_QUIZZES: _run_old_quizzes_cleanup,
+    cleanup.INCOMPLETE_QUIZZES: _run_incomplete_quizzes_cleanup,
+    cleanup.FULL_CLEANUP: _run_full_cleanup,
+}
+
+# Replies to a prompt that is still waiting for confirmation
+def awaiting_confirmation_filter(_, __, message):
+    return pending_confirmations.is_pending(message.chat.id, message.reply_to_message_id)
+
+awaiting_confirmation = filters.create(awaiting_confirmation_filter)
+
+@Client.on_message(filters.reply & filters.text & admin_only & awaiting_confirmation)
+async def confirmation_reply(client: Client, message: Message):
+    """Run or cancel the operation a reply confirms"""
+    job = pending_confirmations.pop(message.chat.id, message.reply_to_message_id, message.from_user.id)
+    if job is None:
+        return
+    
+    if message.text.upper() == "CONFIRM":
+        status_msg = await outbound.reply(message, "Cleanup in progress... This may take a while.")
+        await CLEANUP_RUNNERS[job.action](job, status_msg)
+    elif message.text.upper() == "CANCEL":
+        await outbound.reply(message, "Operation cancelled.")
+    else:
+        await outbound.reply(message, "Invalid response. Operation cancelled.")
+
+@Client.on_message(filters.command("rebuild_stats") & admin_only)
+async def rebuild_stats_command(client: Client, message: Message):
+    """Recompute the per-user statistics table from the quiz attempts"""
+    status_msg = await outbound.reply(message, "Rebuilding user statistics...")
+    rebuilt = await run_write(rebuild_user_stats)
+    await leaderboard.reload()
+    await outbound.edit(status_msg, f"✅ Rebuilt statistics for {rebuilt} users.")
+
+@Client.on_message(filters.command("question_stats") & admin_only)
+async def question_stats_command(client: Client, message: Message):
+    """Item analysis of the question bank; /question_stats <id> for one question, /question_stats refresh to rescan"""
+    command_parts = message.text.split()
+    argument = command_parts[1].lower() if len(command_parts) > 1 else None
+    
+    if argument == "refresh":
+        status_msg = await outbound.reply(message, "Rescanning every answer...")
+        added = await item_analysis.refresh(full=True)
+        await outbound.edit(status_msg, f"✅ Analysed {added} answers.")
+        return
+    
+    # Pick up attempts finished since the last call
+    await item_analysis.refresh()
+    statistics = item_analysis.statistics
+    if statistics.answers == 0:
+        await outbound.reply(message, "No answers from completed quizzes yet.")
+        return
+    
+    if argument is not None:
+        try:
+            question_id = int(argument)
+        except ValueError:
+            await outbound.reply(message, "Invalid question ID. Please provide a numeric ID or 'refresh'.")
+            return
+        item = statistics.question(question_id)
+        if item is None:
+            await outbound.reply(message, f"No answers recorded for question {question_id}.")
+            return
+        
+        answered, difficulty, discrimination, option_counts = item
+        try:
+            correct_option = question_banks.current.by_id(question_id).correct_answer
+        except KeyError:
+            correct_option = None
+        option_list = "\n".join(
+            f"{chr(65 + option)}: {count} ({count / answered * 100:.1f}%)"
+            f"{' ✅' if option == correct_option else ''}"
+            for option, count in enumerate(option_counts[1:])
+        )
+        await outbound.reply(
+            message,
+            f"📝 **Question {_question_label(question_id)}**\n\n"
+            f"Answers: {answered}\n"
+            f"Difficulty (share correct): {difficulty:.2f}\n"
+            f"Discrimination: {discrimination:.2f}\n\n"
+            f"**Options:**\n{option_list}\n"
+            f"Timed out: {option_counts[0]} ({option_counts[0] / answered * 100:.1f}%)"
+        )
+        return
+    
+    difficulty = statistics.difficulty
+    discrimination = statistics.discrimination
+    hardest_list = "\n".join(
+        f"{_question_label(question_id)} - {difficulty[question_id]:.2f} correct"
+        for question_id in statistics.lowest(difficulty, 5)
+    ) or "Not enough answers yet"
+    weakest_list = "\n".join(
+        f"{_question_label(question_id)} - {discrimination[question_id]:.2f}"
+        for question_id in statistics.lowest(discrimination, 5)
+    ) or "Not enough answers yet"
+    
+    await outbound.reply(
+        message,
+        f"📝 **Question Statistics**\n\n"
+        f"Answers analysed: {statistics.answers}\n"
+        f"Questions answered: {len(statistics.question_ids)}\n"
+        f"Questions need at least {MIN_ANSWERS} answers to be ranked.\n\n"
+        f"**Hardest questions:**\n{hardest_list}\n\n"
+        f"**Lowest discrimination** (negative values suggest a wrong answer key):\n{weakest_list}\n\n"
+        f"Use /question_stats <id> for the option breakdown of one question."
+    )
+
+def _archive_progress(status_msg):
+    """Return a progress callback that edits the archive status message"""
+    async def report(result):
+        # Updates still queued are replaced by newer ones
+        outbound.edit(
+            status_msg,
+            f"🗃 Archiving...\n\n"
+            f"Moved so far:\n"
+            f"- {result.quizzes} quiz attempts\n"
+            f"- {result.answers} user answers",
+            priority=PRIORITY_TICK,
+            wait=False
+        )
+    return report
+
+@Client.on_message(filters.command("archive") & admin_only)
+async def archive_command(client: Client, message: Message):
+    """Show the archive; /archive <days> moves quizzes older than that into it"""
+    command_parts = message.text.split()
+    if len(command_parts) > 1:
+        try:
+            days = int(command_parts[1])
+            if days <= 0:
+                raise ValueError
+        except ValueError:
+            await outbound.reply(message, "Invalid number of days. Please provide a valid number.")
+            return
+        
+        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
+        status_msg = await outbound.reply(message, "Archiving... This may take a while.")
+        result = await archive.archive_attempts(cutoff_date, _archive_progress(status_msg))
+        await outbound.edit(
+            status_msg,
+            f"✅ Archived {result.quizzes} quiz attempts and {result.answers} user answers "
+            f"older than {days} days."
+        )
+        return
+    
+    segments, attempts, answers, size, raw = await asyncio.to_thread(archive.summary)
+    ratio = raw / size if size else 0
+    await outbound.reply(
+        message,
+        f"🗃 **Archive**\n\n"
+        f"Directory: {archive.directory}\n"
+        f"Segments: {segments}\n"
+        f"Quiz attempts: {attempts}\n"
+        f"User answers: {answers}\n"
+        f"Size on disk: {size / 1024 / 1024:.1f} MB ({ratio:.1f}x compression)\n\n"
+        f"Use /archive <days> to move older quizzes out of the database."
+    )
+
+@Client.on_message(filters.command("rebuild_rollups") & admin_only)
+async def rebuild_rollups_command(client: Client, message: Message):
+    """Recompute the daily rollups of the last days from the raw tables; /rebuild_rollups all rebuilds everything"""
+    command_parts = message.text.split()
+    days = None
+    if len(command_parts) > 1 and command_parts[1].lower() != "all":
+        try:
+            days = int(command_parts[1])
+            if days <= 0:
+                raise ValueError
+        except ValueError:
+            await outbound.reply(message, "Invalid number of days. Use a positive number or 'all'.")
+            return
+    
+    status_msg = await outbound.reply(message, "Rebuilding daily statistics...")
+    if days is None:
+        rebuilt = await run_write(rebuild_rollups)
+    else:
+        rebuilt = await run_write(catch_up_rollups, days)
+    await outbound.edit(status_msg, f"✅ Rebuilt daily statistics for {rebuilt} days.")
+
+@Client.on_message(filters.command("retention") & admin_only)
+async def retention_command(client: Client, message: Message):
+    """Show the retention policy and the last background run; /retention run starts one now"""
+    command_parts = message.text.split()
+    if len(command_parts) > 1 and command_parts[1].lower() == "run":
+        if not retention_job.policy.enabled:
+            await outbound.reply(message, "Retention is disabled. Set RETENTION_DAYS or RETENTION_INCOMPLETE_HOURS.")
+            return
+        status_msg = await outbound.reply(message, "Running retention...")
+        deleted = await retention_job.run_once()
+        await outbound.edit(status_msg, f"✅ Retention deleted {deleted} rows in {retention_job.last_run_duration:.1f}s.")
+        return
+    
+    job = retention_job
+    last_run = job.last_run_started.strftime('%Y-%m-%d %H:%M:%S') if job.last_run_started else "Never"
+    await outbound.reply(
+        message,
+        f"🗄 **Retention**\n\n"
+        f"Policy: {job.policy.describe()}\n"
+        f"Interval: every {job.policy.interval_minutes} minutes\n\n"
+        f"Last run: {last_run}\n"
+        f"Duration: {job.last_run_duration:.1f}s\n"
+        f"Deleted: {job.last_run_quizzes} quiz attempts, {job.last_run_answers} user answers\n"
+        f"Writer lock wait: {job.last_run_lock_wait * 1000:.0f} ms total, {job.max_lock_wait * 1000:.0f} ms max\n"
+        f"Current chunk size: {job.chunk_size}\n"
+        f"Rows deleted since start: {job.total_rows_deleted}\n"
+        f"Last error: {job.last_error or 'None'}"
+    )
+
+@Client.on_message(filters.command("outbound") & admin_only)
+async def outbound_command(client: Client, message: Message):
+    """Show the depth and latency of the outgoing Telegram call queue"""
+    await outbound.reply(
+        message,
+        f"📤 **Outbound Queue**\n\n"
+        f"Queued calls: {outbound.depth}\n"
+        f"Queue wait: {outbound.latency(0.5) * 1000:.0f} ms p50, {outbound.latency(0.99) * 1000:.0f} ms p99\n\n"
+        f"Sent: {outbound.sent}\n"
+        f"Coalesced edits: {outbound.coalesced}\n"
+        f"FloodWaits: {outbound.flood_waits}\n"
+        f"Failed: {outbound.failed}"
+    )
+
+@Client.on_message(filters.command("metrics") & admin_only)
+async def metrics_command(client: Client, message: Message):
+    """Show handler latency, database query counts and event loop lag since startup"""
+    handler_lines = "\n".join(
+        f"{name}: {histogram.count} calls, p50 {histogram.quantile(0.5) * 1000:.1f} ms, "
+        f"p95 {histogram.quantile(0.95) * 1000:.1f} ms, "
+        f"{metrics.handler_queries.get(name, 0) / histogram.count:.1f} queries/call"
+        for name, histogram in sorted(metrics.handler_latency.items())
+        if histogram.count
+    ) or "No handler calls yet"
+    queries = metrics.query_latency
+    gauges = "\n".join(
+        f"{name.replace('_', ' ').capitalize()}: {read()}"
+        for name, (_, read) in sorted(metrics.gauges.items())
+    )
+    await outbound.reply(
+        message,
+        f"📈 **Metrics**\n\n"
+        f"**Handlers:**\n{handler_lines}\n\n"
+        f"**Database:** {queries.count} queries, p50 {queries.quantile(0.5) * 1000:.2f} ms, "
+        f"p95 {queries.quantile(0.95) * 1000:.2f} ms, "
+        f"{metrics.handler_queries.get('background', 0)} outside handlers\n"
+        f"**Event loop lag:** p95 {metrics.loop_lag.quantile(0.95) * 1000:.1f} ms, "
+        f"max {metrics.max_loop_lag * 1000:.1f} ms\n\n"
+        f"{gauges}\n\n"
+        f"Prometheus file: {metrics.path or 'disabled'}"
+    )
 
 # Update the admin help command to include the cleanup command
 @Client.on_message(filters.command("admin") & admin_only)
 async def admin_command(client: Client, message: Message):
     """Show admin commands help"""
-    await message.reply_text(
+    await outbound.reply(
+        message,
         "🔐 **Admin Commands**\n\n"
         "/admin - Show this help message\n"
         "/users - Show total user count and recent users\n"
-        "/user_stats <user_id> - Show detailed stats for a specific user\n"
-        "/global_stats - Show global statistics for the bot\n"
+        "/user_stats <user_id> [all] - Show detailed stats for a specific user\n"
+        "/global_stats [days] - Show global statistics for the bot\n"
         "/active_users - Show most active users by quiz count\n"
         "/top_scores - Show users with highest scores\n"
+        "/question_stats [id] - Show question difficulty and distractor analysis\n"
+        "/rebuild_stats - Recompute per-user statistics from quiz history\n"
+        "/rebuild_rollups [days|all] - Recompute daily statistics from recent history\n"
+        "/retention - Show the background retention job status\n"
+        "/outbound - Show the outgoing message queue\n"
+        "/metrics - Show handler latency, query counts and event loop lag\n"
+        "/archive [days] - Move old quizzes into compressed archive files\n"
         "/cleanup - Database maintenance and cleanup operations"
     )
\ No newline at end of file
@@ -0,0 +1,27 @@
+from pyrogram import Client, filters
+from pyrogram.types import Message
+from database import run_read
+from leaderboard import leaderboard, load_users
+from outbound import outbound
+
+@Client.on_message(filters.command("leaderboard"))
+async def leaderboard_command(client: Client, message: Message):
+    """Show the best scores and the user's own rank"""
+    entries = leaderboard.top_scores.items()
+    if not entries:
+        await outbound.reply(message, "No completed quizzes yet. Use /quiz to be the first!")
+        return
+    
+    users = await run_read(load_users, [user_id for user_id, _, _ in entries])
+    score_list = "\n".join(
+        f"{i+1}. {users[user_id].first_name if user_id in users else 'Unknown'} - {score}/{total}"
+        for i, (user_id, score, total) in enumerate(entries)
+    )
+    
+    position = leaderboard.rank(message.from_user.id)
+    if position:
+        footer = f"Your rank: #{position[0]} of {position[1]}"
+    else:
+        footer = "Complete a quiz to get on the leaderboard!"
+    
+    await outbound.reply(message, f"🏆 **Leaderboard**\n\n{score_list}\n\n{footer}")
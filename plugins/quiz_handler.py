@@ -1,122 +1,233 @@
-import json
-import asyncio
 import datetime
+import logging
 import random
+import time
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery
-from models import User, QuizAttempt, UserAnswer
+from peewee import IntegrityError
+from models import db, QuizAttempt
+from database import run_write, upsert_user, known_users
+from answer_buffer import answer_buffer
+from timer_wheel import timer_wheel
+from question_bank import QuestionBankLoader
+from quiz_session import QuizSession
+from session_store import session_store
+from user_stats import record_attempt_started, record_attempt_finished
+from rollups import record_quiz_started, record_quiz_completed
+from leaderboard import leaderboard
+from outbound import outbound, PRIORITY_QUESTION, PRIORITY_TICK
 
-# Load questions from JSON file
-with open("questions.json", "r") as f:
-    ALL_QUESTIONS = json.load(f)["questions"]
+# Questions from the JSON file (through its compiled cache), loaded on first
+# use, shared read-only by every session and reloaded when the file changes
+question_banks = QuestionBankLoader("questions.json")
+
+# Seconds the user has to answer each question
+QUESTION_TIMEOUT = 30
+# Seconds of countdown before the first question
+COUNTDOWN_SECONDS = 3
+# Questions drawn for one quiz, however large the bank or topic
+QUESTIONS_PER_QUIZ = 10
 
 # Store active quiz sessions
 active_quizzes = {}
 
-async def countdown(message, user_id):
-    """Display a countdown before starting the quiz"""
-    for i in range(3, 0, -1):
-        await message.edit_text(f"Quiz starting in {i}...")
-        await asyncio.sleep(1)
-    await message.edit_text("Quiz starting now!")
-    await asyncio.sleep(1)
+logger = logging.getLogger(__name__)
+
+def _start_attempt(user_id, user_row_id, username, first_name, last_name):
+    """Create a new quiz attempt, registering the user first unless their row id is known (runs on the writer thread)"""
+    if user_row_id is None:
+        user_row_id = upsert_user(user_id, username, first_name, last_name)
+    start_time = datetime.datetime.now()
+    try:
+        with db.atomic():
+            quiz_attempt = QuizAttempt.create(user=user_row_id, start_time=start_time)
+    except IntegrityError:
+        # The cached row id belonged to a user deleted by a cleanup, register them again
+        user_row_id = upsert_user(user_id, username, first_name, last_name)
+        quiz_attempt = QuizAttempt.create(user=user_row_id, start_time=start_time)
+    record_attempt_started(user_id, start_time)
+    record_quiz_started(start_time)
+    return quiz_attempt.id, user_row_id
+
+def _finish_attempt(quiz_attempt_id, user_id, score, total_questions):
+    """Close a quiz attempt with its final score (runs on the writer thread)"""
+    end_time = datetime.datetime.now()
+    QuizAttempt.update(
+        end_time=end_time,
+        score=score,
+        total_questions=total_questions
+    ).where(QuizAttempt.id == quiz_attempt_id).execute()
+    
+    # Same transaction as the attempt update
+    record_attempt_finished(user_id, score, total_questions)
+    record_quiz_completed(end_time, score)
+
+async def countdown(client, session, remaining=COUNTDOWN_SECONDS):
+    """Display a countdown before starting the quiz, one tick per second"""
+    user_id = session.user_id
+    if active_quizzes.get(user_id) is not session:
+        # The quiz this tick belongs to has ended
+        return
     
-    # Start the quiz
-    await send_question(message, user_id, 0)
+    if remaining > 0:
+        text = f"Quiz starting in {remaining}..."
+    elif remaining == 0:
+        text = "Quiz starting now!"
+    else:
+        # Start the quiz
+        await send_question(client, user_id, 0)
+        return
+    
+    # Ticks don't hold up the countdown; a late tick is replaced by the next one
+    outbound.edit_message_text(client, session.chat_id, session.message_id, text, priority=PRIORITY_TICK, wait=False)
+    
+    session.deadline = time.time() + 1
+    session.timer = timer_wheel.schedule(1, countdown, client, session, remaining - 1)
+    session_store.save(session)
 
-async def send_question(message, user_id, question_index):
+async def send_question(client, user_id, question_index):
     """Send a question to the user"""
-    # Get the user's randomized questions
-    user_questions = active_quizzes[user_id]["questions"]
+    session = active_quizzes.get(user_id)
+    if session is None:
+        return
     
-    if question_index >= len(user_questions):
+    if question_index >= session.total_questions:
         # Quiz completed
-        await end_quiz(message, user_id)
+        await end_quiz(client, user_id)
         return
     
-    question = user_questions[question_index]
-    options = question["options"]
-    
-    # Create inline keyboard with options
-    keyboard = []
-    for i, option in enumerate(options):
-        keyboard.append([InlineKeyboardButton(
-            f"{chr(65+i)}. {option}", 
-            callback_data=f"answer_{question_index}_{i}"
-        )])
+    # Answers are accepted for this question from here on, even before it is on screen
+    session.current_question = question_index
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Text and keyboard are rendered once per (question, position, total)
+    text, reply_markup = session.bank.render(
+        session.order[question_index], question_index, session.total_questions
+    )
     
     # Send the question
-    quiz_message = await message.edit_text(
-        f"Question {question_index + 1}/{len(user_questions)}:\n\n{question['question']}",
-        reply_markup=reply_markup
-    )
+    try:
+        await outbound.edit_message_text(
+            client,
+            session.chat_id,
+            session.message_id,
+            text,
+            priority=PRIORITY_QUESTION,
+            reply_markup=reply_markup
+        )
+    except Exception:
+        # Keep the quiz moving: the question times out unanswered and the next one is tried
+        logger.exception("Failed to send question %d to user %s", question_index, user_id)
     
-    # Store the current question in active quizzes
-    active_quizzes[user_id]["current_question"] = question_index
-    active_quizzes[user_id]["message_id"] = quiz_message.id
+    if active_quizzes.get(user_id) is not session or session.current_question != question_index:
+        # Answered or ended while the edit was queued, the newer state owns the timer
+        return
+    
+    # Replace the previous timer only now, so a failed edit never leaves the session without one
+    if session.timer is not None:
+        session.timer.cancel()
     
     # Set a timer for this question
-    asyncio.create_task(question_timer(message, user_id, question_index))
+    session.deadline = time.time() + QUESTION_TIMEOUT
+    session.timer = timer_wheel.schedule(
+        QUESTION_TIMEOUT, question_timer, client, session, question_index
+    )
+    session_store.save(session)
 
-async def question_timer(message, user_id, question_index):
-    """Timer for each question (30 seconds)"""
-    await asyncio.sleep(30)
-    
-    # Check if the user is still on this question
-    if (user_id in active_quizzes and 
-        active_quizzes[user_id]["current_question"] == question_index):
-        
-        # User didn't answer in time
-        quiz_attempt_id = active_quizzes[user_id]["quiz_attempt_id"]
-        user_questions = active_quizzes[user_id]["questions"]
+async def question_timer(client, session, question_index):
+    """Called by the timer wheel when a question's time limit expires"""
+    user_id = session.user_id
+    
+    # Check if the user is still on this question of this quiz, not of a newer one
+    if active_quizzes.get(user_id) is session and session.current_question == question_index:
+        # Claim the transition before any await, so a late answer can't also advance the quiz
+        session.current_question = question_index + 1
         
         # Record the non-answer
-        UserAnswer.create(
-            quiz_attempt=quiz_attempt_id,
-            question_id=user_questions[question_index]["id"],
-            selected_option=None,
-            is_correct=False,
-            answer_time=None
+        await answer_buffer.add(
+            session.quiz_attempt_id,
+            session.question(question_index).id,
+            None,
+            False,
+            None
         )
         
         # Move to the next question
-        await send_question(message, user_id, question_index + 1)
+        await send_question(client, user_id, question_index + 1)
 
-async def end_quiz(message, user_id):
+async def end_quiz(client, user_id):
     """End the quiz and show results"""
-    if user_id not in active_quizzes:
+    session = active_quizzes.get(user_id)
+    if session is None:
         return
     
-    quiz_attempt_id = active_quizzes[user_id]["quiz_attempt_id"]
-    quiz_attempt = QuizAttempt.get_by_id(quiz_attempt_id)
-    user_questions = active_quizzes[user_id]["questions"]
+    total_questions = session.total_questions
+    correct_answers = session.correct
     
-    # Update the quiz attempt
-    quiz_attempt.end_time = datetime.datetime.now()
-    quiz_attempt.save()
-    
-    # Calculate the score
-    correct_answers = UserAnswer.select().where(
-        (UserAnswer.quiz_attempt == quiz_attempt_id) & 
-        (UserAnswer.is_correct == True)
-    ).count()
+    # The session kept the score, closing the attempt is a single UPDATE
+    await run_write(
+        _finish_attempt, session.quiz_attempt_id, user_id, correct_answers, total_questions
+    )
+    leaderboard.record_score(user_id, correct_answers, total_questions)
     
-    total_questions = len(user_questions)
-    quiz_attempt.score = correct_answers
-    quiz_attempt.total_questions = total_questions
-    quiz_attempt.save()
+    # Clean up first, a failed results edit must not keep the user in the quiz
+    if session.timer is not None:
+        session.timer.cancel()
+    del active_quizzes[user_id]
+    session_store.discard(user_id)
     
     # Show results
-    await message.edit_text(
+    await outbound.edit_message_text(
+        client,
+        session.chat_id,
+        session.message_id,
         f"Quiz completed!\n\n"
         f"Your score: {correct_answers}/{total_questions}\n\n"
-        f"Thank you for taking the Passive Voice Grammar Quiz!"
+        f"Thank you for taking the Passive Voice Grammar Quiz!",
+        priority=PRIORITY_QUESTION
     )
-    
-    # Clean up
-    del active_quizzes[user_id]
+
+async def restore_sessions(client, owns=None):
+    """Reload persisted quiz sessions after a restart and re-arm their timers.
+
+    ``owns`` optionally selects the user ids this process serves; sessions of
+    other users are left to the worker that owns them.
+    """
+    sessions = await load_sessions(owns)
+    resume_timers(client, sessions)
+    return len(sessions)
+
+async def load_sessions(owns=None):
+    """Put persisted quiz sessions back in active_quizzes without arming their timers"""
+    sessions = []
+    for row in await session_store.load():
+        if owns is not None and not owns(row.user_id):
+            continue
+        session = QuizSession.from_row(row, question_banks.current)
+        if session is None:
+            # The questions of this quiz are no longer in the bank
+            session_store.discard(row.user_id)
+            continue
+        
+        active_quizzes[session.user_id] = session
+        sessions.append(session)
+    return sessions
+
+def resume_timers(client, sessions):
+    """Re-arm the timers of sessions from load_sessions once the client can send"""
+    now = time.time()
+    for session in sessions:
+        if session.deadline is None or session.timer is not None or active_quizzes.get(session.user_id) is not session:
+            # Still waiting for the Start Quiz button, or already moved on by a handler
+            continue
+        
+        delay = max(session.deadline - now, 0)
+        if session.current_question < 0:
+            # Interrupted during the countdown, go straight to the first question
+            session.timer = timer_wheel.schedule(delay, countdown, client, session, -1)
+        else:
+            session.timer = timer_wheel.schedule(
+                delay, question_timer, client, session, session.current_question
+            )
 
 @Client.on_message(filters.command("quiz"))
 async def quiz_command(client: Client, message: Message):
@@ -125,52 +236,60 @@ async def quiz_command(client: Client, message: Message):
     
     # Check if user is already in a quiz
     if user_id in active_quizzes:
-        await message.reply_text("You already have an active quiz. Please finish it first.")
+        await outbound.reply(message, "You already have an active quiz. Please finish it first.")
         return
     
-    # Get or create user
-    user, created = User.get_or_create(
-        user_id=user_id,
-        defaults={
-            'username': message.from_user.username,
-            'first_name': message.from_user.first_name,
-            'last_name': message.from_user.last_name
-        }
-    )
+    # Optional topic: /quiz <topic>
+    bank = question_banks.current
+    command_parts = message.text.split() if message.text else []
+    topic = command_parts[1].lower() if len(command_parts) > 1 else None
+    try:
+        order = bank.new_order(random, topic, QUESTIONS_PER_QUIZ)
+    except KeyError:
+        await outbound.reply(
+            message,
+            f"Unknown topic: {topic}\n"
+            f"Available topics: {', '.join(bank.topics)}"
+        )
+        return
     
-    # Create a new quiz attempt
-    quiz_attempt = QuizAttempt.create(
-        user=user,
-        start_time=datetime.datetime.now()
+    # Open a new quiz attempt; unknown users and changed profiles are upserted in the same transaction
+    profile = (message.from_user.username, message.from_user.first_name, message.from_user.last_name)
+    quiz_attempt_id, user_row_id = await run_write(
+        _start_attempt,
+        user_id,
+        known_users.lookup(user_id, *profile),
+        *profile
     )
+    known_users.remember(user_id, user_row_id, *profile)
+    leaderboard.record_attempt(user_id)
     
-    # Create a randomized copy of questions for this user
-    user_questions = ALL_QUESTIONS.copy()
-    random.shuffle(user_questions)
-    
-    # Initialize the quiz session
-    active_quizzes[user_id] = {
-        "quiz_attempt_id": quiz_attempt.id,
-        "current_question": -1,
-        "message_id": None,
-        "questions": user_questions  # Store the randomized questions
-    }
+    # Initialize the quiz session with a randomized question order
+    session = QuizSession(user_id, message.chat.id, bank, order, quiz_attempt_id)
+    active_quizzes[user_id] = session
     
     # Create start quiz button
     keyboard = [[InlineKeyboardButton("Start Quiz", callback_data="start_quiz")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     # Send welcome message with start button
-    welcome_message = await message.reply_text(
+    if topic is None and len(bank.topics) > 1:
+        # A plain /quiz mixes every topic of the bank
+        subject = "mixed topics"
+    else:
+        subject = (topic or bank.topics[0]).replace("_", " ")
+    welcome_message = await outbound.reply(
+        message,
         f"Welcome to the Passive Voice Grammar Quiz, {message.from_user.first_name}!\n\n"
-        f"You will be presented with {len(user_questions)} questions about passive voice in English grammar.\n"
-        f"Each question has a 30-second time limit.\n\n"
+        f"You will be presented with {session.total_questions} questions about {subject} in English grammar.\n"
+        f"Each question has a {QUESTION_TIMEOUT}-second time limit.\n\n"
         f"Click the button below when you're ready to start!",
         reply_markup=reply_markup
     )
     
-    # Store the welcome message ID for reference
-    active_quizzes[user_id]["welcome_message_id"] = welcome_message.id
+    # The welcome message is edited into each question
+    session.message_id = welcome_message.id
+    session_store.save(session)
 
 @Client.on_callback_query(filters.regex(r'^start_quiz$'))
 async def handle_start_quiz(client: Client, callback_query: CallbackQuery):
@@ -178,15 +297,21 @@ async def handle_start_quiz(client: Client, callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
     
     # Check if the user has an active quiz
-    if user_id not in active_quizzes:
-        await callback_query.answer("No active quiz found. Please start a new one with /quiz")
+    session = active_quizzes.get(user_id)
+    if session is None:
+        await outbound.answer(callback_query, "No active quiz found. Please start a new one with /quiz")
         return
     
-    # Answer the callback to remove the loading state
-    await callback_query.answer("Starting quiz...")
+    # Ignore repeated clicks once the countdown is running
+    if session.timer is not None:
+        await outbound.answer(callback_query)
+        return
+    
+    # Start the countdown; its first timer is set before any await, so a second click is ignored
+    await countdown(client, session)
     
-    # Start the countdown
-    await countdown(callback_query.message, user_id)
+    # Answer the callback to remove the loading state
+    await outbound.answer(callback_query, "Starting quiz...")
 
 @Client.on_callback_query(filters.regex(r'^answer_(\d+)_(\d+)$'))
 async def handle_quiz_answer(client: Client, callback_query: CallbackQuery):
@@ -194,8 +319,9 @@ async def handle_quiz_answer(client: Client, callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
     
     # Check if the user has an active quiz
-    if user_id not in active_quizzes:
-        await callback_query.answer("No active quiz found. Please start a new one with /quiz")
+    session = active_quizzes.get(user_id)
+    if session is None:
+        await outbound.answer(callback_query, "No active quiz found. Please start a new one with /quiz")
         return
     
     # Parse the callback data
@@ -204,28 +330,29 @@ async def handle_quiz_answer(client: Client, callback_query: CallbackQuery):
     selected_option = int(parts[2])
     
     # Check if this is the current question
-    if active_quizzes[user_id]["current_question"] != question_index:
-        await callback_query.answer("This question has already been answered or timed out")
+    if session.current_question != question_index:
+        await outbound.answer(callback_query, "This question has already been answered or timed out")
         return
     
-    # Get the user's questions and the correct answer
-    user_questions = active_quizzes[user_id]["questions"]
-    correct_answer = user_questions[question_index]["correct_answer"]
-    is_correct = (selected_option == correct_answer)
+    # Claim the question before any await, so a second tap on its buttons is rejected
+    session.current_question = question_index + 1
+    
+    # Check the answer and update the running score
+    question = session.question(question_index)
+    is_correct = session.record_answer(question_index, selected_option)
     
     # Record the answer
-    quiz_attempt_id = active_quizzes[user_id]["quiz_attempt_id"]
-    UserAnswer.create(
-        quiz_attempt=quiz_attempt_id,
-        question_id=user_questions[question_index]["id"],
-        selected_option=selected_option,
-        is_correct=is_correct,
-        answer_time=datetime.datetime.now()
+    await answer_buffer.add(
+        session.quiz_attempt_id,
+        question.id,
+        selected_option,
+        is_correct,
+        datetime.datetime.now()
     )
     
     # Provide feedback
     feedback = "✅ Correct!" if is_correct else "❌ Incorrect!"
-    await callback_query.answer(feedback)
+    await outbound.answer(callback_query, feedback)
     
     # Move to the next question
-    await send_question(callback_query.message, user_id, question_index + 1)
\ No newline at end of file
+    await send_question(client, user_id, question_index + 1)
\ No newline at end of file
@@ -0,0 +1,321 @@
+import asyncio
+import contextlib
+import functools
+import gc
+import hashlib
+import json
+import logging
+import marshal
+import operator
+import os
+import re
+import struct
+from array import array
+from collections import namedtuple
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+# Rendered (question, position, total) combinations kept per bank
+RENDER_CACHE_SIZE = 4096
+# Topic of questions that don't declare one
+DEFAULT_TOPIC = "passive_voice"
+# Characters read per step by the streaming parser
+PARSE_CHUNK_SIZE = 64 * 1024
+# Seconds between checks of the question file's modification time
+RELOAD_INTERVAL = 5
+# Compiled banks are stored next to their JSON file with this suffix
+COMPILED_SUFFIX = ".bank"
+# Bytes hashed per read when fingerprinting a question file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+# One immutable question of the bank
+Question = namedtuple("Question", ["id", "question", "options", "correct_answer", "topic"])
+
+# Compiled bank header: magic, marshal format version, SHA-256 of the JSON file
+_COMPILED_MAGIC = b"GQBANK01"
+_COMPILED_HEADER = struct.Struct("<8sI32s")
+_QUESTIONS_ARRAY = re.compile(r'"questions"\s*:\s*\[')
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_questions(path, chunk_size=PARSE_CHUNK_SIZE):
+    """Yield the objects of the top-level "questions" array one at a time.
+
+    Only the question being decoded is held in memory, so banks with tens of
+    thousands of items load without building the whole document first.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        # Find the start of the questions array
+        buffer = ""
+        while True:
+            match = _QUESTIONS_ARRAY.search(buffer)
+            if match:
+                buffer = buffer[match.end():]
+                break
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError(f'{path} has no "questions" array')
+            # Keep a short tail in case the key was split between chunks
+            buffer = buffer[-32:] + chunk
+
+        pos = 0
+        while True:
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+
+
+def file_digest(path):
+    """SHA-256 of a file's content, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def load_compiled(path, digest):
+    """Payload of a compiled bank, or None if it is missing, stale or unreadable"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    header = _COMPILED_HEADER.size
+    if len(data) < header or _COMPILED_HEADER.unpack_from(data) != (_COMPILED_MAGIC, marshal.version, digest):
+        return None
+    try:
+        return marshal.loads(data[header:])
+    except (EOFError, ValueError, TypeError):
+        logger.warning("Ignoring corrupt compiled question bank %s", path)
+        return None
+
+
+def save_compiled(path, digest, payload):
+    """Write a compiled bank; the rename makes it appear complete or not at all"""
+    partial = path + ".tmp"
+    with open(partial, "wb") as f:
+        f.write(_COMPILED_HEADER.pack(_COMPILED_MAGIC, marshal.version, digest))
+        f.write(marshal.dumps(payload))
+    os.replace(partial, path)
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Skip cyclic GC passes while many acyclic tuples are being allocated"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class QuestionBank:
+    """Immutable question list shared by every quiz session"""
+
+    def __init__(self, questions):
+        self.questions = tuple(
+            Question(
+                q["id"],
+                q["question"],
+                tuple(q["options"]),
+                q["correct_answer"],
+                q.get("topic", DEFAULT_TOPIC),
+            )
+            for q in questions
+        )
+        self._build_indexes()
+
+    def _build_indexes(self):
+        self._set_index_by_id()
+        # Correct option of every question, indexed like ``questions``
+        self.correct_options = array("b", (q.correct_answer for q in self.questions))
+        # Question indexes of every topic
+        self._indexes_by_topic = {}
+        for index, q in enumerate(self.questions):
+            self._indexes_by_topic.setdefault(q.topic, array(self.index_typecode)).append(index)
+        # Rendered messages are cached per bank, a reloaded bank starts empty
+        self.render = functools.lru_cache(maxsize=RENDER_CACHE_SIZE)(self._render)
+
+    def _set_index_by_id(self):
+        self._index_by_id = dict(zip(map(operator.itemgetter(0), self.questions), range(len(self.questions))))
+        if len(self._index_by_id) != len(self.questions):
+            raise ValueError("Question ids must be unique")
+        # Smallest array type code able to index every question
+        self.index_typecode = "H" if len(self.questions) <= 0xFFFF else "I"
+
+    def compiled(self):
+        """Marshal-friendly form of the bank, including its prebuilt index arrays"""
+        return (
+            tuple(map(tuple, self.questions)),
+            self.correct_options.tobytes(),
+            {topic: indexes.tobytes() for topic, indexes in self._indexes_by_topic.items()},
+        )
+
+    @classmethod
+    def from_compiled(cls, payload):
+        """Rebuild a bank from ``compiled()`` output without re-deriving its arrays"""
+        rows, correct_options, indexes_by_topic = payload
+        bank = cls.__new__(cls)
+        with _gc_paused():
+            bank.questions = tuple(map(Question._make, rows))
+        bank._set_index_by_id()
+        bank.correct_options = array("b", correct_options)
+        bank._indexes_by_topic = {}
+        for topic, indexes in indexes_by_topic.items():
+            bank._indexes_by_topic[topic] = array(bank.index_typecode)
+            bank._indexes_by_topic[topic].frombytes(indexes)
+        bank.render = functools.lru_cache(maxsize=RENDER_CACHE_SIZE)(bank._render)
+        return bank
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a bank from its compiled form if it matches the JSON file, else parse and compile it"""
+        digest = file_digest(path)
+        compiled_path = path + COMPILED_SUFFIX
+        with _gc_paused():
+            payload = load_compiled(compiled_path, digest)
+        if payload is not None:
+            return cls.from_compiled(payload)
+        bank = cls(iter_questions(path))
+        try:
+            save_compiled(compiled_path, digest, bank.compiled())
+        except OSError as e:
+            # A read-only checkout still works, it just parses on every start
+            logger.warning("Could not write compiled question bank %s: %s", compiled_path, e)
+        return bank
+
+    def __len__(self):
+        return len(self.questions)
+
+    def __getitem__(self, index):
+        return self.questions[index]
+
+    @property
+    def topics(self):
+        return sorted(self._indexes_by_topic)
+
+    def index_of(self, question_id):
+        """Position of a question in the bank, raises KeyError if it is unknown"""
+        return self._index_by_id[question_id]
+
+    def by_id(self, question_id):
+        return self.questions[self._index_by_id[question_id]]
+
+    def new_order(self, rng, topic=None, count=None):
+        """Return a compact, shuffled permutation of question indexes.
+
+        With a topic only that topic's questions are used, at O(k) cost for
+        k questions in the topic. With a count at most that many questions
+        are drawn, at O(count) cost. Raises KeyError for an unknown topic.
+        """
+        if topic is None:
+            population = range(len(self.questions))
+        else:
+            population = self._indexes_by_topic[topic]
+        if count is not None and count < len(population):
+            return array(self.index_typecode, rng.sample(population, count))
+        order = array(self.index_typecode, population)
+        rng.shuffle(order)
+        return order
+
+    def _render(self, index, position, total):
+        """Build the message text and answer keyboard for a question.
+
+        The output only depends on its arguments, so callers get the cached
+        (text, reply_markup) pair through ``render``. Treat it as read-only.
+        """
+        question = self.questions[index]
+
+        # Create inline keyboard with options
+        keyboard = []
+        for i, option in enumerate(question.options):
+            keyboard.append([InlineKeyboardButton(
+                f"{chr(65+i)}. {option}",
+                callback_data=f"answer_{position}_{i}"
+            )])
+
+        text = f"Question {position + 1}/{total}:\n\n{question.question}"
+        return text, InlineKeyboardMarkup(keyboard)
+
+    def clear_render_cache(self):
+        self.render.cache_clear()
+
+
+class QuestionBankLoader:
+    """Keep the current QuestionBank for a file and reload it when it changes.
+
+    A reload parses the file on a worker thread and then swaps ``current`` in
+    one assignment. Sessions keep a reference to the bank they started with,
+    so quizzes in flight are not affected by a reload.
+    """
+
+    def __init__(self, path, reload_interval=RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._mtime = None
+        self._current = None
+        self._task = None
+
+    @property
+    def current(self):
+        """The current bank, loaded on first use rather than at import"""
+        if self._current is None:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            self._current = QuestionBank.from_file(self.path)
+        return self._current
+
+    async def load(self):
+        """Load the bank on a worker thread unless it is loaded already"""
+        if self._current is None:
+            await asyncio.to_thread(lambda: self.current)
+        return self._current
+
+    def start(self):
+        """Start watching the question file"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def reload_if_changed(self):
+        """Reload the bank if the file's mtime changed; returns True on reload"""
+        mtime = os.stat(self.path).st_mtime_ns
+        if self._current is None or mtime == self._mtime:
+            return False
+        # Remember the mtime first so a broken file is only reported once
+        self._mtime = mtime
+        bank = await asyncio.to_thread(QuestionBank.from_file, self.path)
+        self._current = bank
+        logger.info("Reloaded %d questions in %d topics from %s", len(bank), len(bank.topics), self.path)
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload_if_changed()
+            except Exception:
+                # Keep serving the previous bank until the file is fixed
+                logger.exception("Failed to reload questions from %s", self.path)
@@ -0,0 +1,90 @@
+from array import array
+
+# Array type code used to persist question ids
+QUESTION_ID_TYPECODE = "q"
+
+
+class QuizSession:
+    """State of one user's quiz.
+
+    Questions are referenced by index into the shared QuestionBank through a
+    compact permutation array, so a session costs a few hundred bytes no
+    matter how large the bank is.
+    """
+
+    __slots__ = (
+        "user_id",
+        "chat_id",
+        "bank",
+        "order",
+        "quiz_attempt_id",
+        "current_question",
+        "message_id",
+        "deadline",
+        "timer",
+        "correct",
+        "answered",
+    )
+
+    def __init__(self, user_id, chat_id, bank, order, quiz_attempt_id):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.bank = bank
+        self.order = order
+        self.quiz_attempt_id = quiz_attempt_id
+        self.current_question = -1
+        self.message_id = None
+        self.deadline = None
+        self.timer = None
+        # Running tally, so finishing a quiz needs no re-aggregation
+        self.correct = 0
+        self.answered = 0
+
+    @property
+    def total_questions(self):
+        return len(self.order)
+
+    def question(self, position):
+        """Return the question shown at the given position of this quiz"""
+        return self.bank[self.order[position]]
+
+    def record_answer(self, position, selected_option):
+        """Score an answer to the question at ``position``; returns whether it was correct"""
+        is_correct = self.bank.correct_options[self.order[position]] == selected_option
+        self.answered += 1
+        if is_correct:
+            self.correct += 1
+        return is_correct
+
+    def to_row(self):
+        """Serialize the session for the session store"""
+        question_ids = array(QUESTION_ID_TYPECODE, (self.bank[index].id for index in self.order))
+        return {
+            "user_id": self.user_id,
+            "chat_id": self.chat_id,
+            "quiz_attempt_id": self.quiz_attempt_id,
+            "question_ids": question_ids.tobytes(),
+            "current_question": self.current_question,
+            "message_id": self.message_id,
+            "deadline": self.deadline,
+            "correct": self.correct,
+            "answered": self.answered,
+        }
+
+    @classmethod
+    def from_row(cls, row, bank):
+        """Rebuild a session from the session store, or None if its questions are gone"""
+        question_ids = array(QUESTION_ID_TYPECODE)
+        question_ids.frombytes(bytes(row.question_ids))
+        try:
+            order = array(bank.index_typecode, (bank.index_of(question_id) for question_id in question_ids))
+        except KeyError:
+            return None
+
+        session = cls(row.user_id, row.chat_id, bank, order, row.quiz_attempt_id)
+        session.current_question = row.current_question
+        session.message_id = row.message_id
+        session.deadline = row.deadline
+        session.correct = row.correct
+        session.answered = row.answered
+        return session
@@ -0,0 +1,156 @@
+import asyncio
+import datetime
+import logging
+import time
+import cleanup
+from archive import archive
+from database import run_write
+
+# Seconds a single delete transaction should take at most
+CHUNK_TIME_BUDGET = 0.05
+# Bounds for the adaptive number of attempts deleted per transaction
+MIN_CHUNK_SIZE = 10
+MAX_CHUNK_SIZE = 1000
+# Seconds to yield between chunks so quiz writes can interleave
+CHUNK_PAUSE = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    """What the background retention job deletes; 0 disables a rule"""
+
+    def __init__(self, keep_days=0, incomplete_hours=0, interval_minutes=60, archive=False):
+        self.keep_days = keep_days
+        self.incomplete_hours = incomplete_hours
+        self.interval_minutes = interval_minutes
+        self.archive = archive
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            keep_days=config.retention_days,
+            incomplete_hours=config.retention_incomplete_hours,
+            interval_minutes=config.retention_interval_minutes,
+            archive=config.retention_archive,
+        )
+
+    @property
+    def enabled(self):
+        return self.keep_days > 0 or self.incomplete_hours > 0
+
+    def describe(self):
+        rules = []
+        if self.keep_days > 0:
+            action = "archive" if self.archive else "delete"
+            rules.append(f"keep quiz attempts for {self.keep_days} days, then {action} them")
+        if self.incomplete_hours > 0:
+            rules.append(f"drop incomplete attempts after {self.incomplete_hours} hours")
+        return ", ".join(rules) or "disabled"
+
+
+class RetentionJob:
+    """Enforce a RetentionPolicy in the background in small, time-budgeted deletes.
+
+    Each chunk is its own short transaction on the writer thread. The chunk
+    size adapts so a transaction stays within CHUNK_TIME_BUDGET, and the job
+    sleeps between chunks so quiz writes queued behind it get their turn.
+    """
+
+    def __init__(self, policy=None):
+        self.policy = policy or RetentionPolicy()
+        self.chunk_size = MIN_CHUNK_SIZE
+        self.last_run_started = None
+        self.last_run_duration = 0.0
+        self.last_run_quizzes = 0
+        self.last_run_answers = 0
+        self.last_run_lock_wait = 0.0
+        self.max_lock_wait = 0.0
+        self.total_rows_deleted = 0
+        self.last_error = None
+        self._task = None
+
+    def start(self):
+        """Start the periodic job if the policy enables any rule"""
+        if self._task is None and self.policy.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self):
+        """Apply the policy once and return the number of rows deleted"""
+        started = time.monotonic()
+        self.last_run_started = datetime.datetime.now()
+        self.last_run_quizzes = 0
+        self.last_run_answers = 0
+        self.last_run_lock_wait = 0.0
+
+        now = datetime.datetime.now()
+        if self.policy.incomplete_hours > 0:
+            cutoff_date = now - datetime.timedelta(hours=self.policy.incomplete_hours)
+            await self._delete(cleanup.INCOMPLETE_QUIZZES, cutoff_date)
+        if self.policy.keep_days > 0:
+            cutoff_date = now - datetime.timedelta(days=self.policy.keep_days)
+            if self.policy.archive:
+                # Whole segments, written off the writer thread
+                result = await archive.archive_attempts(cutoff_date)
+                self.last_run_quizzes += result.quizzes
+                self.last_run_answers += result.answers
+            else:
+                await self._delete(cleanup.OLD_QUIZZES, cutoff_date)
+
+        self.last_run_duration = time.monotonic() - started
+        deleted = self.last_run_quizzes + self.last_run_answers
+        self.total_rows_deleted += deleted
+        return deleted
+
+    async def _delete(self, target, cutoff_date):
+        after_id = 0
+        while True:
+            after_id, quizzes, answers, lock_wait, elapsed = await run_write(
+                _timed_chunk, time.monotonic(), target, cutoff_date, after_id, self.chunk_size
+            )
+            self.last_run_lock_wait += lock_wait
+            self.max_lock_wait = max(self.max_lock_wait, lock_wait)
+            if after_id is None:
+                return
+            self.last_run_quizzes += quizzes
+            self.last_run_answers += answers
+            self._adapt_chunk_size(elapsed)
+            # Let quiz writes waiting for the writer thread go first
+            await asyncio.sleep(CHUNK_PAUSE)
+
+    def _adapt_chunk_size(self, elapsed):
+        if elapsed > CHUNK_TIME_BUDGET:
+            self.chunk_size = max(MIN_CHUNK_SIZE, self.chunk_size // 2)
+        elif elapsed < CHUNK_TIME_BUDGET / 2:
+            self.chunk_size = min(MAX_CHUNK_SIZE, self.chunk_size * 2)
+
+    async def _run(self):
+        while True:
+            try:
+                deleted = await self.run_once()
+                self.last_error = None
+                if deleted:
+                    logger.info("Retention deleted %d rows in %.1fs", deleted, self.last_run_duration)
+            except Exception as e:
+                self.last_error = str(e)
+                logger.exception("Retention run failed")
+            await asyncio.sleep(self.policy.interval_minutes * 60)
+
+
+def _timed_chunk(submitted, target, cutoff_date, after_id, limit):
+    """Delete one chunk and measure how long it waited for the writer (runs on the writer thread)"""
+    started = time.monotonic()
+    after_id, quizzes, answers = cleanup.delete_attempts_chunk(target, cutoff_date, after_id, limit)
+    return after_id, quizzes, answers, started - submitted, time.monotonic() - started
+
+
+retention_job = RetentionJob()
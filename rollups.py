@@ -0,0 +1,130 @@
+import datetime
+from collections import Counter, defaultdict
+from peewee import chunked, fn
+from models import User, QuizAttempt, UserAnswer, DailyStats
+
+# Functions in this module run on the database executor threads
+
+# Days recomputed by the catch-up rebuild
+ROLLUP_CATCH_UP_DAYS = 2
+
+COUNTERS = (
+    "new_users",
+    "quizzes_started",
+    "quizzes_completed",
+    "answers",
+    "correct_answers",
+    "score_sum",
+)
+
+
+def _bump(day, **increments):
+    """Add to the counters of one day, creating the row if needed"""
+    DailyStats.insert(day=day, **increments).on_conflict(
+        conflict_target=[DailyStats.day],
+        update={getattr(DailyStats, name): getattr(DailyStats, name) + value for name, value in increments.items()}
+    ).execute()
+
+
+def record_new_user(joined_date):
+    _bump(joined_date.date(), new_users=1)
+
+
+def record_users_deleted(user_ids):
+    """Take deleted users out of the new-user counts of their join days, as a rebuild would"""
+    user_day = fn.date(User.joined_date).coerce(False)
+    query = (User
+             .select(user_day, fn.COUNT(User.id))
+             .where(User.id.in_(user_ids))
+             .group_by(user_day))
+    for day, count in query.tuples():
+        _bump(datetime.date.fromisoformat(day), new_users=-count)
+
+
+def record_quiz_started(start_time):
+    _bump(start_time.date(), quizzes_started=1)
+
+
+def record_quiz_completed(end_time, score):
+    _bump(end_time.date(), quizzes_completed=1, score_sum=score)
+
+
+def record_answers(rows):
+    """Count a batch of answer rows; timed-out answers count on the day they are written"""
+    today = datetime.date.today()
+    answers = Counter()
+    correct = Counter()
+    for row in rows:
+        day = row["answer_time"].date() if row["answer_time"] else today
+        answers[day] += 1
+        if row["is_correct"]:
+            correct[day] += 1
+    for day, count in answers.items():
+        _bump(day, answers=count, correct_answers=correct[day])
+
+
+def rebuild_rollups(since=None):
+    """Recompute the rollups of every day from ``since`` (a date) on from the raw tables.
+
+    Without ``since`` all history is rebuilt. Days whose raw rows were already
+    deleted by cleanup or retention lose their counts, so the catch-up job
+    should only go back a few days. Returns the number of days written.
+    """
+    start = datetime.datetime.combine(since or datetime.date.min, datetime.time.min)
+    days = defaultdict(Counter)
+
+    def collect(query, *counters):
+        for day, *values in query.tuples():
+            day = datetime.date.fromisoformat(day)
+            for counter, value in zip(counters, values):
+                days[day][counter] += value or 0
+
+    user_day = fn.date(User.joined_date).coerce(False)
+    collect(User
+            .select(user_day, fn.COUNT(User.id))
+            .where(User.joined_date >= start)
+            .group_by(user_day),
+            "new_users")
+
+    start_day = fn.date(QuizAttempt.start_time).coerce(False)
+    collect(QuizAttempt
+            .select(start_day, fn.COUNT(QuizAttempt.id))
+            .where(QuizAttempt.start_time >= start)
+            .group_by(start_day),
+            "quizzes_started")
+
+    end_day = fn.date(QuizAttempt.end_time).coerce(False)
+    collect(QuizAttempt
+            .select(end_day, fn.COUNT(QuizAttempt.id), fn.SUM(QuizAttempt.score))
+            .where(QuizAttempt.end_time >= start)
+            .group_by(end_day),
+            "quizzes_completed", "score_sum")
+
+    # Timed-out answers have no answer time, count them on the attempt's start day
+    answered_at = fn.COALESCE(UserAnswer.answer_time, QuizAttempt.start_time)
+    answer_day = fn.date(answered_at).coerce(False)
+    collect(UserAnswer
+            .select(answer_day, fn.COUNT(UserAnswer.id), fn.SUM(UserAnswer.is_correct))
+            .join(QuizAttempt)
+            .where(answered_at >= start)
+            .group_by(answer_day),
+            "answers", "correct_answers")
+
+    DailyStats.delete().where(DailyStats.day >= start.date()).execute()
+    rows = [dict({name: counters[name] for name in COUNTERS}, day=day) for day, counters in days.items()]
+    for chunk in chunked(rows, 100):
+        DailyStats.insert_many(chunk).execute()
+    return len(rows)
+
+
+def catch_up_rollups(days=ROLLUP_CATCH_UP_DAYS):
+    """Rebuild the rollups of the last ``days`` days, today included"""
+    return rebuild_rollups(datetime.date.today() - datetime.timedelta(days=days - 1))
+
+
+def load_totals(since=None):
+    """Sum the rollups of every day from ``since`` on (all days without it)"""
+    query = DailyStats.select(*[fn.COALESCE(fn.SUM(getattr(DailyStats, name)), 0) for name in COUNTERS])
+    if since is not None:
+        query = query.where(DailyStats.day >= since)
+    return dict(zip(COUNTERS, query.tuples().get()))
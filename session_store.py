@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from peewee import chunked
+from models import QuizSessionState
+from database import run_read, run_write
+
+# Persist changed sessions at least this often (seconds)
+FLUSH_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Write-behind persistence for active quiz sessions.
+
+    Every state transition only records a snapshot of the session in memory;
+    the background task writes all changed sessions in one transaction per
+    FLUSH_INTERVAL. A session that changes several times between flushes is
+    written once, and a finished session is simply deleted.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._dirty = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+
+    def start(self):
+        """Start the background flusher"""
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the background flusher and persist every pending change"""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def save(self, session):
+        """Record the current state of a session"""
+        self._dirty[session.user_id] = session.to_row()
+
+    def discard(self, user_id):
+        """Forget a finished session"""
+        self._dirty[user_id] = None
+
+    async def load(self):
+        """Return every persisted session row"""
+        return await run_read(_load_sessions)
+
+    async def flush(self):
+        """Write every pending change in one transaction"""
+        async with self._flush_lock:
+            changes, self._dirty = self._dirty, {}
+            if not changes:
+                return 0
+            rows = [row for row in changes.values() if row is not None]
+            deleted = [user_id for user_id, row in changes.items() if row is None]
+            try:
+                await run_write(_write_sessions, rows, deleted)
+            except Exception:
+                # Keep newer changes, retry the rest on the next flush
+                for user_id, row in changes.items():
+                    self._dirty.setdefault(user_id, row)
+                raise
+            return len(changes)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to persist %d quiz sessions", len(self._dirty))
+
+
+def _load_sessions():
+    """Load every persisted session (runs on a reader thread)"""
+    return list(QuizSessionState.select())
+
+
+def _write_sessions(rows, deleted):
+    """Upsert changed sessions and delete finished ones (runs on the writer thread)"""
+    for chunk in chunked(rows, 100):
+        QuizSessionState.insert_many(chunk).on_conflict_replace().execute()
+    for chunk in chunked(deleted, 500):
+        QuizSessionState.delete().where(QuizSessionState.user_id.in_(chunk)).execute()
+
+
+session_store = SessionStore()
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import database
+import models
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point the database at a fresh file, served by executor threads of its own.
+
+    Tables are not created, so migration tests can start from an older schema.
+    """
+    path = str(tmp_path / "grammar_bot.db")
+    models.db.init(path, pragmas=models.DATABASE_PRAGMAS, timeout=10)
+    # Executor threads keep their connection, a new executor opens new ones
+    executor = database.DatabaseExecutor()
+    monkeypatch.setattr(database, "executor", executor)
+    yield path
+    executor.shutdown()
+    models.db.close()
+
+
+@pytest.fixture
+def db(db_path):
+    """A fresh database at the current schema version"""
+    models.create_tables()
+    return models.db
@@ -0,0 +1,92 @@
+import asyncio
+import datetime
+import os
+
+import numpy as np
+
+from archive import Archive, PARTIAL_SUFFIX, SEGMENT_SUFFIX, load_archive_rows, write_segment
+from models import User, QuizAttempt, UserAnswer
+
+OLD = datetime.datetime(2024, 1, 1, 12, 0)
+CUTOFF = datetime.datetime(2025, 1, 1)
+
+
+def create_history(db):
+    """Three aged attempts with answers, one of them unfinished, and one recent attempt"""
+    with db.atomic():
+        user = User.create(user_id=42, first_name="Alice", joined_date=OLD)
+        for index in range(3):
+            finished = index < 2
+            attempt = QuizAttempt.create(
+                user=user, start_time=OLD + datetime.timedelta(days=index),
+                end_time=OLD if finished else None, score=index, total_questions=2,
+            )
+            UserAnswer.create(quiz_attempt=attempt, question_id=10, selected_option=1, is_correct=True, answer_time=OLD)
+            UserAnswer.create(quiz_attempt=attempt, question_id=11, selected_option=None, is_correct=False)
+        recent = QuizAttempt.create(user=user, start_time=datetime.datetime.now(), score=0, total_questions=2)
+        UserAnswer.create(quiz_attempt=recent, question_id=10, selected_option=0, is_correct=False)
+    return recent
+
+
+def test_archive_round_trip(db, tmp_path):
+    recent = create_history(db)
+    archive = Archive(str(tmp_path / "archive"), segment_attempts=2)
+
+    result = asyncio.run(archive.archive_attempts(CUTOFF))
+
+    assert (result.quizzes, result.answers) == (3, 6)
+    assert [attempt.id for attempt in QuizAttempt.select()] == [recent.id]
+    assert UserAnswer.select().count() == 1
+    # Two attempts per segment, every segment published
+    assert len(archive.segment_paths()) == 2
+    assert not [name for name in os.listdir(archive.directory) if name.endswith(PARTIAL_SUFFIX)]
+    segments, attempts, answers, size, raw = archive.summary()
+    assert (segments, attempts, answers) == (2, 3, 6)
+    assert 0 < size
+
+    ids = np.concatenate([segment.column("attempts", "id") for segment in archive.segments()])
+    assert ids.tolist() == [1, 2, 3]
+    with_user = {int(segment.column("attempts", "user_id")[0]) for segment in archive.segments()}
+    assert with_user == {42}
+    # Timed-out answers keep their NULLs as -1
+    options = np.concatenate([block["selected_option"] for segment in archive.segments()
+                              for block in segment.blocks("answers")])
+    assert sorted(options.tolist()) == [-1, -1, -1, 1, 1, 1]
+    # Unfinished attempts are left out of the item analysis input
+    batches = list(archive.answer_batches())
+    assert sum(len(question_ids) for question_ids, _, _, _ in batches) == 4
+    assert archive.question_breakdown(42) == [(10, 3, 3), (11, 3, 0)]
+
+
+def test_recover_finishes_a_written_segment(db, tmp_path):
+    create_history(db)
+    archive = Archive(str(tmp_path / "archive"))
+    os.makedirs(archive.directory)
+    # Crashed after writing the segment, before deleting its rows
+    tables = load_archive_rows(CUTOFF, 0, 10)
+    partial = os.path.join(archive.directory, "000000000001-000000000003" + PARTIAL_SUFFIX)
+    write_segment(partial, tables)
+
+    asyncio.run(archive.recover())
+
+    assert not os.path.exists(partial)
+    assert archive.segment_paths() == [partial[:-len(PARTIAL_SUFFIX)] + SEGMENT_SUFFIX]
+    assert QuizAttempt.select().count() == 1
+    assert UserAnswer.select().count() == 1
+
+
+def test_recover_discards_a_torn_segment(db, tmp_path):
+    create_history(db)
+    archive = Archive(str(tmp_path / "archive"))
+    os.makedirs(archive.directory)
+    # Crashed while writing: the file has no footer and nothing was deleted
+    partial = os.path.join(archive.directory, "000000000001-000000000003" + PARTIAL_SUFFIX)
+    with open(partial, "wb") as f:
+        f.write(b"GQARCH01 torn")
+
+    asyncio.run(archive.recover())
+
+    assert not os.path.exists(partial)
+    assert archive.segment_paths() == []
+    assert QuizAttempt.select().count() == 4
+    assert UserAnswer.select().count() == 7
@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+
+from leaderboard import Leaderboard, ScoreRanks, TopK
+from models import User, QuizAttempt
+from user_stats import rebuild_user_stats
+
+
+def test_topk_keeps_highest_keys():
+    top = TopK(k=3)
+    for user_id, key in [(1, 5), (2, 1), (3, 7), (4, 3), (5, 6)]:
+        top.offer(user_id, key, f"payload{user_id}")
+    assert [(user_id, key) for user_id, key, _ in top.items()] == [(3, 7), (5, 6), (1, 5)]
+    assert top.items()[0][2] == "payload3"
+
+
+def test_topk_member_improves_and_never_drops():
+    top = TopK(k=2)
+    top.offer(1, 5)
+    top.offer(2, 4)
+    top.offer(2, 9)
+    # A lower key for a member is ignored
+    top.offer(1, 1)
+    assert [(user_id, key) for user_id, key, _ in top.items()] == [(2, 9), (1, 5)]
+    # The evicted user can come back with a higher key
+    top.offer(3, 6)
+    assert [user_id for user_id, _, _ in top.items()] == [2, 3]
+    top.offer(1, 10)
+    assert [user_id for user_id, _, _ in top.items()] == [1, 2]
+
+
+def test_score_ranks_share_ties():
+    ranks = ScoreRanks(size=4)
+    for score in (3, 7, 7, 1):
+        ranks.add(score, 1)
+    assert ranks.total == 4
+    assert ranks.rank(7) == 1
+    assert ranks.rank(3) == 3
+    assert ranks.rank(1) == 4
+    assert ranks.count_above(0) == 4
+
+
+def test_score_ranks_grow_past_initial_size():
+    ranks = ScoreRanks(size=2)
+    ranks.add(1, 1)
+    ranks.add(100, 1)
+    ranks.add(50, 2)
+    assert ranks.rank(100) == 1
+    assert ranks.rank(50) == 2
+    assert ranks.rank(1) == 4
+    ranks.add(50, -2)
+    assert ranks.rank(1) == 2
+
+
+def test_record_score_moves_users_between_ranks():
+    board = Leaderboard(size=2)
+    assert board.rank(1) is None
+    board.record_score(1, 5, 10)
+    board.record_score(2, 8, 10)
+    assert board.rank(1) == (2, 2)
+    board.record_score(1, 9, 10)
+    assert board.rank(1) == (1, 2)
+    assert board.rank(2) == (2, 2)
+    # A worse score leaves the best one in place
+    board.record_score(1, 2, 10)
+    assert board.rank(1) == (1, 2)
+    assert [user_id for user_id, _, _ in board.top_scores.items()] == [1, 2]
+
+
+def test_record_attempt_orders_most_active():
+    board = Leaderboard(size=2)
+    for user_id in (1, 2, 2, 3, 3, 3):
+        board.record_attempt(user_id)
+    assert [(user_id, attempts) for user_id, attempts, _ in board.most_active.items()] == [(3, 3), (2, 2)]
+
+
+def test_reload_matches_incremental_updates(db):
+    now = datetime.datetime.now()
+    board = Leaderboard()
+    with db.atomic():
+        for telegram_id, scores in {10: [3, 7], 20: [5], 30: [None]}.items():
+            user = User.create(user_id=telegram_id, first_name=str(telegram_id), joined_date=now)
+            for score in scores:
+                board.record_attempt(telegram_id)
+                end_time = None if score is None else now
+                QuizAttempt.create(user=user, start_time=now, end_time=end_time,
+                                   score=score or 0, total_questions=10)
+                if score is not None:
+                    board.record_score(telegram_id, score, 10)
+        rebuild_user_stats()
+
+    reloaded = Leaderboard()
+    asyncio.run(reloaded.reload())
+    assert reloaded.top_scores.items() == board.top_scores.items()
+    assert reloaded.most_active.items() == board.most_active.items()
+    assert reloaded.rank(10) == board.rank(10) == (1, 2)
+    assert reloaded.rank(30) is None
@@ -0,0 +1,92 @@
+import datetime
+
+import models
+from migrations import SCHEMA_VERSION, get_schema_version
+from models import User, QuizAttempt, UserAnswer, UserStats, DailyStats, QuizSessionState
+from rollups import load_totals
+
+# Schema of a database created before migrations existed (version 0)
+BASELINE_SCHEMA = [
+    'CREATE TABLE "user" ("id" INTEGER NOT NULL PRIMARY KEY, "user_id" INTEGER NOT NULL, '
+    '"username" VARCHAR(255), "first_name" VARCHAR(255) NOT NULL, "last_name" VARCHAR(255), '
+    '"joined_date" DATETIME NOT NULL)',
+    'CREATE UNIQUE INDEX "user_user_id" ON "user" ("user_id")',
+    'CREATE TABLE "quizattempt" ("id" INTEGER NOT NULL PRIMARY KEY, "user_id" INTEGER NOT NULL, '
+    '"start_time" DATETIME NOT NULL, "end_time" DATETIME, "score" INTEGER NOT NULL, '
+    '"total_questions" INTEGER NOT NULL, FOREIGN KEY ("user_id") REFERENCES "user" ("id"))',
+    'CREATE TABLE "useranswer" ("id" INTEGER NOT NULL PRIMARY KEY, "quiz_attempt_id" INTEGER NOT NULL, '
+    '"question_id" INTEGER NOT NULL, "selected_option" INTEGER, "is_correct" INTEGER, '
+    '"answer_time" DATETIME, FOREIGN KEY ("quiz_attempt_id") REFERENCES "quizattempt" ("id"))',
+]
+
+
+def create_baseline(db):
+    with db:
+        for statement in BASELINE_SCHEMA:
+            db.execute_sql(statement)
+        day = datetime.datetime(2024, 3, 1, 12, 0)
+        alice = User.create(user_id=1, first_name="Alice", joined_date=day)
+        bob = User.create(user_id=2, first_name="Bob", joined_date=day + datetime.timedelta(days=1))
+        finished = QuizAttempt.create(user=alice, start_time=day, end_time=day, score=2, total_questions=3)
+        QuizAttempt.create(user=alice, start_time=day, end_time=day, score=1, total_questions=3)
+        QuizAttempt.create(user=bob, start_time=day, end_time=None, score=0, total_questions=0)
+        for question_id, is_correct in ((1, True), (2, True), (3, False)):
+            UserAnswer.create(quiz_attempt=finished, question_id=question_id, selected_option=0,
+                              is_correct=is_correct, answer_time=day)
+
+
+def test_baseline_database_is_migrated_and_backfilled(db_path):
+    db = models.db
+    create_baseline(db)
+    assert get_schema_version(db) == 0
+
+    models.create_tables()
+
+    assert get_schema_version(db) == SCHEMA_VERSION
+    stats = {row.user_id: row for row in UserStats.select()}
+    assert (stats[1].attempts, stats[1].completed, stats[1].best_score, stats[1].best_total) == (2, 2, 2, 3)
+    assert (stats[1].total_score, stats[1].total_questions) == (3, 6)
+    assert (stats[2].attempts, stats[2].completed) == (1, 0)
+    totals = load_totals()
+    assert totals["new_users"] == 2
+    assert totals["quizzes_started"] == 3
+    assert totals["quizzes_completed"] == 2
+    assert (totals["answers"], totals["correct_answers"]) == (3, 2)
+    assert DailyStats.select().count() == 2
+    # The indexes of migration 1 exist
+    indexes = {index.name for index in db.get_indexes("quizattempt")}
+    assert "quizattempt_user_id_end_time" in indexes
+    # The existing rows are untouched
+    assert User.select().count() == 2
+    assert UserAnswer.select().count() == 3
+
+
+def test_session_score_columns_are_added(db_path):
+    db = models.db
+    with db:
+        db.create_tables([User, QuizAttempt, UserAnswer])
+        # Version 3: sessions were persisted without their running score
+        db.execute_sql(
+            'CREATE TABLE "quizsessionstate" ("user_id" INTEGER NOT NULL PRIMARY KEY, '
+            '"chat_id" INTEGER NOT NULL, "quiz_attempt_id" INTEGER NOT NULL, "question_ids" BLOB NOT NULL, '
+            '"current_question" INTEGER NOT NULL, "message_id" INTEGER, "deadline" REAL)'
+        )
+        db.execute_sql(
+            'INSERT INTO "quizsessionstate" VALUES (7, 7, 1, ?, 2, 10, NULL)', (b"\x01" * 8,)
+        )
+        db.create_tables([UserStats])
+        db.pragma("user_version", 3)
+
+    models.create_tables()
+
+    columns = {column.name for column in db.get_columns("quizsessionstate")}
+    assert {"correct", "answered"} <= columns
+    session = QuizSessionState.get_by_id(7)
+    assert (session.current_question, session.correct, session.answered) == (2, 0, 0)
+
+
+def test_current_schema_is_left_alone(db):
+    User.create(user_id=1, first_name="Alice")
+    models.create_tables()
+    assert get_schema_version(db) == SCHEMA_VERSION
+    assert User.select().count() == 1
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+import outbound as outbound_module
+from outbound import OutboundScheduler, TokenBucket, PRIORITY_ANSWER, PRIORITY_TICK
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=10, capacity=2)
+    now = bucket.updated
+    assert bucket.delay(now) == 0
+    bucket.take()
+    bucket.take()
+    assert bucket.delay(now) == pytest.approx(0.1)
+    assert bucket.delay(now + 0.1) == pytest.approx(0)
+    assert bucket.full_in(now + 0.1) == pytest.approx(0.1)
+
+
+def test_token_bucket_pause_delays_tokens():
+    bucket = TokenBucket(rate=10, capacity=2)
+    bucket.pause(5)
+    assert bucket.delay(bucket.updated) == pytest.approx(5, abs=0.01)
+
+
+def test_pending_edits_of_a_message_are_coalesced(monkeypatch):
+    monkeypatch.setattr(outbound_module, "CHAT_RATE", float("inf"))
+    monkeypatch.setattr(outbound_module, "CHAT_BURST", float("inf"))
+
+    async def scenario():
+        scheduler = OutboundScheduler(rate=1000, burst=1000)
+        sent = []
+
+        async def edit(text):
+            sent.append(text)
+            return text
+
+        # The first call of the chat is in flight while the edits queue up
+        first = scheduler.submit(1, PRIORITY_TICK, lambda: edit("first"))
+        edits = [scheduler.submit(1, PRIORITY_TICK, lambda text=text: edit(text), key=(1, 99))
+                 for text in ("a", "b", "c")]
+        results = await asyncio.gather(first, *edits)
+        await scheduler.close()
+        return sent, results, scheduler.coalesced
+
+    sent, results, coalesced = asyncio.run(scenario())
+    assert sent == ["first", "c"]
+    # Every caller gets the result of the edit that was sent
+    assert results == ["first", "c", "c", "c"]
+    assert coalesced == 2
+
+
+def test_higher_priority_chats_go_first(monkeypatch):
+    async def scenario():
+        # One token a second: only the first send is immediate
+        scheduler = OutboundScheduler(rate=1, burst=1)
+        scheduler.bucket.take()
+        sent = []
+
+        async def send(label):
+            sent.append(label)
+
+        calls = [
+            scheduler.submit(1, PRIORITY_TICK, lambda: send("tick")),
+            scheduler.submit(2, PRIORITY_ANSWER, lambda: send("answer")),
+        ]
+        await asyncio.gather(*calls)
+        await scheduler.close()
+        return sent
+
+    assert asyncio.run(scenario()) == ["answer", "tick"]
+
+
+def test_share_splits_the_global_rate():
+    scheduler = OutboundScheduler()
+    scheduler.share(3)
+    assert scheduler.bucket.rate == outbound_module.GLOBAL_RATE / 3
+    scheduler.share(100)
+    # A process can always send at least one message in a burst
+    assert scheduler.bucket.capacity == 1
@@ -0,0 +1,108 @@
+import asyncio
+
+from timer_wheel import TimerWheel
+
+TICK = 0.01
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_timers_fire_in_deadline_order():
+    async def scenario():
+        wheel = TimerWheel(tick=TICK)
+        fired = []
+        wheel.schedule(0.05, fired.append, "late")
+        wheel.schedule(0.02, fired.append, "early")
+        assert wheel.pending == 2
+        await asyncio.sleep(0.1)
+        await wheel.close()
+        return fired, wheel.pending
+
+    fired, pending = run(scenario())
+    assert fired == ["early", "late"]
+    assert pending == 0
+
+
+def test_cancelled_timer_never_fires():
+    async def scenario():
+        wheel = TimerWheel(tick=TICK)
+        fired = []
+        timer = wheel.schedule(0.02, fired.append, "cancelled")
+        wheel.schedule(0.02, fired.append, "kept")
+        timer.cancel()
+        # Cancelling twice is a no-op
+        timer.cancel()
+        assert not timer.active
+        assert wheel.pending == 1
+        await asyncio.sleep(0.06)
+        await wheel.close()
+        return fired
+
+    assert run(scenario()) == ["kept"]
+
+
+def test_cancel_after_firing_is_a_no_op():
+    async def scenario():
+        wheel = TimerWheel(tick=TICK)
+        fired = []
+        timer = wheel.schedule(0, fired.append, 1)
+        await asyncio.sleep(0.03)
+        timer.cancel()
+        await wheel.close()
+        return fired, wheel.pending
+
+    assert run(scenario()) == ([1], 0)
+
+
+def test_coroutine_callbacks_run_as_tasks():
+    async def scenario():
+        wheel = TimerWheel(tick=TICK)
+        done = asyncio.Event()
+
+        async def callback(value):
+            await asyncio.sleep(0)
+            done.value = value
+            done.set()
+
+        wheel.schedule(0.01, callback, "ran")
+        await asyncio.wait_for(done.wait(), 1)
+        await wheel.close()
+        return done.value
+
+    assert run(scenario()) == "ran"
+
+
+def test_deadline_beyond_one_revolution():
+    async def scenario():
+        # Four slots cover 0.04s, the timer needs several revolutions
+        wheel = TimerWheel(tick=TICK, slots=4)
+        fired = []
+        wheel.schedule(0.1, fired.append, "far")
+        await asyncio.sleep(0.05)
+        early = list(fired)
+        await asyncio.sleep(0.1)
+        await wheel.close()
+        return early, fired
+
+    early, fired = run(scenario())
+    assert early == []
+    assert fired == ["far"]
+
+
+def test_failing_callback_does_not_stop_the_wheel():
+    async def scenario():
+        wheel = TimerWheel(tick=TICK)
+        fired = []
+
+        def fail():
+            raise RuntimeError("boom")
+
+        wheel.schedule(0.01, fail)
+        wheel.schedule(0.03, fired.append, "after")
+        await asyncio.sleep(0.08)
+        await wheel.close()
+        return fired
+
+    assert run(scenario()) == ["after"]
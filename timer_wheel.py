@@ -0,0 +1,144 @@
+import asyncio
+import itertools
+import logging
+import math
+import time
+
+# Resolution of the wheel in seconds
+TICK = 0.1
+# Number of slots; with the default tick one revolution covers ~102 seconds
+SLOTS = 1024
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    """Handle for a scheduled callback, returned by TimerWheel.schedule()"""
+
+    __slots__ = ("id", "target", "slot", "callback", "args", "wheel")
+
+    def __init__(self, timer_id, target, slot, callback, args, wheel):
+        self.id = timer_id
+        self.target = target
+        self.slot = slot
+        self.callback = callback
+        self.args = args
+        self.wheel = wheel
+
+    @property
+    def active(self):
+        return self.wheel is not None
+
+    def cancel(self):
+        """Cancel the timer in O(1); cancelling twice or after firing is a no-op"""
+        if self.wheel is not None:
+            self.wheel._remove(self)
+
+
+class TimerWheel:
+    """Hashed timing wheel driven by a single asyncio task.
+
+    Every deadline lands in slot ``target_tick % SLOTS``. The loop task wakes
+    once per tick, fires the timers of the current slot whose target tick has
+    been reached and leaves the others for a later revolution. Scheduling and
+    cancelling are O(1); there is no per-timer coroutine.
+    """
+
+    def __init__(self, tick=TICK, slots=SLOTS):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._ids = itertools.count()
+        self._pending = 0
+        self._current_tick = 0
+        self._origin = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self._running_callbacks = set()
+
+    @property
+    def pending(self):
+        """Number of timers that have not fired or been cancelled yet"""
+        return self._pending
+
+    def __len__(self):
+        return self._pending
+
+    def start(self):
+        """Start the loop task (called automatically by schedule())"""
+        if self._task is None:
+            self._origin = time.monotonic() - self._current_tick * self.tick
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the loop task; pending timers are dropped"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, delay, callback, *args):
+        """Call ``callback(*args)`` after ``delay`` seconds.
+
+        Coroutine functions are run as a task on the event loop.
+        """
+        self.start()
+        elapsed = (time.monotonic() - self._origin) / self.tick
+        target = max(math.ceil(elapsed + delay / self.tick), self._current_tick + 1)
+        slot = target % len(self._slots)
+        timer = Timer(next(self._ids), target, slot, callback, args, self)
+        self._slots[slot][timer.id] = timer
+        self._pending += 1
+        self._wakeup.set()
+        return timer
+
+    def _remove(self, timer):
+        del self._slots[timer.slot][timer.id]
+        timer.wheel = None
+        self._pending -= 1
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                # Nothing to do until the next schedule()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                # Skip the idle period instead of walking every empty slot
+                due = int((time.monotonic() - self._origin) / self.tick)
+                self._current_tick = max(self._current_tick, due - 1)
+            await asyncio.sleep(self.tick)
+            due = int((time.monotonic() - self._origin) / self.tick)
+            while self._current_tick < due and self._pending:
+                self._current_tick += 1
+                self._advance(self._current_tick)
+            self._current_tick = max(self._current_tick, due)
+
+    def _advance(self, tick):
+        slot = self._slots[tick % len(self._slots)]
+        if not slot:
+            return
+        expired = [timer for timer in slot.values() if timer.target <= tick]
+        for timer in expired:
+            self._remove(timer)
+            self._fire(timer)
+
+    def _fire(self, timer):
+        try:
+            result = timer.callback(*timer.args)
+        except Exception:
+            logger.exception("Timer callback %r failed", timer.callback)
+            return
+        if asyncio.iscoroutine(result):
+            task = asyncio.create_task(result)
+            self._running_callbacks.add(task)
+            task.add_done_callback(self._callback_done)
+
+    def _callback_done(self, task):
+        self._running_callbacks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Timer callback failed", exc_info=task.exception())
+
+
+timer_wheel = TimerWheel()
@@ -0,0 +1,104 @@
+from peewee import Case, JOIN, fn
+from models import User, QuizAttempt, UserAnswer, UserStats
+
+# Functions in this module run on the database executor threads
+
+
+def record_attempt_started(user_id, started_at):
+    """Count a new quiz attempt for a Telegram user"""
+    UserStats.insert(
+        user_id=user_id,
+        attempts=1,
+        last_activity=started_at
+    ).on_conflict(
+        conflict_target=[UserStats.user_id],
+        update={
+            UserStats.attempts: UserStats.attempts + 1,
+            UserStats.last_activity: started_at,
+        }
+    ).execute()
+
+
+def record_attempt_finished(user_id, score, total_questions):
+    """Add a completed attempt to a Telegram user's aggregates"""
+    is_best = (UserStats.completed == 0) | (UserStats.best_score < score)
+    UserStats.update(
+        completed=UserStats.completed + 1,
+        total_score=UserStats.total_score + score,
+        total_questions=UserStats.total_questions + total_questions,
+        best_score=Case(None, [(is_best, score)], UserStats.best_score),
+        best_total=Case(None, [(is_best, total_questions)], UserStats.best_total),
+    ).where(UserStats.user_id == user_id).execute()
+
+
+def get_user_stats(user_id):
+    """Return the aggregates of a Telegram user, or None if they never took a quiz"""
+    return UserStats.get_or_none(UserStats.user_id == user_id)
+
+
+def get_user_with_stats(user_id):
+    """Return a Telegram user with their aggregates as ``user.stats`` in one query, or None"""
+    query = (
+        User
+        .select(User, UserStats)
+        .join(UserStats, JOIN.LEFT_OUTER, on=(UserStats.user_id == User.user_id), attr='stats')
+        .where(User.user_id == user_id)
+    )
+    return query.get_or_none()
+
+
+def get_question_breakdown(user_id):
+    """Return (question_id, answered, correct) for every question a Telegram user saw.
+
+    One grouped scan over the user's answers, served by the covering
+    (quiz_attempt, question_id, is_correct) index.
+    """
+    query = (
+        UserAnswer
+        .select(UserAnswer.question_id, fn.COUNT(UserAnswer.id), fn.COALESCE(fn.SUM(UserAnswer.is_correct), 0))
+        .join(QuizAttempt)
+        .join(User)
+        .where(User.user_id == user_id)
+        .group_by(UserAnswer.question_id)
+    )
+    return list(query.tuples())
+
+
+def rebuild_user_stats():
+    """Recompute every user's aggregates from the quiz attempts (one-off backfill)"""
+    completed = QuizAttempt.end_time.is_null(False)
+    Best = QuizAttempt.alias()
+    best_total = (
+        Best
+        .select(Best.total_questions)
+        .where((Best.user == QuizAttempt.user) & Best.end_time.is_null(False))
+        .order_by(Best.score.desc())
+        .limit(1)
+    )
+    query = (
+        QuizAttempt
+        .select(
+            User.user_id,
+            fn.COUNT(QuizAttempt.id),
+            fn.COUNT(QuizAttempt.end_time),
+            fn.COALESCE(fn.SUM(Case(None, [(completed, QuizAttempt.score)], 0)), 0),
+            fn.COALESCE(fn.SUM(Case(None, [(completed, QuizAttempt.total_questions)], 0)), 0),
+            fn.COALESCE(fn.MAX(Case(None, [(completed, QuizAttempt.score)], None)), 0),
+            fn.COALESCE(best_total, 0),
+            fn.MAX(QuizAttempt.start_time),
+        )
+        .join(User)
+        .group_by(QuizAttempt.user)
+    )
+    UserStats.delete().execute()
+    UserStats.insert_from(query, [
+        UserStats.user_id,
+        UserStats.attempts,
+        UserStats.completed,
+        UserStats.total_score,
+        UserStats.total_questions,
+        UserStats.best_score,
+        UserStats.best_total,
+        UserStats.last_activity,
+    ]).execute()
+    return UserStats.select().count()
@@ -0,0 +1,442 @@
+"""Webhook ingestion mode: an alternative entry point to main.py.
+
+Telegram (or webhook_stub.py) POSTs Bot API updates to a local HTTP
+endpoint. The receiving process routes each update by a hash of its user
+id to one of several worker processes, so every user's quiz session lives
+in exactly one worker. Admin commands and maintenance all run in worker 0.
+Workers run the usual plugins and read the database directly, while all
+their writes go through one shared writer process, keeping SQLite to a
+single writer.
+
+    python webhook.py [--workers N] [--port PORT] [--secret TOKEN] [--offline]
+
+``--offline`` replaces outgoing Telegram calls with log lines, so the whole
+pipeline can be exercised without credentials or network access.
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import hmac
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import signal
+from pyrogram import Client, ContinuePropagation, StopPropagation, enums, types
+from pyrogram.handlers import CallbackQueryHandler, MessageHandler
+from config import ADMIN_USER_IDS
+
+WEBHOOK_HOST = "127.0.0.1"
+WEBHOOK_PORT = 8443
+WORKERS = 4
+# Seconds between leaderboard reloads; each worker only sees its own users' scores live
+LEADERBOARD_RELOAD_INTERVAL = 60
+# Largest update body accepted, Bot API updates are far smaller
+MAX_BODY_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+CHAT_TYPES = {
+    "private": enums.ChatType.PRIVATE,
+    "group": enums.ChatType.GROUP,
+    "supergroup": enums.ChatType.SUPERGROUP,
+    "channel": enums.ChatType.CHANNEL,
+}
+
+
+def update_user_id(update):
+    """Return the id of the user who sent a Bot API update, or None"""
+    for kind in ("message", "edited_message", "callback_query"):
+        payload = update.get(kind)
+        if payload is not None and "from" in payload:
+            return payload["from"]["id"]
+    return None
+
+
+def route(user_id, workers):
+    """Index of the worker serving ``user_id``.
+
+    Updates without a user go to worker 0, and so do the admins', so
+    /archive and /cleanup run in the same process as the retention job and
+    are serialised by the archive's lock.
+    """
+    if user_id is None or user_id in ADMIN_USER_IDS:
+        return 0
+    return user_id % workers
+
+
+# Bot API JSON -> pyrogram types
+
+def _user(client, data):
+    return types.User(
+        client=client,
+        id=data["id"],
+        is_bot=data.get("is_bot", False),
+        first_name=data.get("first_name"),
+        last_name=data.get("last_name"),
+        username=data.get("username"),
+    )
+
+
+def _chat(client, data):
+    return types.Chat(
+        client=client,
+        id=data["id"],
+        type=CHAT_TYPES.get(data.get("type"), enums.ChatType.PRIVATE),
+        title=data.get("title"),
+        username=data.get("username"),
+        first_name=data.get("first_name"),
+        last_name=data.get("last_name"),
+    )
+
+
+def parse_message(client, data):
+    reply = data.get("reply_to_message")
+    return types.Message(
+        client=client,
+        id=data["message_id"],
+        from_user=_user(client, data["from"]) if "from" in data else None,
+        chat=_chat(client, data["chat"]),
+        date=datetime.datetime.fromtimestamp(data.get("date", 0)),
+        text=data.get("text"),
+        reply_to_message_id=reply["message_id"] if reply else None,
+        reply_to_message=parse_message(client, reply) if reply else None,
+    )
+
+
+def parse_callback_query(client, data):
+    return types.CallbackQuery(
+        client=client,
+        id=data["id"],
+        from_user=_user(client, data["from"]),
+        chat_instance=data.get("chat_instance", ""),
+        message=parse_message(client, data["message"]) if "message" in data else None,
+        data=data.get("data"),
+    )
+
+
+def parse_update(client, update):
+    """Return (pyrogram update, handler type) for the update kinds the bot handles, or None"""
+    if "message" in update:
+        return parse_message(client, update["message"]), MessageHandler
+    if "callback_query" in update:
+        return parse_callback_query(client, update["callback_query"]), CallbackQueryHandler
+    return None
+
+
+async def dispatch(client, parsed, handler_type):
+    """Run the first matching handler of each group, as pyrogram's dispatcher does"""
+    for group in client.dispatcher.groups.values():
+        for handler in group:
+            if not isinstance(handler, handler_type):
+                continue
+            try:
+                if not await handler.check(client, parsed):
+                    continue
+            except Exception:
+                logger.exception("Filter of %s failed", handler.callback.__name__)
+                continue
+            try:
+                await handler.callback(client, parsed)
+            except StopPropagation:
+                return
+            except ContinuePropagation:
+                continue
+            except Exception:
+                logger.exception("Handler %s failed", handler.callback.__name__)
+            break
+
+
+class OfflineClient(Client):
+    """Client that logs outgoing calls instead of sending them to Telegram"""
+
+    _message_ids = itertools.count(1)
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        logger.debug("send_message %s: %s", chat_id, text.splitlines()[0] if text else "")
+        return self._sent(chat_id, next(self._message_ids), text, reply_markup)
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        logger.debug("edit_message_text %s/%s: %s", chat_id, message_id, text.splitlines()[0] if text else "")
+        return self._sent(chat_id, message_id, text, reply_markup)
+
+    async def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        logger.debug("answer_callback_query %s: %s", callback_query_id, text)
+        return True
+
+    def _sent(self, chat_id, message_id, text, reply_markup):
+        return types.Message(
+            client=self,
+            id=message_id,
+            chat=types.Chat(client=self, id=chat_id, type=enums.ChatType.PRIVATE),
+            date=datetime.datetime.now(),
+            text=text,
+            reply_markup=reply_markup,
+        )
+
+    async def start(self):
+        self.me = types.User(id=0, is_bot=True, first_name="offline", username="offline_bot")
+        self.load_plugins()
+        # Plugin handlers are registered by tasks, let them run
+        await asyncio.sleep(0)
+        return self
+
+    async def stop(self, block=True):
+        return self
+
+
+# Worker processes
+
+def run_writer(write_requests, write_responses):
+    """Entry point of the writer process"""
+    # Stopped by the parent once every worker has flushed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from database import serve_writes
+
+    serve_writes(write_requests, write_responses)
+
+
+def run_worker(index, workers, updates, write_requests, write_responses, users_generation, offline):
+    """Entry point of a worker process"""
+    # Stopped by the parent through its update queue, after in-flight updates
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+    from main import bot_config, plugins, proxy
+
+    client_class = OfflineClient if offline else Client
+    client = client_class(
+        name=f"grammer_bot_worker{index}",
+        api_id=bot_config.api_id,
+        api_hash=bot_config.api_hash,
+        bot_token=bot_config.token,
+        plugins=plugins,
+        proxy=proxy,
+        # Updates arrive through the webhook only
+        no_updates=True,
+    )
+    client.run(_serve_worker(client, index, workers, updates, write_requests, write_responses, users_generation,
+                             bot_config))
+
+
+async def _serve_worker(client, index, workers, updates, write_requests, write_responses, users_generation,
+                        bot_config):
+    from answer_buffer import answer_buffer
+    from archive import archive
+    from database import executor, known_users, RemoteWriter
+    from leaderboard import leaderboard
+    from metrics import metrics
+    from outbound import outbound
+    from plugins.quiz_handler import restore_sessions, question_banks
+    from retention import retention_job, RetentionPolicy
+    from session_store import session_store
+    from timer_wheel import timer_wheel
+
+    executor.remote_writer = RemoteWriter(write_requests, write_responses, index)
+    executor.remote_writer.start()
+    # A cleanup in any worker invalidates the user row ids cached by all of them
+    known_users.share(users_generation)
+    await client.start()
+    answer_buffer.start()
+    session_store.start()
+    await question_banks.load()
+    question_banks.start()
+    archive.directory = bot_config.archive_dir
+    retention_job.policy = RetentionPolicy.from_config(bot_config)
+    # Maintenance runs once, not once per worker
+    if index == 0:
+        await archive.recover()
+        retention_job.start()
+    await leaderboard.reload()
+    # Long-lived tasks start here, so they don't inherit a handler's metrics label
+    timer_wheel.start()
+    # Workers send as the same bot, together they stay within its global rate
+    outbound.share(workers)
+    outbound.start()
+    # One file per worker, each process only sees its own handlers
+    metrics.path = f"{bot_config.metrics_file}.worker{index}" if bot_config.metrics_file else None
+    metrics.export_interval = bot_config.metrics_interval
+    metrics.start(client)
+    restored = await restore_sessions(client, owns=lambda user_id: route(user_id, workers) == index)
+    logger.info("Restored %d active quiz sessions", restored)
+    reload_task = asyncio.create_task(_reload_leaderboard())
+
+    loop = asyncio.get_running_loop()
+    # Latest update task of each user; a user's updates run in arrival order,
+    # different users run concurrently
+    latest = {}
+    try:
+        while True:
+            update = await loop.run_in_executor(None, updates.get)
+            if update is None:
+                break
+            parsed = parse_update(client, update)
+            if parsed is None:
+                continue
+            user_id = update_user_id(update)
+            task = asyncio.create_task(_dispatch_after(latest.get(user_id), client, *parsed))
+            latest[user_id] = task
+            task.add_done_callback(functools.partial(_forget, latest, user_id))
+    finally:
+        reload_task.cancel()
+        await metrics.close()
+        if latest:
+            await asyncio.gather(*latest.values(), return_exceptions=True)
+        await retention_job.close()
+        await question_banks.close()
+        await timer_wheel.close()
+        # Never lose buffered answers on shutdown
+        await answer_buffer.close()
+        await session_store.close()
+        # Deliver queued messages while the client is still connected
+        await outbound.close()
+        await client.stop()
+        executor.shutdown()
+
+
+async def _dispatch_after(previous, client, parsed, handler_type):
+    if previous is not None:
+        await asyncio.wait([previous])
+    await dispatch(client, parsed, handler_type)
+
+
+def _forget(latest, user_id, task):
+    if latest.get(user_id) is task:
+        del latest[user_id]
+
+
+async def _reload_leaderboard():
+    from leaderboard import leaderboard
+
+    while True:
+        await asyncio.sleep(LEADERBOARD_RELOAD_INTERVAL)
+        try:
+            await leaderboard.reload()
+        except Exception:
+            logger.exception("Leaderboard reload failed")
+
+
+# HTTP front end
+
+class WebhookServer:
+    """Minimal HTTP/1.1 endpoint accepting one JSON update per POST"""
+
+    def __init__(self, queues, secret=None):
+        self.queues = queues
+        self.secret = secret
+        self.received = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method = request_line.split(b" ", 1)[0]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", "0"))
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, "Payload Too Large")
+                    break
+                body = await reader.readexactly(length)
+
+                status = self._accept(method, headers, body)
+                await self._respond(writer, *status)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def _accept(self, method, headers, body):
+        if method != b"POST":
+            return 405, "Method Not Allowed"
+        token = headers.get("x-telegram-bot-api-secret-token", "")
+        if self.secret and not hmac.compare_digest(token, self.secret):
+            return 401, "Unauthorized"
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return 400, "Bad Request"
+        self.queues[route(update_user_id(update), len(self.queues))].put(update)
+        self.received += 1
+        return 200, "OK"
+
+    async def _respond(self, writer, status, reason):
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n\r\n".encode())
+        await writer.drain()
+
+
+async def serve(host, port, queues, secret=None):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    webhook = WebhookServer(queues, secret)
+    server = await asyncio.start_server(webhook.handle, host, port)
+    logger.info("Listening for updates on http://%s:%d with %d workers", host, port, len(queues))
+    async with server:
+        await stop.wait()
+    logger.info("Stopping after %d updates", webhook.received)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"),
+                        help="expected X-Telegram-Bot-Api-Secret-Token header")
+    parser.add_argument("--offline", action="store_true", help="log outgoing Telegram calls instead of sending them")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    import models
+
+    # Schema checks and migrations run here, before any worker opens the database
+    models.create_tables()
+
+    context = multiprocessing.get_context("spawn")
+    write_requests = context.Queue()
+    write_responses = [context.Queue() for _ in range(args.workers)]
+    updates = [context.Queue() for _ in range(args.workers)]
+    users_generation = context.Value("q", 0)
+    writer = context.Process(target=run_writer, args=(write_requests, write_responses), name="db-writer")
+    writer.start()
+    workers = [
+        context.Process(
+            target=run_worker,
+            args=(index, args.workers, updates[index], write_requests, write_responses[index], users_generation,
+                  args.offline),
+            name=f"worker{index}",
+        )
+        for index in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        asyncio.run(serve(args.host, args.port, updates, args.secret))
+    finally:
+        # Workers flush their buffers through the writer, so it stops last
+        for queue in updates:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        write_requests.put(None)
+        writer.join()
+
+
+if __name__ == '__main__':
+    main()
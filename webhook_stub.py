@@ -0,0 +1,118 @@
+"""Stand-in for Telegram: POST synthetic Bot API updates to a local webhook.
+
+Each simulated user sends /start and /quiz, presses "Start Quiz", waits out
+the countdown and answers every question with a random option after some
+think time. Pair it with ``python webhook.py --offline``.
+
+    python webhook_stub.py [--users N] [--port PORT] [--think SECONDS]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from webhook import WEBHOOK_HOST, WEBHOOK_PORT
+
+# Countdown of the quiz plus a margin for the first question to be sent
+COUNTDOWN_WAIT = 4.5
+# Simulated users get ids from here on, clear of real Telegram ids in a test database
+FIRST_USER_ID = 9_000_000_000
+
+
+class StubTelegram:
+    """Builds updates for simulated users and POSTs them over keep-alive connections"""
+
+    def __init__(self, host, port, secret=None):
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.sent = 0
+        self.latencies = []
+
+    def message(self, user, text):
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "from": user,
+                "chat": {"id": user["id"], "type": "private", "first_name": user["first_name"]},
+                "date": int(time.time()),
+                "text": text,
+            },
+        }
+
+    def callback_query(self, user, data):
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": user,
+                "chat_instance": str(user["id"]),
+                "data": data,
+            },
+        }
+
+    async def post(self, connection, update):
+        reader, writer = connection
+        body = json.dumps(update).encode()
+        headers = f"POST / HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        if self.secret:
+            headers += f"X-Telegram-Bot-Api-Secret-Token: {self.secret}\r\n"
+        started = time.perf_counter()
+        writer.write(headers.encode() + b"\r\n" + body)
+        await writer.drain()
+        status = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        self.latencies.append(time.perf_counter() - started)
+        if b" 200 " not in status:
+            raise RuntimeError(f"Webhook answered {status.decode().strip()}")
+        self.sent += 1
+
+    async def play(self, user_id, questions, think):
+        user = {"id": user_id, "is_bot": False, "first_name": f"Stub{user_id - FIRST_USER_ID}", "username": None}
+        connection = await asyncio.open_connection(self.host, self.port)
+        try:
+            await self.post(connection, self.message(user, "/start"))
+            await self.post(connection, self.message(user, "/quiz"))
+            await asyncio.sleep(think)
+            await self.post(connection, self.callback_query(user, "start_quiz"))
+            await asyncio.sleep(COUNTDOWN_WAIT)
+            for index in range(questions):
+                await asyncio.sleep(random.uniform(0, 2 * think))
+                await self.post(connection, self.callback_query(user, f"answer_{index}_{random.randrange(4)}"))
+        finally:
+            connection[1].close()
+
+
+async def run(args):
+    stub = StubTelegram(args.host, args.port, args.secret)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        stub.play(FIRST_USER_ID + number, args.questions, args.think) for number in range(args.users)
+    ))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(stub.latencies)
+    print(f"{args.users} users, {stub.sent} updates in {elapsed:.1f}s, "
+          f"POST latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+          f"max {latencies[-1] * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--users", type=int, default=20, help="simulated users")
+    parser.add_argument("--questions", type=int, default=10, help="questions answered per quiz")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds before each answer")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()